@@ -0,0 +1,299 @@
+# The interesting lines of the #idlerpg logs, extracted once into a SQLite
+# file so that the scripts here can query them instead of each re-reading
+# and regex-matching the whole log every time they run.  Each event is one
+# row of the events table:
+#   log, line      which log (id in the logs table) and line (from 0) it is on
+#   epoch          when it happened
+#   type, kind     what happened, e.g. ('battle', 'hourly')
+#   actor, target  who did it and to whom; teams and quest participants are
+#                  comma separated lists
+#   actor_roll, actor_sum, target_roll, target_sum
+#                  the [roll/sum] pairs of battles
+#   result         'won' or 'lost', for battles and quests
+#   level          the level attained, or of the player coming online
+#   duration       seconds the event mentions (time to next level, time
+#                  added to or removed from a clock, time allowed a quest)
+# The logs table remembers how far into each log we have got, so refresh()
+# only reads what has been appended since; if the part already read changes
+# (the log was rotated or truncated) the log is read again from the start.
+#
+# Both the irssi ('YYYY-MM-DD HH:MM:SS') and older xchat ('Mon DD HH:MM:SS')
+# time stamps are understood; for the latter the year comes from the most
+# recent log opened/BEGIN LOGGING header.
+
+from collections import namedtuple
+import hashlib
+import os
+import re
+import sqlite3
+
+from timestamps import months, convert_stamp_to_epoch
+
+default_store = '/home/newren/irclogs/events.sqlite'
+
+columns = ('log', 'line', 'epoch', 'type', 'kind', 'actor', 'target',
+           'actor_roll', 'actor_sum', 'target_roll', 'target_sum', 'result',
+           'level', 'duration')
+Event = namedtuple('Event', columns)
+
+schema = '''
+  CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY,
+    filename TEXT UNIQUE,
+    offset INTEGER,
+    line INTEGER,
+    fingerprint TEXT,
+    year INTEGER,
+    month INTEGER,
+    last_type TEXT
+  );
+  CREATE TABLE IF NOT EXISTS events (
+    log INTEGER,
+    line INTEGER,
+    epoch REAL,
+    type TEXT,
+    kind TEXT,
+    actor TEXT,
+    target TEXT,
+    actor_roll INTEGER,
+    actor_sum INTEGER,
+    target_roll INTEGER,
+    target_sum INTEGER,
+    result TEXT,
+    level INTEGER,
+    duration INTEGER
+  );
+  CREATE INDEX IF NOT EXISTS events_by_type ON events (log, type, epoch);
+'''
+
+line_re = re.compile(r'(?P<stamp>[\d-]{10} [\d:]{8}|[A-Z][a-z]{2} [ \d]\d [\d:]{8})'
+                     r'(?:\s?<@?idlerpg>\s*(?P<message>.*)|'
+                     r'\s?(?:-!-|-->|<--|\*)\s*(?P<irc>.*))$')
+header_re = re.compile(r'(?:--- Log opened|--- Day changed|\*{4} BEGIN LOGGING AT)'
+                       r' \w{3} (?P<month>\w{3}) .*(?P<year>\d{4})$')
+irc_re = re.compile(r'(?P<actor>\S+) (?:(?:[\[(].*?[\])] )?has (?P<kind>joined|quit|left)|'
+                    r'is now known as (?P<target>\S+))')
+duration_re = re.compile(r'(\d+) days?, (\d{2}):(\d{2}):(\d{2})')
+names_re = re.compile(r',? and |, ')
+
+result_words = {'won': 'won', 'taken them in combat': 'won',
+                'lost': 'lost', 'been defeated in combat': 'lost'}
+
+# The messages from idlerpg we keep, checked in order; as in levelling.py
+# the keyword is a substring every match of the regex contains, so that
+# most lines only ever get matched against one regex.  Groups named after
+# columns fill those columns in (with 'actors'/'targets' being lists of
+# names), and any 'D days, HH:MM:SS' in the message becomes the duration.
+#   type, kind, keyword, regex
+event_types = [
+  ('battle', None, '] has c',
+   re.compile(r"(?P<actor>.*) \[(?P<actor_roll>\d+)/(?P<actor_sum>\d+)\] has (?P<kind>challenged|come upon) (?P<target>.*) \[(?P<target_roll>\d+)/(?P<target_sum>\d+)\](?: in combat)? and (?:has )?(?P<result>won|lost|taken them in combat|been defeated in combat)")),
+  ('team_battle', None, ' have team battled ',
+   re.compile(r"(?P<actors>.*?) \[(?P<actor_roll>\d+)/(?P<actor_sum>\d+)\] have team battled (?P<targets>.*?) \[(?P<target_roll>\d+)/(?P<target_sum>\d+)\] and (?P<result>won|lost)!")),
+  ('attained', None, 'has attained level',
+   re.compile(r"(?P<actor>.*), the .*, has attained level (?P<level>\d+)!")),
+  ('next_level', None, ' reaches ',
+   re.compile(r"(?P<actor>.*) reaches [Nn]ext level in")),
+  ('next_level', 'rank', ', is #',
+   re.compile(r"(?P<actor>.*?), the level .*, is #\d+! [Nn]ext level in")),
+  ('online', None, 'is now online from nickname',
+   re.compile(r"(?P<actor>.*), the level (?P<level>\d+) .*, is now online from nickname (?P<target>.*)\. [Nn]ext level in")),
+  ('online', 'new', "'s new player ",
+   re.compile(r"Welcome (?P<target>.*)'s new player (?P<actor>.*), the .*! [Nn]ext level in")),
+  ('quest_start', 'location', 'Participants must first reach',
+   re.compile(r"(?P<actors>.*) have been chosen by the gods to ")),
+  ('quest_start', 'time', 'Quest to end in',
+   re.compile(r"(?P<actors>.*) have been chosen by the gods to ")),
+  ('quest_end', 'location', 'completed their journey',
+   re.compile(r"(?P<actors>.*?) have completed their journey")),
+  ('quest_end', 'time', 'have blessed the realm',
+   re.compile(r"(?P<actors>.*?) have blessed the realm by completing their quest")),
+  ('quest_end', 'failed', 'prudence and self-regard',
+   re.compile(r".*prudence and self-regard has brought the wrath of the gods upon the realm")),
+  ('godsend', 'item', ' gains 10% effectiveness',
+   re.compile(r".*! (?P<actor>\w+)'s .* gains 10% effectiveness")),
+  ('godsend', 'time', 'wondrous godsend has accelerated',
+   re.compile(r"(?P<actor>\w+).*wondrous godsend has accelerated")),
+  ('calamity', 'item', ' loses 10% of its effectiveness',
+   re.compile(r".*! (?P<actor>\w+)'s .* loses 10% of its effectiveness")),
+  ('calamity', 'time', 'terrible calamity has slowed them',
+   re.compile(r"(?P<actor>\w+).*terrible calamity has slowed them")),
+  ('hog', 'help', 'hand of God carried ',
+   re.compile(r".*hand of God carried (?P<actor>\w+).*toward level")),
+  ('hog', 'smite', ' with fire, slowing',
+   re.compile(r"Thereupon.*consumed (?P<actor>\w+) with fire, slowing")),
+  ('alignment', None, 'has changed alignment to: ',
+   re.compile(r"(?P<actor>.*) has changed alignment to: (?P<kind>.*)\.$")),
+  ('alignment', 'stole', ' while they were sleeping! ',
+   re.compile(r"(?P<actor>.*) stole (?P<target>.*)'s level \d+ .* while they were sleeping!")),
+  ('alignment', 'steal_attempt', ' made to steal ',
+   re.compile(r"(?P<actor>.*) made to steal (?P<target>.*)'s .*, but realized")),
+  ('alignment', 'forsaken', ' is forsaken by their evil god. ',
+   re.compile(r"(?P<actor>.*?) is forsaken by their evil god\.")),
+  ('alignment', 'light_shining', ' have not let the iniquities of evil men',
+   re.compile(r"(?P<actors>.*? and .*?) have not let the iniquities of evil men")),
+]
+
+def split_names(names):
+  # 'a, b, and c' -> ['a', 'b', 'c']
+  return names_re.split(names)
+
+def log_fingerprint(filename, offset):
+  # Identify the part of a log already read (by the store here, or by
+  # levelling.py for its checkpoints) by its first and last few KB, so that
+  # we notice if the log is rotated or truncated.
+  with open(filename) as f:
+    head = f.read(min(offset, 4096))
+    f.seek(max(0, offset-4096))
+    tail = f.read(offset-f.tell())
+  return hashlib.sha1(head+tail).hexdigest()
+
+def parse_message(message):
+  # The (type, kind, {column: value}) of an idlerpg message, or None
+  for event_type, kind, keyword, regex in event_types:
+    if keyword not in message:
+      continue
+    m = regex.match(message)
+    if not m:
+      continue
+    values = dict((k, v) for k, v in m.groupdict().iteritems() if v is not None)
+    for group, column in (('actors', 'actor'), ('targets', 'target')):
+      if group in values:
+        values[column] = ','.join(split_names(values.pop(group)))
+    for column in ('actor_roll', 'actor_sum', 'target_roll', 'target_sum',
+                   'level'):
+      if column in values:
+        values[column] = int(values[column])
+    if 'result' in values:
+      values['result'] = result_words[values['result']]
+    elif event_type == 'quest_end':
+      values['result'] = 'lost' if kind == 'failed' else 'won'
+    d = duration_re.search(message)
+    if d:
+      days, hours, mins, secs = (int(x) for x in d.groups())
+      values['duration'] = ((days*24 + hours)*60 + mins)*60 + secs
+    return event_type, values.pop('kind', kind), values
+  return None
+
+class EventStore(object):
+  def __init__(self, filename=default_store):
+    self.db = sqlite3.connect(filename)
+    self.db.text_factory = str
+    self.db.executescript(schema)
+
+  def log_id(self, logfile):
+    row = self.db.execute('SELECT id FROM logs WHERE filename = ?',
+                          (os.path.abspath(logfile),)).fetchone()
+    return row[0] if row else None
+
+  def refresh(self, logfile):
+    # Extract the events from whatever has been added to logfile since we
+    # last looked at it, returning how many there were
+    filename = os.path.abspath(logfile)
+    db = self.db
+    row = db.execute('SELECT id, offset, line, fingerprint, year, month, '
+                     'last_type FROM logs WHERE filename = ?',
+                     (filename,)).fetchone()
+    if row is None:
+      db.execute('INSERT INTO logs (filename) VALUES (?)', (filename,))
+      row = (self.log_id(filename), 0, 0, None, None, None, None)
+    log, offset, line_no, fingerprint, year, month, last_type = row
+    size = os.path.getsize(filename)
+    if offset and (size < offset or
+                   log_fingerprint(filename, offset) != fingerprint):
+      db.execute('DELETE FROM events WHERE log = ?', (log,))
+      offset, line_no, year, month, last_type = 0, 0, None, None, None
+
+    rows = []
+    with open(filename) as f:
+      f.seek(offset)
+      while True:
+        line = f.readline()
+        # Leave a partly written last line for next time
+        if not line.endswith('\n'):
+          break
+        offset += len(line)
+        line_no += 1
+        m = line_re.match(line.rstrip('\r\n'))
+        if not m:
+          m = header_re.match(line.rstrip('\r\n'))
+          if m:
+            year, month = int(m.group('year')), months[m.group('month')]
+          continue
+        stamp = m.group('stamp')
+        if stamp[4] != '-':
+          # There's no telling what year lines before the first header
+          # are from, so they're left out
+          if year is None:
+            continue
+          # Rolled over into a new year since the last header
+          if month and months[stamp[0:3]] < month:
+            year += 1
+          month = months[stamp[0:3]]
+        if m.group('message') is not None:
+          event = parse_message(m.group('message'))
+          if event is None:
+            last_type = None
+            continue
+          event_type, kind, values = event
+          # A challenge straight after a level up is the level up's
+          # battle, not the hourly one.
+          if event_type == 'battle':
+            if kind == 'come upon':
+              kind = 'collision'
+            else:
+              kind = 'levelup' if last_type == 'attained' else 'hourly'
+          last_type = event_type
+        else:
+          i = irc_re.match(m.group('irc'))
+          if not i:
+            continue
+          values = i.groupdict()
+          event_type = 'nick' if values['target'] else 'irc'
+          kind = values.pop('kind')
+        values.update(log=log, line=line_no-1,
+                      epoch=convert_stamp_to_epoch(stamp, year),
+                      type=event_type, kind=kind)
+        rows.append(tuple(values.get(c) for c in columns))
+
+    db.executemany('INSERT INTO events VALUES ({})'.format(
+                     ', '.join('?'*len(columns))), rows)
+    db.execute('UPDATE logs SET offset = ?, line = ?, fingerprint = ?, '
+               'year = ?, month = ?, last_type = ? WHERE id = ?',
+               (offset, line_no, log_fingerprint(filename, offset), year,
+                month, last_type, log))
+    db.commit()
+    return len(rows)
+
+  def select(self, logfile, event_type=None, since=None, until=None, **where):
+    # The Events of logfile, in order, optionally only those of the given
+    # type (or tuple of types), in [since, until), and with the given column
+    # values
+    conditions = ['log = ?']
+    params = [self.log_id(logfile)]
+    if isinstance(event_type, tuple):
+      conditions.append('type IN ({})'.format(', '.join('?'*len(event_type))))
+      params.extend(event_type)
+    elif event_type is not None:
+      conditions.append('type = ?')
+      params.append(event_type)
+    if since is not None:
+      conditions.append('epoch >= ?')
+      params.append(since)
+    if until is not None:
+      conditions.append('epoch < ?')
+      params.append(until)
+    for column, value in sorted(where.iteritems()):
+      if column not in columns:
+        raise ValueError("No such column: {}".format(column))
+      conditions.append('{} = ?'.format(column))
+      params.append(value)
+    cursor = self.db.execute('SELECT * FROM events WHERE {} ORDER BY line'
+                             .format(' AND '.join(conditions)), params)
+    return [Event(*row) for row in cursor]
+
+def query(logfile, event_type=None, store=default_store, **where):
+  # Bring the store up to date with logfile and select from it
+  events = EventStore(store)
+  events.refresh(logfile)
+  return events.select(logfile, event_type, **where)
@@ -1,128 +1,165 @@
 #!/usr/bin/env python
 
-import itertools
-import operator
 import re
-import subprocess
-
-def rand48(seed, ntimes=1):
-  a, m = 0x5DEECE66D, 2**48
-  for i in xrange(ntimes):
-    seed = int((a*seed+0xB)%m)
-  return seed
-def rand48inv(seed, ntimes=1):
-  ainv, m = 246154705703781, 2**48
-  for i in xrange(ntimes):
-    seed = int(ainv*(seed-0xB)%m)
-  return seed
-def fl(seed):
-  return (seed+0.0)/2**48
+import sys
+
+import numpy
+
+import events
+import rand48
+from timestamps import convert_log_time_to_epoch
 
 solved_seed = 112858162602330
 solved_time = '2015-04-18 21:56:39'
 solved_num_players = 13
+# solved_seed is the one for the solved battle's attacker roll, so its
+# defender roll (what every other battle is counted by) is one call later
+solved_count = 1
 
-def rand(count, mult):
-  change = count-rand.current_count
-  if change<0:
-    rand.seed = rand48inv(rand.seed, -change)
-  else:
-    rand.seed = rand48(rand.seed, change)
-  rand.current_count = count
-  return fl(rand.seed)*mult
+annotation_file = 'idlerpg-seeds.txt'
+
+# There are 1200 self_clock cycles of 6+6*#online rand() calls between hourly
+# battles, plus whatever events and collisions add (or location quests take
+# away, up to 12 a cycle).  We first look just past where the next battle
+# ought to be, and only if that fails do we look a couple of players' worth
+# of calls either side.
+hourly_calls = 7200
+narrow_slack = 256
+wide_slack = 2*hourly_calls
+max_hours_lost = 72
 
-rand.seed = solved_seed
-rand.current_count = 0
+def matching_counts(lo, hi, rolls):
+  # All counts x in [lo, hi) where rand(x, asum) and rand(x+1, dsum) give
+  # the attacker and defender rolls; the window is checked all at once
+  # rather than one rand() call at a time.
+  aroll, asum, droll, dsum = rolls
+  seeds = rand48.stream(rand48.jump(solved_seed, lo-1), hi-lo+1)
+  fractions = seeds.astype(numpy.float64)/rand48.m
+  hits = ((numpy.floor(fractions[:-1]*asum) == aroll) &
+          (numpy.floor(fractions[1:]*dsum) == droll))
+  return [lo+int(x) for x in numpy.flatnonzero(hits)]
 
-seed = {}
-output = subprocess.check_output(['grep', '-A999999', 'BEGIN.LOGGING.*Wed Apr  1',
-                          '/home/newren/.xchat2/xchatlogs/Palantir-#idlerpg.log'])
-all_lines = output.splitlines()
+logfile = '/home/newren/.xchat2/xchatlogs/Palantir-#idlerpg.log'
+store = events.EventStore()
+store.refresh(logfile)
 
+# We still need every line of the log to write out the annotated copy, but
+# which of them matter comes from the event store.
+with open(logfile) as f:
+  log_lines = f.read().splitlines()
+first = next(idx for idx, line in enumerate(log_lines)
+             if re.search('BEGIN.LOGGING.*Wed Apr  1', line))
+all_lines = log_lines[first:]
 
-solved_idx = None
 user_count_changes = [0]*len(all_lines)
-for idx,line in enumerate(all_lines):
-  if line.startswith(solved_time):
-    solved_idx = idx
-  if 'has joined' in line:
-    user_count_changes[idx] = 1
-  elif 'has quit' in line:
-    user_count_changes[idx] = -1
-
-def advance_seed(line, cur_players, direction=1):
-  global last_count
-  print "Called advance_seed with {}, {}".format(cur_players, direction)+line
-  assert cur_players > 0
-  possible_seeds = []
-  m = re.match(r"(?P<attacker>.*) \[(?P<attacker_roll>\d+)/(?P<attacker_sum>\d+)\] has challenged (?P<defender>.*) \[(?P<defender_roll>\d+)/(?P<defender_sum>\d+)\]", line)
-  if not m:
-    return
-
-  attacker, aroll, asum, defender, droll, dsum = m.groups()
-  aroll, asum, droll, dsum = int(aroll), int(asum), int(droll), int(dsum)
-  for x in xrange(last_count+(cur_players-2)*7200-(cur_players*3),
-                  last_count+(cur_players+2)*7200,
-                  direction):
-    if int(rand(x+1, dsum)) == droll and int(rand(x, asum)) == aroll:
-      possible_seeds.append((rand.seed, rand.current_count))
-
-  found_seed = (len(possible_seeds) == 1)
-  if not found_seed:
-    if possible_seeds == [(281054668518238, 5531492), (281074565486939, 5541999)]:
-      bla = possible_seeds.pop(0)
-      print possible_seeds
-      found_seed = True
-    if possible_seeds == [(21299609081788, 9585114), (21432503642072, 9591670)]:
-      bla = possible_seeds.pop(0)
-      print possible_seeds
-      found_seed = True
-  if not found_seed:
-    last = 0
-    if len(possible_seeds) > 1:
-      for key,value in sorted(seed.iteritems(), key=lambda x:x[1][1]):
-        print value[1]-last, value, key
-        last = value[1]
-      print len(possible_seeds)
-      if len(possible_seeds) > 0:
-        print possible_seeds
-      print last_count
-      print [last_count+(0+cur_players)*7200, last_count+(2+cur_players)*7200]
-      raise SystemExit("Failed to find {} solution with {} players: {}".format("unique" if len(possible_seeds) else "a", cur_players, line))
-    else:
-      for x in itertools.count(last_count+(cur_players+2)*7200, direction):
-        if int(rand(x+1, dsum)) == droll and int(rand(x, asum)) == aroll:
-          solution = (rand.seed, rand.current_count)
-          seed[line] = solution
-          relative_range = (x-last_count)/7200.0 - cur_players
-          last_count = rand.current_count
-          break
-      import sys
-      sys.stderr.write("Failed to find {} solution with {} players; went ahead by {}: {}\n".format("unique" if len(possible_seeds) else "a", cur_players, relative_range, line))
-  else:
-    seed[line] = possible_seeds[0]
-    last_count = seed[line][1]
+for event in store.select(logfile, 'irc'):
+  if event.line >= first and event.kind != 'left':
+    user_count_changes[event.line-first] = 1 if event.kind == 'joined' else -1
+
+solved_epoch = convert_log_time_to_epoch(solved_time)
+solved_idx = store.select(logfile, 'battle', since=solved_epoch,
+                          until=solved_epoch+1, kind='hourly')[0].line - first
 
-last_count = 0
-cur_players = solved_num_players
+# Number of players at each line, counting out from the solved one
+num_players = [0]*len(all_lines)
+num_players[solved_idx] = solved_num_players
 for x in xrange(solved_idx+1, len(all_lines)):
-  line = all_lines[x]
-  cur_players += user_count_changes[idx]
-  if 'has attained' not in all_lines[x-1]:
-    advance_seed(line, cur_players, 1)
-last_count = 0
-cur_players = solved_num_players
-for x in xrange(solved_idx-1, 0, -1):
-  line = all_lines[x]
-  cur_players += user_count_changes[idx]
-  if 'has attained' not in all_lines[x-1]:
-    advance_seed(line, cur_players, -1)
-  
-for line in all_lines:
-  if line in seed:
-    randseed, randcount = seed[line]
-    print "{:15d} {:9d} {:6d} {}".format(randseed, randcount,
-                                         randcount-last_count, line)
-    last_count = randcount
+  num_players[x] = num_players[x-1] + user_count_changes[x]
+for x in xrange(solved_idx-1, -1, -1):
+  num_players[x] = num_players[x+1] - user_count_changes[x+1]
+
+hourly = [(event.line-first, (event.actor_roll, event.actor_sum,
+                               event.target_roll, event.target_sum))
+          for event in store.select(logfile, 'battle', kind='hourly')
+          if event.line >= first]
+
+def hourly_battles(direction):
+  # (index, rolls, number of players) for each hourly battle after (or before)
+  # the solved one, nearest first
+  battles = [(idx, rolls, num_players[idx]) for idx, rolls in hourly
+             if (idx-solved_idx)*direction > 0]
+  return battles if direction > 0 else battles[::-1]
+
+def candidates(anchor, distance, slack_below, slack_above, rolls, direction):
+  # Counts of the defender roll for a battle roughly distance calls from
+  # anchor, nearest to where we expect it first
+  expected = anchor + direction*distance
+  if direction > 0:
+    lo, hi = expected-slack_below, expected+slack_above
   else:
-    print " "*33+line
+    lo, hi = expected-slack_above, expected+slack_below
+  found = [x+1 for x in matching_counts(lo-1, hi, rolls)]
+  return sorted(found, key=lambda count: abs(count-expected))
+
+def track(battles, direction):
+  # Carry the solved seed from battle to battle, returning {index: count}.
+  # Each battle is looked for just past where it should be; failing that, in
+  # a much wider window, where any candidate must also lead to the next
+  # battle being no further past where it should be.  When a battle can't be
+  # found at all we lose sync: we keep the last battle we are sure of as the
+  # anchor, and keep widening the windows for the following battles until
+  # we get a confirmed match again.  If a re-anchored battle is a whole
+  # number of players' worth of calls off, our count of players is wrong, so
+  # we correct it from then on.
+  counts = {}
+  anchor = solved_count
+  distance = 0
+  hours = 0
+  miscount = 0
+  for i, (idx, rolls, players) in enumerate(battles):
+    players += miscount
+    distance += hourly_calls*(1+players)
+    hours += 1
+    found = candidates(anchor, distance, 0, narrow_slack*hours,
+                       rolls, direction)
+    if not found:
+      found = candidates(anchor, distance, wide_slack*hours+3*players,
+                         wide_slack*hours, rolls, direction)
+      if i+1 < len(battles):
+        next_idx, next_rolls, next_players = battles[i+1]
+        found = [count for count in found
+                 if candidates(count, hourly_calls*(1+next_players),
+                               wide_slack, narrow_slack, next_rolls,
+                               direction)]
+      if len(found) != 1:
+        sys.stderr.write("Lost sync ({} candidates, {} players, {} hours "
+                         "since last match): {}\n".format(
+                           len(found), players, hours, all_lines[idx]))
+        if hours >= max_hours_lost:
+          sys.stderr.write("Giving up after {} hours\n".format(hours))
+          break
+        continue
+      relative_range = float(abs(found[0]-anchor))/(hourly_calls*hours) - players
+      sys.stderr.write("Re-anchored with {} players; went ahead by {}: "
+                       "{}\n".format(players, relative_range, all_lines[idx]))
+      if hours == 1 and abs(relative_range-round(relative_range)) < 0.01:
+        miscount += int(round(relative_range)) - 1
+    counts[idx] = found[0]
+    anchor = found[0]
+    distance = 0
+    hours = 0
+  return counts
+
+forward = hourly_battles(1)
+backward = hourly_battles(-1)
+annotations = {solved_idx: solved_count}
+annotations.update(track(forward, 1))
+annotations.update(track(backward, -1))
+
+# One line out for each line in, prefixed by the line number and, for the
+# battles we found, the seed and rand() count at the defender roll and the
+# number of calls since the previous battle we found.
+last_count = None
+with open(annotation_file, 'w') as f:
+  for idx, line in enumerate(all_lines):
+    if idx in annotations:
+      randcount = annotations[idx]
+      randseed = rand48.jump(solved_seed, randcount)
+      delta = randcount-last_count if last_count is not None else 0
+      f.write("{:7d} {:15d} {:9d} {:6d} {}\n".format(idx, randseed, randcount,
+                                                     delta, line))
+      last_count = randcount
+    else:
+      f.write("{:7d} {}{}\n".format(idx, " "*33, line))
+sys.stderr.write("Found {} of {} hourly battles; wrote {}\n".format(
+  len(annotations), len(forward)+len(backward)+1, annotation_file))
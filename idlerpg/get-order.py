@@ -1,22 +1,18 @@
 #!/usr/bin/env python
 
 from collections import defaultdict
-import re
-import subprocess
 
-#output = subprocess.check_output(['grep', '-A999999', 'BEGIN.LOGGING.*Wed Apr  1',
-#                          '/home/newren/.xchat2/xchatlogs/Palantir-#idlerpg.log'])
-output = subprocess.check_output(['cat',
-                          '/home/newren/irclogs/Palantir/#idlerpg.log'])
+import events
+
+#logfile = '/home/newren/.xchat2/xchatlogs/Palantir-#idlerpg.log'
+logfile = '/home/newren/irclogs/Palantir/#idlerpg.log'
 groups = []
 everyone = set()
-for line in output.splitlines():
-  m = re.match(".*<@idlerpg>\s*(.*) have been chosen", line)
-  if m:
-    participants = re.split(', (?:and )?', m.group(1))
-    groups.append(participants)
-    for who in participants:
-      everyone.add(who)
+for event in events.query(logfile, 'quest_start'):
+  participants = event.actor.split(',')
+  groups.append(participants)
+  for who in participants:
+    everyone.add(who)
 
 order = []
 folks_left = set([x for x in everyone])
@@ -9,14 +9,18 @@ import sys
 import time
 from collections import Counter
 import multiprocessing
+import numpy
+
+import rand48
+from timestamps import convert_to_epoch, convert_log_time_to_epoch
 
 class Random:
   eps = sys.float_info.epsilon
-  a = 0x5DEECE66D
-  c = 0xB
-  m = 2**48
+  a = rand48.a
+  c = rand48.c
+  m = rand48.m
   seed = None
-  apower_cache = {}
+  jump_table = None
 
   @staticmethod
   def calculate_interval(r,p):
@@ -24,149 +28,339 @@ class Random:
     return [int(math.ceil( (r+0.0)*m/p*(1-5*eps))),
             int(math.floor((r+1.0)*m/p*(1+5*eps)))]
 
+  @staticmethod
+  def slow_stride(step, count):
+    # Find a stride e such that stepping e terms at a time through the
+    # progression (v + k*step) % m moves by only a small signed drift, small
+    # enough that count/e terms taken e apart cover less than m in total.
+    # Candidates come from the continued fraction convergents of step/m,
+    # which Euclid's algorithm hands us along with their residues.
+    m = Random.m
+    prev_r, prev_q, r, q = m, 0, step, 1
+    while True:
+      e, drift = abs(q), (r if q > 0 else -r)
+      if r == 0 or e >= count or ((count+e-1)//e - 1)*abs(drift) < m:
+        return min(e, count), drift
+      f = prev_r // r
+      prev_r, prev_q, r, q = r, q, prev_r-f*r, prev_q-f*q
+
+  @staticmethod
+  def ap_hits(values, step, counts, interval):
+    # For each arithmetic progression (values[i] + k*step) % m, k < counts[i],
+    # find which terms land in interval, as sub-progressions: terms
+    # offsets[j] + t*stride for t < hit_counts[j] of progression which[j].
+    # Split each progression into residue classes mod the slow_stride e;
+    # within a class consecutive terms differ by a small drift, so the
+    # class crosses a multiple of m at most once and the terms in interval
+    # are one or two solutions of a linear inequality.
+    m = Random.m
+    lo, hi = interval[0], min(interval[1], m-1)
+    empty = numpy.zeros(0, dtype=numpy.int64)
+    if lo > hi or len(values) == 0:
+      return empty, empty, 1, empty
+    e, drift = Random.slow_stride(step, int(counts.max()))
+
+    # One row per (progression, residue class)
+    classes = numpy.minimum(e, counts)
+    which = numpy.repeat(numpy.arange(len(values)), classes)
+    residue = numpy.arange(len(which)) - \
+              numpy.repeat(numpy.cumsum(classes)-classes, classes)
+    first = ((values[which] + residue.astype(numpy.uint64)*numpy.uint64(step))
+             & numpy.uint64(m-1)).astype(numpy.int64)
+    num_terms = (counts[which] - residue + e-1)//e
+
+    found = []
+    def ceildiv(x, y):
+      return -((-x)//y)
+    for wrap in ((0, 1) if drift > 0 else (0, -1) if drift < 0 else (0,)):
+      if drift > 0:
+        k_lo = ceildiv(lo + wrap*m - first, drift)
+        k_hi = (hi + wrap*m - first)//drift
+      elif drift < 0:
+        k_lo = ceildiv(first - hi - wrap*m, -drift)
+        k_hi = (first - lo - wrap*m)//-drift
+      else:
+        inside = (first >= lo) & (first <= hi)
+        k_lo = numpy.where(inside, 0, num_terms)
+        k_hi = num_terms-1
+      k_lo = numpy.maximum(k_lo, 0)
+      k_hi = numpy.minimum(k_hi, num_terms-1)
+      hit = (k_hi >= k_lo)
+      found.append((which[hit], residue[hit] + k_lo[hit]*e,
+                    k_hi[hit]-k_lo[hit]+1))
+    return (numpy.concatenate([x[0] for x in found]),
+            numpy.concatenate([x[1] for x in found]),
+            e,
+            numpy.concatenate([x[2] for x in found]))
+
   @staticmethod
   def initial_subinterval(r, p, intervals):
-    a,c,m,eps = Random.a, Random.c, Random.m, Random.eps
-    new_interval = Random.calculate_interval(r,p)
-    assert new_interval[1] - new_interval[0] > 2*a
-    for interval in intervals:
-      s=interval[0]
-      map2 = int((a*s+c)%m)
-      while s <= interval[1]:
-        if map2 < new_interval[0]:
-          s += 1+int(math.ceil((new_interval[0]  -map2)/a*(1-5*eps)))
-          map2 = int((a*s+c)%m)
-          assert map2-a < new_interval[0]
-          assert map2 > new_interval[0] and map2 < new_interval[1]
-        if map2 > new_interval[1]:
-          s += 1+int(math.ceil((new_interval[0]+m-map2)/a*(1-5*eps)))
-          if s > interval[1]:
-            return
-          map2 = int((a*s+c)%m)
-          assert map2-a < new_interval[0]
-          assert map2 > new_interval[0] and map2 < new_interval[1]
-        while map2 <= new_interval[1] and s<=interval[1]:
-          yield s, 1, ((s, 0), 1)
-          s += 1
-          map2 += a
+    # The seeds in intervals whose next roll also matches, as batches of
+    # (start, stride, count) ranges; see niter_batches
+    ranges = (numpy.array([interval[0] for interval in intervals], dtype=numpy.uint64),
+              1,
+              numpy.array([interval[1]-interval[0]+1 for interval in intervals]),
+              numpy.zeros((len(intervals), 1), dtype=numpy.int64))
+    keep = (ranges[2] > 0)
+    ranges = (ranges[0][keep], 1, ranges[2][keep], ranges[3][keep])
+    return Random.niter_matches(r, p, [ranges], 1, 1)
+
+  @staticmethod
+  def rand_count_windows(limiters):
+    # The range of rand() call counts (since the first limiter's roll) that
+    # each limiter after the second can be checked at
+    windows = []
+    lo = hi = 1
+    for kind, r, p, min_rands, num_to_do in limiters[2:]:
+      lo, hi = lo+min_rands, hi+min_rands+num_to_do-1
+      windows.append((lo, hi))
+    return windows
+
+  @staticmethod
+  def build_jump_table(limiters, shared=False):
+    planned, order = Random.plan_limiters(limiters)
+    Random.jump_table = rand48.JumpTable(Random.rand_count_windows(planned),
+                                         shared)
 
   @staticmethod
   def _calculate_an_rest(n):
-    if n in Random.apower_cache:
-      rest, an = Random.apower_cache[n]
-    else:
-      a,c,m = Random.a,Random.c,Random.m
-      try:
-        calced = max(x for x in Random.apower_cache.keys() if x < n)
-        rest, an = Random.apower_cache[calced]
-      except ValueError:
-        calced = 1
-        rest = c
-        an = a
-      for i in xrange(n-calced):
-        rest = int((a*rest+c)%m)
-        an = int((a*an)%m)
-      Random.apower_cache[n] = (rest, an)
-    return an, rest
+    if Random.jump_table:
+      return Random.jump_table.coefficients(n)
+    return rand48.jump_coefficients(n)
 
   @staticmethod
-  def niter_matches(r, p, values, min_rands, num_to_do):
+  def niter_batches(values, interval, min_rands, num_to_do, size=4096):
+    # Candidate seeds are handled as batches of arithmetic progressions:
+    # a uint64 array of starting seeds, a stride shared by the batch, an
+    # array of counts, and a parallel array of the rand() counts each
+    # limiter so far was matched at (one row per progression, one column
+    # per limiter).  Seeds in a progression step n rand() calls ahead to
+    # another progression, (A*start + C) + k*(A*stride), so ap_hits can find
+    # which ones roll within interval without visiting each seed.  uint64
+    # multiplication wraps modulo 2^64 and only the low 48 bits matter, so
+    # masking gives exact results.  Survivors are regrouped by stride into
+    # batches of up to size progressions.
     m = Random.m
-    interval = Random.calculate_interval(r,p)
-
-    # Work on a set of values at a time
-    nextvalues = list(itertools.islice(values, 512))
-    while nextvalues:
-      # Each item in the list is of the form (s, n, camefrom), we want to
-      # group these by same values of n to avoid recalculation of an & rest
-      for prev_n, grouped_values in itertools.groupby(nextvalues,
-                                                      operator.itemgetter(1)):
-        grouped_values = list(grouped_values) # need to iterate num_to_do times
-        # Determine the number, n, of rand rolls we are checking
+    low_bits = numpy.uint64(m-1)
+    found = {}
+    def flush(stride, minimum):
+      pieces = found.get(stride, [])
+      if sum(len(x[0]) for x in pieces) < minimum:
+        return
+      starts, counts, history = [numpy.concatenate([x[i] for x in pieces])
+                                 for i in xrange(3)]
+      del found[stride]
+      for i in xrange(0, len(starts), size):
+        yield starts[i:i+size], stride, counts[i:i+size], history[i:i+size]
+
+    for starts, stride, counts, history in values:
+      last_n = history[:,-1]
+      for prev_n in numpy.unique(last_n).tolist():
+        group = (last_n == prev_n)
+        group_starts, group_counts = starts[group], counts[group]
+        group_history = history[group]
         for n in xrange(prev_n + min_rands, prev_n + min_rands + num_to_do):
-          # Calculate (a^n % m) and (sum_i=0^n a^i*c)%m
           an, rest = Random._calculate_an_rest(n)
-          # Iterate over grouped values (guaranteed prevn == prev_n)
-          for s, prevn, camefrom in grouped_values:
-            # Check whether this value works
-            map2 = int((an*s+rest)%m)
-            if map2 >= interval[0] and map2 <= interval[1]:
-              yield s, n, (camefrom,n)
-      # Get the next set of values to work on
-      nextvalues = list(itertools.islice(values, 512))
+          rolls = (group_starts*numpy.uint64(an) + numpy.uint64(rest)) & low_bits
+          which, offsets, e, hit_counts = \
+            Random.ap_hits(rolls, an*stride % m, group_counts, interval)
+          if len(which) == 0:
+            continue
+          new_stride = stride*e if hit_counts.max() > 1 else 1
+          new_starts = group_starts[which] + \
+                       offsets.astype(numpy.uint64)*numpy.uint64(stride)
+          new_history = numpy.column_stack((group_history[which],
+                                            numpy.repeat(n, len(which))))
+          found.setdefault(new_stride, []).append((new_starts, hit_counts,
+                                                   new_history))
+          for batch in flush(new_stride, size):
+            yield batch
+    for stride in found.keys():
+      for batch in flush(stride, 0):
+        yield batch
+
+  @staticmethod
+  def niter_matches(r, p, values, min_rands, num_to_do):
+    interval = Random.calculate_interval(r,p)
+    return Random.niter_batches(values, interval, min_rands, num_to_do)
 
   @staticmethod
   def niter_constrained_less(r, p, values, min_rands, num_to_do):
-    # The ONLY difference between niter_matches and niter_constrained_less is:
-    #   * the if-condition check on the map2 value
-    m = Random.m
+    # The ONLY difference between niter_matches and niter_constrained_less is
+    # which values count; here it is those below the interval
     interval = Random.calculate_interval(r,p)
+    if interval[0] == 0:
+      return iter([])
+    return Random.niter_batches(values, [0, interval[0]-1],
+                                min_rands, num_to_do)
 
-    # Work on a set of values at a time
-    nextvalues = list(itertools.islice(values, 512))
-    while nextvalues:
-      # Each item in the list is of the form (s, n, camefrom), we want to
-      # group these by same values of n to avoid recalculation of an & rest
-      for prev_n, grouped_values in itertools.groupby(nextvalues,
-                                                      operator.itemgetter(1)):
-        grouped_values = list(grouped_values) # need to iterate num_to_do times
-        # Determine the number, n, of rand rolls we are checking
-        for n in xrange(prev_n + min_rands, prev_n + min_rands + num_to_do):
-          # Calculate (a^n % m) and (sum_i=0^n a^i*c)%m
-          an, rest = Random._calculate_an_rest(n)
-          # Iterate over grouped values (guaranteed prevn == prev_n)
-          for s, prevn, camefrom in grouped_values:
-            # Check whether this value works
-            map2 = int((an*s+rest)%m)
-            if map2 < interval[0]:
-              yield s, n, (camefrom,n)
-      # Get the next set of values to work on
-      nextvalues = list(itertools.islice(values, 512))
+  @staticmethod
+  def unbatched(values):
+    # Turn batches back into (s, n, camefrom) results, where camefrom nests
+    # the rand() counts matched at: (((s, 0), 1), n2), ...
+    for starts, stride, counts, history in values:
+      for start, count, matched in itertools.izip(starts.tolist(),
+                                                  counts.tolist(),
+                                                  history.tolist()):
+        for s in xrange(int(start), int(start)+count*stride, stride):
+          camefrom = s
+          for n in matched:
+            camefrom = (camefrom, n)
+          yield s, matched[-1], camefrom
+
+  @staticmethod
+  def selectivity(limiter):
+    # Rough fraction of candidates a limiter lets through per rand() count
+    kind, r, p, min_rands, num_to_do = limiter
+    return (r+0.0)/p if kind == 'less' else 1.0/p
+
+  @staticmethod
+  def plan_limiters(limiters):
+    # Reorder limiters so the most selective checks run first.  Each
+    # limiter's rand() count is relative to the one before it, so only
+    # limiters within a group -- one limiter plus the following ones that
+    # sit at a fixed offset from it (num_to_do == 1) -- can be shuffled.
+    # Within a group the most selective limiter takes over the group's
+    # window and the others are re-expressed as fixed (possibly negative)
+    # offsets from it, and the next group's offset is corrected to be
+    # relative to whichever limiter now ends the group.  The first two
+    # limiters define the initial interval and stay put.  Returns the
+    # planned limiters, and which original limiter each one is.
+    planned, order = [list(x) for x in limiters[0:2]], [0, 1]
+    lvl, carry = 2, 0
+    while lvl < len(limiters):
+      end = lvl+1
+      while end < len(limiters) and limiters[end][4] == 1:
+        end += 1
+      offset = {lvl: 0}  # rand() counts after the group's first limiter
+      for i in xrange(lvl+1, end):
+        offset[i] = offset[i-1] + limiters[i][3]
+      ranked = sorted(xrange(lvl, end),
+                      key=lambda i: Random.selectivity(limiters[i]))
+      prev = None
+      for i in ranked:
+        kind, r, p = limiters[i][0:3]
+        if prev is None:
+          planned.append([kind, r, p, limiters[lvl][3]+carry+offset[i],
+                          limiters[lvl][4]])
+        else:
+          planned.append([kind, r, p, offset[i]-offset[prev], 1])
+        order.append(i)
+        prev = i
+      carry = offset[end-1]-offset[prev]
+      lvl = end
+    return planned, order
+
+  @staticmethod
+  def estimate_survivors(limiters, interval):
+    # Expected number of candidates left after each (planned) limiter
+    estimates = [interval[1]-interval[0]+1.0]
+    estimates.append(estimates[0]*Random.selectivity(limiters[1]))
+    for limiter in limiters[2:]:
+      estimates.append(estimates[-1]*limiter[4]*Random.selectivity(limiter))
+    return estimates
+
+  @staticmethod
+  def print_plan(limiters, interval, survivors):
+    planned, order = Random.plan_limiters(limiters)
+    estimates = Random.estimate_survivors(planned, interval)
+    print >>sys.stderr, "Stage Limiter Check       Offset Window    Estimated       Actual"
+    for stage, (limiter, original) in enumerate(zip(planned, order)):
+      kind, r, p, min_rands, num_to_do = limiter
+      check = "{}{}/{}".format('<' if kind == 'less' else '=', r, p)
+      print >>sys.stderr, "{:5d} {:7d} {:11s} {:6d} {:6d} {:12.1f} {:12d}".format(
+        stage, original, check, min_rands, num_to_do,
+        estimates[stage], survivors[stage])
 
   @staticmethod
-  def compute_possibilities_helper(limiters, interval):
-    nextiter = Random.initial_subinterval(limiters[1][1],limiters[1][2],
-                                           [interval])
-    for lvl in xrange(2,len(limiters)):
-      if limiters[lvl][0] == 'equal':
-        nextiter = Random.niter_matches(limiters[lvl][1], limiters[lvl][2],
+  def counted(batches, survivors, stage):
+    for batch in batches:
+      survivors[stage] += int(batch[2].sum())
+      yield batch
+
+  @staticmethod
+  def compute_possibilities_helper(limiters, interval, survivors=None):
+    # Run the limiters (in planned order) over interval; if survivors is
+    # given, add the number of candidates left after each stage to it.
+    planned, order = Random.plan_limiters(limiters)
+    if survivors is None:
+      survivors = [0]*len(planned)
+    survivors[0] += interval[1]-interval[0]+1
+    nextiter = Random.initial_subinterval(planned[1][1],planned[1][2],
+                                          [interval])
+    nextiter = Random.counted(nextiter, survivors, 1)
+    for lvl in xrange(2,len(planned)):
+      if planned[lvl][0] == 'equal':
+        nextiter = Random.niter_matches(planned[lvl][1], planned[lvl][2],
                                         nextiter,
-                                        limiters[lvl][3], limiters[lvl][4])
-      elif limiters[lvl][0] == 'less':
+                                        planned[lvl][3], planned[lvl][4])
+      elif planned[lvl][0] == 'less':
         nextiter = Random.niter_constrained_less(
-                                        limiters[lvl][1], limiters[lvl][2],
+                                        planned[lvl][1], planned[lvl][2],
                                         nextiter,
-                                        limiters[lvl][3], limiters[lvl][4])
+                                        planned[lvl][3], planned[lvl][4])
       else:
-        raise SystemExit("Invalid limiter type: "+limiters[lvl][0])
-    return nextiter
+        raise SystemExit("Invalid limiter type: "+planned[lvl][0])
+      nextiter = Random.counted(nextiter, survivors, lvl)
+    # Put the matched rand() counts back in the original limiter order
+    columns = numpy.argsort(order)
+    nextiter = ((starts, stride, counts, history[:,columns])
+                for starts, stride, counts, history in nextiter)
+    return Random.unbatched(nextiter)
 
   @staticmethod
-  def compute_possibilities(limiters):
-    def execute_on_subinterval(limiters, subinterval, result_queue):
-      for result in Random.compute_possibilities_helper(limiters, subinterval):
-        result_queue.put(result)
+  def report_progress(done, total, elapsed):
+    eta = elapsed*(total-done)/done
+    sys.stderr.write("\r{}/{} chunks searched; {:.0f}s elapsed, about {:.0f}s "
+                     "left  ".format(done, total, elapsed, eta))
+    if done == total:
+      sys.stderr.write("\n")
 
+  @staticmethod
+  def compute_possibilities(limiters, processes=None, tasks_per_process=64,
+                            max_results=None, progress=None):
+    # Split the primary interval into many small chunks that a pool of
+    # worker processes pulls from as they finish their previous one, so an
+    # uneven chunk doesn't leave the other workers idle.  Each chunk's
+    # results come back together as soon as it is done and are yielded
+    # right away.  Stops early (killing the workers) after max_results
+    # results, or if the caller stops iterating.  progress(done, total,
+    # elapsed) is called after each chunk.  When done, prints how many
+    # candidates were expected and found after each limiter.
     assert limiters[0][0]=='equal' and limiters[0][3]==1 and limiters[0][4]==1
     assert limiters[1][0]=='equal' and limiters[1][3]==1 and limiters[1][4]==1
     primary = Random.calculate_interval(limiters[0][1],limiters[0][2])
-
-    np = multiprocessing.cpu_count()*3/4
-    per_proc_check = int(math.ceil((primary[1]-primary[0]+1.0)/np))
-
-    result_queue = multiprocessing.Queue()
-    procs = []
-    for i in xrange(np):
-      interval = [                primary[0]+(i+0)*per_proc_check,
-                  min(primary[1], primary[0]+(i+1)*per_proc_check-1)]
-      proc = multiprocessing.Process(target=execute_on_subinterval,
-                                     args=(limiters, interval, result_queue))
-      proc.start()
-      procs.append(proc)
-    for proc in procs:
-      proc.join()
-    result_queue.put('DONE')
-    return iter(result_queue.get, 'DONE')
+    # Build before forking, so all the workers share one table
+    Random.build_jump_table(limiters, shared=True)
+
+    if processes is None:
+      processes = max(1, multiprocessing.cpu_count()*3/4)
+    if progress is None:
+      progress = Random.report_progress
+    per_task = int(math.ceil((primary[1]-primary[0]+1.0)/
+                             (processes*tasks_per_process)))
+    jobs = [(limiters, [start, min(primary[1], start+per_task-1)])
+            for start in xrange(primary[0], primary[1]+1, per_task)]
+
+    survivors = [0]*len(limiters)
+    pool = multiprocessing.Pool(processes)
+    try:
+      found = 0
+      start_time = time.time()
+      for done, (results, counts) in enumerate(
+                                 pool.imap_unordered(search_interval, jobs), 1):
+        progress(done, len(jobs), time.time()-start_time)
+        survivors = map(operator.add, survivors, counts)
+        if done == len(jobs):
+          Random.print_plan(limiters, primary, survivors)
+        for result in results:
+          yield result
+          found += 1
+          if found == max_results:
+            return
+    finally:
+      pool.terminate()
+      pool.join()
 
   @staticmethod
   def serial_compute_possibilities(limiters):
@@ -174,10 +368,11 @@ class Random:
     assert limiters[1][0]=='equal' and limiters[1][3]==1 and limiters[1][4]==1
 
     primary = Random.calculate_interval(limiters[0][1],limiters[0][2])
+    Random.build_jump_table(limiters)
     return Random.compute_possibilities_helper(limiters, primary)
 
   @staticmethod
-  def compute_possibilities_from_hourly_battles(num_players, rolls):
+  def compute_possibilities_from_hourly_battles(num_players, rolls, **options):
     hrc = 5 # hidden rand calls, such as from map collisions or mystery rolls
     assert(len(rolls)%2==0)
     limiters =     [['equal', rolls[0][0], rolls[0][1], 1, 1]]
@@ -187,32 +382,190 @@ class Random:
       limiters.append(['equal', rolls[lvl  ][0], rolls[lvl  ][1],
                                 7200*(1+num_players)+battle_rolls-1, 1+hrc])
       limiters.append(['equal', rolls[lvl+1][0], rolls[lvl+1][1], 1, 1])
-    return Random.compute_possibilities(limiters)
+    return Random.compute_possibilities(limiters, **options)
 
   def set_seed(self, seed):
     assert seed < self.m and seed > 0 and seed == int(seed)
     self.seed = seed
 
   def rand(self, value, ncalls = 1):
-    for i in xrange(ncalls):
-      self.seed = int((self.a*self.seed+self.c)%self.m)
+    self.seed = rand48.jump(self.seed, ncalls)
     return (self.seed*value+0.0)/self.m
 
   def drand48(self):
-    self.seed = int((self.a*self.seed+self.c)%self.m)
+    self.seed = rand48.jump(self.seed)
     return self.seed
 
-def calc_rand48(seed, ntimes):
-  for i in xrange(ntimes):
-    seed = int((Random.a*seed+Random.c)%Random.m)
-  return seed
-def count_hops(initial_seed, final_seed):
-  count = 1
-  v = Random()
-  v.set_seed(initial_seed)
-  while v.drand48() != final_seed:
-    count += 1
-  return count
+calc_rand48 = rand48.jump
+count_hops = rand48.count_hops
+
+def search_interval(job):
+  # Worker for Random.compute_possibilities
+  limiters, interval = job
+  survivors = [0]*len(limiters)
+  results = list(Random.compute_possibilities_helper(limiters, interval,
+                                                     survivors))
+  return results, survivors
+
+# Turning a stretch of channel log into limiters, using the rand() call
+# model from rand-calls.txt.  Between two hourly battles there are 1200
+# self_clock cycles of 6+6*#online rand() calls each (fewer during a
+# location quest, where questers only use 1 call per moveplayers step
+# instead of 2), plus the calls made by whatever events got logged in
+# between.  Events are given as (calls, slack): the number of calls we
+# know of, and how many more there might be that we can't see.
+log_line_re = re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})'
+                         r'(?:\s?<@?idlerpg>\s*(.*)|-!- (.*))$')
+battle_re = re.compile(r'(?P<attacker>.*) \[(?P<aroll>\d+)/(?P<asum>\d+)\] '
+                       r'has (?P<type>challenged|come upon) '
+                       r'(?P<defender>.*) \[(?P<droll>\d+)/(?P<dsum>\d+)\]'
+                       r'.* (?P<result>won|lost|taken them in combat)')
+event_calls = [
+  # godsend/calamity: 3, plus however many the time variants pick a
+  # message with (31 more in handle_original_case_a)
+  (re.compile(r'gains 10% effectiveness|loses 10% of its effectiveness'),
+   lambda m, online: (3, 0)),
+  (re.compile(r'wondrous godsend|terrible calamity'),
+   lambda m, online: (3, 31)),
+  (re.compile(r'hand of God carried|consumed \w+ with fire'),
+   lambda m, online: (3, 2)),
+  (re.compile(r'have team battled'),
+   lambda m, online: (2+max(0, online-6), 0)),
+  (re.compile(r'have been chosen by the gods.*(Quest to end in)?'),
+   lambda m, online: (max(0, online-4) + (1 if m.group(1) else 0), 0)),
+  (re.compile(r'have not let the iniquities of evil men'),
+   lambda m, online: (1, online)),
+  (re.compile(r'is forsaken by their evil god|stole .* while they were sleeping'),
+   lambda m, online: (3, 1)),
+  (re.compile(r'has attained level (\d+)'),  # find_item
+   lambda m, online: (3+int(1.5*int(m.group(1))), 7)),
+]
+location_quest_start_re = re.compile(r'Participants must first reach')
+location_quest_end_re = re.compile(r'completed their journey|'
+                                   r'prudence and self-regard has brought')
+online_re = re.compile(r"(?:(?P<who>.*), the level .*, is now online from "
+                       r"nickname (?P<nick>.*)\. |Welcome (?P<nick2>.*)'s new "
+                       r"player (?P<who2>.*), the )")
+irc_re = re.compile(r'(?P<nick>\S+) (?:\[.*\] has (?P<what>quit|left)|'
+                    r'is now known as (?P<newnick>\S+))')
+
+def read_channel_log(filename, since, until):
+  # Returns the number of players online at since, and the lines after that
+  # up to until, as (epoch, idlerpg message or None, number online).  Who is
+  # online is tracked from the start of the log, by login messages and by
+  # their nick quitting or leaving.
+  since = convert_to_epoch(since)
+  until = convert_to_epoch(until)
+  online = {}  # nick -> player
+  lines = []
+  online_at_start = None
+  with open(filename) as f:
+    for line in f:
+      m = log_line_re.match(line.rstrip('\n'))
+      if not m:
+        continue
+      epoch = convert_log_time_to_epoch(m.group(1))
+      if epoch > until:
+        break
+      if epoch >= since and online_at_start is None:
+        online_at_start = len(online)
+      message, irc_event = m.group(2), m.group(3)
+      if message:
+        login = online_re.match(message)
+        if login:
+          nick = login.group('nick') or login.group('nick2')
+          online[nick] = login.group('who') or login.group('who2')
+        # Anyone fighting must be online, even if they logged in before the
+        # log starts; guess that their nick matches their character name.
+        battle = battle_re.match(message)
+        if battle:
+          for who in battle.group('attacker', 'defender'):
+            if who not in online.values() and who != 'idlerpg':
+              online[who] = who
+      elif irc_event:
+        change = irc_re.match(irc_event)
+        if not change or change.group('nick') not in online:
+          continue
+        if change.group('newnick'):
+          online[change.group('newnick')] = online.pop(change.group('nick'))
+        else:
+          del online[change.group('nick')]
+        message = None
+      if epoch >= since:
+        lines.append((epoch, message, len(online)))
+  if online_at_start is None:
+    online_at_start = len(online)
+  return online_at_start, lines
+
+def compile_limiters(online, lines, hrc=5, self_clock=3):
+  # Emit a limiter chain for the hourly battles in lines, as read by
+  # read_channel_log.  The first battle's rolls start the chain; each later
+  # battle's attacker roll comes after all the cycles and events since the
+  # previous one, and its defender roll right after.  Battles right after a
+  # level up are the level up challenge, not the hourly one.
+  limiters = []
+  previous = None  # (epoch, rand calls left in that battle)
+  extra = slack = 0
+  cycle_calls = []  # (epoch, calls per cycle from then on)
+  location_quest = 0
+  last_message = ''
+  for epoch, message, now_online in lines:
+    if message is None:
+      online = now_online
+      cycle_calls.append((epoch, 6+6*online-location_quest))
+      continue
+    battle = battle_re.match(message)
+    levelup = (battle and 'has attained level' in last_message)
+    if battle and battle.group('type') == 'challenged' and not levelup:
+      won = (battle.group('result') == 'won')
+      if previous is None:
+        limiters.append(['equal', int(battle.group('aroll')),
+                         int(battle.group('asum')), 1, 1])
+      else:
+        # Add up the calls in the 1200 cycles since the last battle
+        then, left_over = previous
+        calls, cycle, rate = 0, 0, cycle_calls[0][1]
+        for when, new_rate in cycle_calls[1:]:
+          change = min(1200, max(cycle, int(round((when-then)/self_clock))))
+          calls += (change-cycle)*rate
+          cycle, rate = change, new_rate
+        calls += (1200-cycle)*rate
+        limiters.append(['equal', int(battle.group('aroll')),
+                         int(battle.group('asum')),
+                         calls+left_over+extra, 1+hrc+slack])
+      limiters.append(['equal', int(battle.group('droll')),
+                       int(battle.group('dsum')), 1, 1])
+      previous = (epoch, 7-1 if won else 5-1)
+      extra = slack = 0
+      cycle_calls = [(epoch, 6+6*online-location_quest)]
+    elif battle:
+      # Grid collision or level up challenge
+      won = (battle.group('result') != 'lost')
+      extra += (4 if levelup else 2) + (2 if won else 0)
+      slack += 1
+    else:
+      for regex, calls in event_calls:
+        m = regex.search(message)
+        if m:
+          known, unknown = calls(m, online)
+          extra += known
+          slack += unknown
+      if location_quest_start_re.search(message):
+        location_quest = 12
+        cycle_calls.append((epoch, 6+6*online-location_quest))
+      elif location_quest_end_re.search(message) and location_quest:
+        location_quest = 0
+        cycle_calls.append((epoch, 6+6*online-location_quest))
+    last_message = message
+  return limiters
+
+def solve_log_window(filename, since, until, **options):
+  online, lines = read_channel_log(filename, since, until)
+  limiters = compile_limiters(online, lines)
+  print >>sys.stderr, "Limiters from the log, with {} online:".format(online)
+  for limiter in limiters:
+    print >>sys.stderr, "  {}".format(limiter)
+  return Random.compute_possibilities(limiters, **options)
 
 def calculate_with_known_quantities():
   randcounts=[224491502306380,126166889533354,265930535560594,277450753605568]
@@ -427,11 +780,19 @@ def handle_beginning_after_reset():
   print(list(Random.compute_possibilities_from_hourly_battles(11, rolls)))
   # Answer: [(25696289847270, 259220, ((((((((25696289847270, 0), 1), 86406), 86407), 172812), 172813), 259219), 259220))]
 
+def handle_log_window():
+  # Same battles as the end of handle_beginning_after_reset, but with the
+  # limiters worked out from the log
+  print(list(solve_log_window('/home/newren/irclogs/Palantir/#idlerpg.log',
+                              '2015-07-08 22:48:00', '2015-07-09 01:49:00')))
+  # Answer: [(25696289847270, 259220, ((((((((25696289847270, 0), 1), 86406), 86407), 172812), 172813), 259219), 259220))]
+
 #handle_local_case_a()
 #handle_original_case_b()
 #handle_original_case_a()
 #handle_early_april_case()
 #handle_funny_case()
+#handle_log_window()
 handle_beginning_after_reset()
 raise SystemExit("Stopping here.")
 
@@ -1,7 +1,10 @@
 #!/bin/bash
 
 while true; do
-  if ( ./levelling.py | grep -o Participants:.* | grep -v elijah | grep -q Atychiphobe ); then
+  if ( ./levelling.py --format json | python -c '
+import json, sys
+questers = json.load(sys.stdin)[0]["questers"]
+sys.exit(not ("Atychiphobe" in questers and "elijah" not in questers))' ); then
     sleep $[ ( $RANDOM % 10800 ) + 3600 ]s
     ssh pt-scm-staging-01 pkill -TERM irssi
   fi
@@ -10,56 +10,92 @@
 #     come in giving me updated information.
 
 from datetime import datetime, timedelta
-from collections import defaultdict, deque, Counter
+from collections import defaultdict, deque, namedtuple, Counter
+from cStringIO import StringIO
 import argparse
+import array
+import cPickle
+import hashlib
+import heapq
+import itertools
 import math
+import mmap
 import operator
 import os
 import re
+import select
+import shlex
+import signal
+import socket
 import subprocess
 import sys
 import time
+import traceback
+
+from events import log_fingerprint
+from timestamps import (convert_to_epoch, convert_log_time_to_epoch,
+                        convert_header_time_to_epoch)
 
 current_time = time.time()  # Yeah, yeah, globals are bad.  *shrug*
 now = current_time
 
-def convert_to_epoch(timestring):
-  if ':' in timestring:
-    timetuple = datetime.strptime(timestring, '%Y-%m-%d %H:%M:%S').timetuple()
-  else:
-    timetuple = datetime.strptime(timestring, '%Y-%m-%d').timetuple()
-  return time.mktime(timetuple)
 def convert_to_duration(days, hours, mins, secs):
   return 86400*int(days) + 3600*int(hours) + 60*int(mins) + int(secs)
+nextlvl_re="[Nn]ext level in (?P<days>\d+) days?, (?P<hours>\d{2}):(?P<mins>\d{2}):(?P<secs>\d{2})"
+
+class Player(object):
+  # Everything we track about one character.  Using __slots__ keeps these
+  # small (there is one per character ever seen) and the attributes quick
+  # to get at; the running stats are arrays so that copy() can snapshot a
+  # player without going through them field by field.
+  __slots__ = ('level', 'timeleft', 'itemsum', 'alignment', 'online',
+               'stronline', 'last_logbreak_seen', 'online_since',
+               'attack_stats', 'quest_stats', 'total_time_stats',
+               'alignment_stats', 'gch_stats', 'item_info', 'item_stats',
+               'expected_ttls', 'burnrates')
+  stat_vectors = ('attack_stats', 'quest_stats', 'total_time_stats',
+                  'alignment_stats', 'gch_stats')
+  item_names = ("ring", "amulet", "charm", "weapon", "helm", "tunic",
+                "pair of gloves", "set of leggings", "shield", "pair of boots")
 
-def default_player():
-  return {'level':0, 'timeleft':0, 'itemsum':0, 'alignment':'neutral',
-          'online':None, 'stronline':'no', 'last_logbreak_seen':0,
-          'online_since':0,
-          'attack_stats':[0,0,0], 'quest_stats':[0,0,0],
-          'total_time_stats':[0,0,0], 'alignment_stats':[0,0,0],
-          'gch_stats':[0,0,0,0,0],
-          # item_info: godsend/calamity:   item_name, multiplier
-          #            levelling:          'level', None
-          #            no unhandled event: None, None
-          #            early parsing:      'ignore', None
-          'item_info':('ignore', None),
-          # item_stats[item] -> presumed level, confidence (percentage)
-          'item_stats':{"ring":(0,0),
-                        "amulet":(0,0),
-                        "charm":(0,0),
-                        "weapon":(0,0),
-                        "helm":(0,0),
-                        "tunic":(0,0),
-                        "pair of gloves":(0,0),
-                        "set of leggings":(0,0),
-                        "shield":(0,0),
-                        "pair of boots":(0,0)}
-         }
+  def __init__(self):
+    self.level = 0
+    self.timeleft = 0
+    self.itemsum = 0
+    self.alignment = 'neutral'
+    self.online = None
+    self.stronline = 'no'
+    self.last_logbreak_seen = 0
+    self.online_since = 0
+    # attack_stats and quest_stats: expected count, times eligible, count
+    self.attack_stats = array.array('d', [0,0,0])
+    self.quest_stats = array.array('d', [0,0,0])
+    self.total_time_stats = array.array('d', [0,0,0])
+    self.alignment_stats = array.array('l', [0,0,0])
+    self.gch_stats = array.array('l', [0,0,0,0,0])
+    # item_info: godsend/calamity:   item_name, multiplier
+    #            levelling:          'level', None
+    #            no unhandled event: None, None
+    #            early parsing:      'ignore', None
+    self.item_info = ('ignore', None)
+    # item_stats[item] -> presumed level, confidence (percentage)
+    self.item_stats = dict.fromkeys(Player.item_names, (0,0))
+    # Only set on copies recorded for comparisons
+    self.expected_ttls = None
+    self.burnrates = None
+
+  def copy(self):
+    other = Player.__new__(Player)
+    for attr in Player.__slots__:
+      setattr(other, attr, getattr(self, attr))
+    for attr in Player.stat_vectors:
+      setattr(other, attr, getattr(self, attr)[:])
+    other.item_stats = self.item_stats.copy()
+    return other
 
 class IdlerpgStats(defaultdict):
   def __init__(self):
-    super(IdlerpgStats, self).__init__(default_player)
+    super(IdlerpgStats, self).__init__(Player)
     self.player = {}  # ircnick -> who_string
     self.quest_started = None  # time_string or None
     self.quest_times = defaultdict(list) # quest_positions -> list of times
@@ -68,11 +104,50 @@ class IdlerpgStats(defaultdict):
     self.quest_positions = None
     self.questers = []
     self.next_quest = 0
+    self.logs = []  # (filename, translate_you) of each of the logfiles
     self.logfiles = []
     self.primary_log = None
     self.last_lines = []
     self.last_epoch_and_line = None
     self.levels = defaultdict(list)
+    self.last_leveller = None
+    # (epoch, rolls, won, cycle_calls) of the latest hourly battles, where
+    # cycle_calls is the average of realm_calls() over the time since the
+    # one before
+    self.hourly_battles = deque(maxlen=48)
+    # realm_calls() rand() calls per cycle, and when it last changed; and
+    # those calls times seconds, added up since the latest hourly battle
+    self.cycle_calls = (None, 0)
+    self.cycle_call_seconds = 0
+    self.line_counts = Counter()  # line type -> number of lines seen
+    self.checkpoint_file = None
+    self.snapshot_dir = None
+    self.next_snapshot = None  # epoch of the next daily snapshot to take
+    self.resumable = True  # Has state only come from parsing log lines?
+    # Burn rates and ttls depend on everyone's level, itemsum, alignment and
+    # online status (and the quest times seen); state_version is bumped
+    # whenever any of those change, and memo only holds values computed at
+    # memo_version.
+    self.state_version = 0
+    self.memo_version = 0
+    self.memo = {}
+
+  def __missing__(self, who):
+    # A new player is someone else for everyone to battle
+    self.state_changed()
+    return super(IdlerpgStats, self).__missing__(who)
+
+  def state_changed(self):
+    self.state_version += 1
+
+  def memoized(self, key, compute, *args):
+    # compute(*args), remembered under key until the state next changes
+    if self.memo_version != self.state_version:
+      self.memo.clear()
+      self.memo_version = self.state_version
+    if key not in self.memo:
+      self.memo[key] = compute(*args)
+    return self.memo[key]
 
   def handle_timeleft(self, m, epoch):
     who = m.group('who')
@@ -87,32 +162,56 @@ class IdlerpgStats(defaultdict):
     post_delta = convert_to_duration(days, hours, mins, secs)
     now_delta = (epoch+post_delta)-now
 
-    self[who]['timeleft'] = now_delta
+    self[who].timeleft = now_delta
     self.ensure_online(who, epoch)
 
   def adjust_total_time_by_alignment(self, who, epoch, increase):
     factor = 1 if increase else -1
-    index = {'good':0, 'neutral':1, 'evil':2}[self[who]['alignment']]
-    self[who]['total_time_stats'][index] += factor*(now-epoch)
+    index = {'good':0, 'neutral':1, 'evil':2}[self[who].alignment]
+    self[who].total_time_stats[index] += factor*(now-epoch)
 
   def ensure_offline(self, who, epoch, known_offline=True):
-    if self[who]['online']:
-      self[who]['timeleft'] += (now-epoch)
+    if self[who].online:
+      self[who].timeleft += (now-epoch)
       self.adjust_total_time_by_alignment(who, epoch, increase=False)
-    self[who]['online'] = (False if known_offline else None)
+    online = (False if known_offline else None)
+    if self[who].online is not online:
+      self[who].online = online
+      self.state_changed()
+      self.note_cycle_calls(epoch)
 
   def ensure_online(self, who, epoch):
-    if not self[who]['online']:
+    if not self[who].online:
       self.adjust_total_time_by_alignment(who, epoch, increase=True)
-    if self[who]['online'] == False or (
-       self[who]['online'] is None and self[who]['online_since'] == 0):
-      self[who]['online_since'] = epoch
-    self[who]['online'] = True
+    if self[who].online == False or (
+       self[who].online is None and self[who].online_since == 0):
+      self[who].online_since = epoch
+    if self[who].online is not True:
+      self[who].online = True
+      self.state_changed()
+      self.note_cycle_calls(epoch)
+
+  def note_cycle_calls(self, epoch):
+    # Who is online or on a location quest changed at epoch, and with it how
+    # many rand() calls each self_clock cycle makes
+    then, cycle_calls = self.cycle_calls
+    if then is not None:
+      self.cycle_call_seconds += (epoch-then)*cycle_calls
+    self.cycle_calls = (epoch, realm_calls(self)[3])
+
+  def record_hourly_battle(self, epoch, rolls, won):
+    self.note_cycle_calls(epoch)
+    if self.hourly_battles and epoch > self.hourly_battles[-1][0]:
+      cycle_calls = self.cycle_call_seconds/(epoch-self.hourly_battles[-1][0])
+    else:
+      cycle_calls = self.cycle_calls[1]
+    self.cycle_call_seconds = 0
+    self.hourly_battles.append((epoch, rolls, won, cycle_calls))
 
   def adjust_timeleft_percentage(self, who, post_epoch, percentage):
     then_diff = (now-post_epoch)
-    time_then_remaining = self[who]['timeleft'] + then_diff
-    self[who]['timeleft'] = (1-percentage/100.0)*time_then_remaining - then_diff
+    time_then_remaining = self[who].timeleft + then_diff
+    self[who].timeleft = (1-percentage/100.0)*time_then_remaining - then_diff
 
   @staticmethod
   def get_people_list(wholist):
@@ -140,14 +239,14 @@ class IdlerpgStats(defaultdict):
     # 10 hours.
     possibles = [x for x in self
                  if x in questers or (
-                    self[x]['online'] and self[x]['level'] >= 40 and
-                    self[x]['online_since'] < epoch-36000)]
+                    self[x].online and self[x].level >= 40 and
+                    self[x].online_since < epoch-36000)]
     # Record stats related to quests
     for x in possibles:
-      self[x]['quest_stats'][0] += 4.0/len(possibles)
-      self[x]['quest_stats'][1] += 1
+      self[x].quest_stats[0] += 4.0/len(possibles)
+      self[x].quest_stats[1] += 1
     for x in questers:
-      self[x]['quest_stats'][2] += 1
+      self[x].quest_stats[2] += 1
 
   def quest_ended(self, quest_end, successful):
     # Reward for a successful quest
@@ -159,57 +258,62 @@ class IdlerpgStats(defaultdict):
     else:
       wait_period = 43200  # 12 hours
       for p in self:
-        if self[p]['online']:
-          self[p]['timeleft'] += 15*1.14**self[p]['level']
+        if self[p].online:
+          self[p].timeleft += 15*1.14**self[p].level
     # Record that there is no active quest
     self.quest_started = None
     self.quest_time_left = None
     self.quest_positions = None
     self.questers = []
     self.next_quest = quest_end+wait_period
+    self.note_cycle_calls(quest_end)
 
   def change_alignment(self, who, align, epoch):
-    if self[who]['alignment'] == align:
+    if self[who].alignment == align:
       return
     factor = {'good':1.1, 'neutral':1.0, 'evil':0.9}
     self.adjust_total_time_by_alignment(who, epoch, increase=False)
-    self[who]['alignment'], old = align, self[who]['alignment']
-    self[who]['itemsum'] = int(math.ceil(self[who]['itemsum']/factor[old])*factor[align])
+    self[who].alignment, old = align, self[who].alignment
+    self[who].itemsum = int(math.ceil(self[who].itemsum/factor[old])*factor[align])
     self.adjust_total_time_by_alignment(who, epoch, increase=True)
+    self.state_changed()
 
 
   def handle_item_stats(self, who, event_type, item, multiplier):
     if event_type == 'level':
-      if self[who]['item_info'][0] == 'ignore_level':
-        self[who]['item_info'] = (None, None)
+      if self[who].item_info[0] == 'ignore_level':
+        self[who].item_info = (None, None)
         item_info = (None, None)
       else:
         item_info = ('level', None)
     elif event_type in ('godsend', 'calamity'):
-      item_value, confidence = self[who]['item_stats'][item]
+      item_value, confidence = self[who].item_stats[item]
       if confidence == 100:
-        factor = {'good':1.1, 'neutral':1.0, 'evil':0.9}[self[who]['alignment']]
+        factor = {'good':1.1, 'neutral':1.0, 'evil':0.9}[self[who].alignment]
         new_item_value = int(item_value * multiplier)
-        olditemsum = int(self[who]['itemsum']/factor+1e-5)
+        olditemsum = int(self[who].itemsum/factor+1e-5)
         newitemsum = olditemsum+(new_item_value-item_value)
-        self[who]['itemsum'] = int(newitemsum*factor)
-        self[who]['item_stats'][item] = (new_item_value, 100)
+        self[who].itemsum = int(newitemsum*factor)
+        self[who].item_stats[item] = (new_item_value, 100)
+        self.state_changed()
         return
       item_info = (item, multiplier)
     else:
       raise SystemExit("Unhandled event_type: {}".format(event_type))
 
-    if self[who]['level'] > 30:
-      if self[who]['item_info'] in ((None, None), ('ignore', None)) or True:
-        self[who]['item_info'] = item_info
+    if self[who].level > 30:
+      if self[who].item_info in ((None, None), ('ignore', None)) or True:
+        self[who].item_info = item_info
       else:
-        raise SystemExit("Received {},{},{} for {} (level {}) when item_info was already {}".format(event_type, item, multiplier, who, self[who]['level'], self[who]['item_info']))
+        raise SystemExit("Received {},{},{} for {} (level {}) when item_info was already {}".format(event_type, item, multiplier, who, self[who].level, self[who].item_info))
 
   def handle_battle_item_stats(self, who, newitemsum):
-    last_event_type, multiplier = self[who]['item_info']
-    olditemsum, self[who]['itemsum'] = self[who]['itemsum'], newitemsum
+    last_event_type, multiplier = self[who].item_info
+    olditemsum, self[who].itemsum = self[who].itemsum, newitemsum
     change = newitemsum - olditemsum
-    factor = {'good':1.1, 'neutral':1.0, 'evil':0.9}[self[who]['alignment']]
+    if change:
+      self.state_changed()
+    factor = {'good':1.1, 'neutral':1.0, 'evil':0.9}[self[who].alignment]
     real_change = math.ceil(newitemsum/factor) - math.ceil(olditemsum/factor)
     if last_event_type in (None, 'ignore'):
       return
@@ -221,12 +325,12 @@ class IdlerpgStats(defaultdict):
       # weapon value is over 350, it can't get any higher).
       # - If only 1 item, set it's value accordingly and confidence to 100%.
       # - Otherwise, multiply all such items confidence by (num-1)/num.
-      for item in self[who]['item_stats']:
-        itemvalue, confidence = self[who]['item_stats'][item]
-        self[who]['item_stats'][item] = (itemvalue, confidence*9.0/10)
+      for item in self[who].item_stats:
+        itemvalue, confidence = self[who].item_stats[item]
+        self[who].item_stats[item] = (itemvalue, confidence*9.0/10)
     else:
       item = last_event_type
-      item_value, confidence = self[who]['item_stats'][item]
+      item_value, confidence = self[who].item_stats[item]
       assert confidence != 100  # confidence==100 should be handled elsewhere
       # Use the change in total itemsum, the user's alignment, and
       # knowledge that it came from the specified item getting the specified
@@ -234,21 +338,22 @@ class IdlerpgStats(defaultdict):
       # the exact value (the various truncations to int in the process
       # prohibit exact calculations).
       new_item_value = int(real_change*multiplier/(multiplier-1)+1e-5)
-      self[who]['item_stats'][item] = (new_item_value, 99)
+      self[who].item_stats[item] = (new_item_value, 99)
 
     # Mark everything as handled now
-    self[who]['item_info'] = (None, None)
+    self[who].item_info = (None, None)
 
   def swap_items(self, winner, loser, item, new_level, old_level):
     def record_new_item(who, level, prev_level):
-      oldlvl_guess, confidence = self[who]['item_stats'][item]
+      oldlvl_guess, confidence = self[who].item_stats[item]
       if confidence >= 99 and abs(oldlvl_guess - prev_level) > 9:
         raise SystemExit("Mismatch for {}; {} vs {}".format(who, oldlvl_guess, prev_level))
-      self[who]['item_stats'][item] = (level, 100.0)
+      self[who].item_stats[item] = (level, 100.0)
 
       change = level - prev_level
-      factor = {'good':1.1, 'neutral':1.0, 'evil':0.9}[self[who]['alignment']]
-      self[who]['itemsum'] += int(round(factor*change))
+      factor = {'good':1.1, 'neutral':1.0, 'evil':0.9}[self[who].alignment]
+      self[who].itemsum += int(round(factor*change))
+      self.state_changed()
 
     record_new_item(winner, new_level, prev_level = old_level)
     record_new_item(loser,  old_level, prev_level = new_level)
@@ -267,370 +372,705 @@ class IdlerpgStats(defaultdict):
           pass
         for who in userlist:
           if attrib == 'alignment':
-            rpgstats.change_alignment(who, value, epoch)
+            self.change_alignment(who, value, epoch)
+          elif attrib in Player.__slots__:
+            setattr(self[who], attrib, value)
           else:
-            rpgstats[who][attrib] = value
+            raise SystemExit("Unknown attribute: "+attrib)
+      self.state_changed()
       self.update_offline()
 
+  def quit_quest(self, quitter, epoch):
+    # The current quest fails right now, costing everyone online p15; as
+    # for quit_strategy_report(), the quitter (if known) gets p16 instead
+    if not self.questers:
+      raise SystemExit("There is no quest to quit")
+    if quitter and quitter not in self:
+      raise SystemExit("Unrecognized player: "+quitter)
+    self.quest_ended(epoch, successful=False)
+    if quitter:
+      self[quitter].timeleft += 1.14**self[quitter].level
+
+  def apply_scenario(self, spec, epoch):
+    # spec is ';'-separated changes, each either in the --whatif format or
+    # 'quit[:QUITTER]' for quitting the current quest (by the quitter
+    # default_quit_strategy() picks, if none is given)
+    for change in filter(None, spec.split(';')):
+      if change == 'quit' or change.startswith('quit:'):
+        quitter = change[5:] or default_quit_strategy(self).split(',')[0]
+        self.quit_quest(quitter, epoch)
+      else:
+        self.apply_attribute_modifications(change, epoch)
+
+  scenario_attributes = ('level', 'timeleft', 'itemsum', 'alignment',
+                         'online', 'stronline', 'online_since',
+                         'last_logbreak_seen')
+
+  def scenario_state(self):
+    # Just what burn rates, ttls, levelling predictions and the changes of
+    # a scenario look at, as plain values that can be handed to worker
+    # processes
+    return dict(players=[(who, tuple(getattr(self[who], attr) for attr in
+                                     IdlerpgStats.scenario_attributes))
+                         for who in self],
+                quest_times=dict(self.quest_times),
+                quest=(self.questers, self.quest_started,
+                       self.quest_time_left, self.quest_positions,
+                       self.next_quest))
+
+  @staticmethod
+  def from_scenario_state(state):
+    stats = IdlerpgStats()
+    for who, values in state['players']:
+      for attr, value in zip(IdlerpgStats.scenario_attributes, values):
+        setattr(stats[who], attr, value)
+    stats.quest_times.update(state['quest_times'])
+    (questers, stats.quest_started, stats.quest_time_left,
+     stats.quest_positions, stats.next_quest) = state['quest']
+    stats.questers = list(questers)
+    return stats
+
+  class LogReplaced(Exception):
+    # A log no longer begins with what we have already read of it
+    pass
+
+  class LogReader(object):
+    # Reads lines out of a memory-mapped log, remapping it as it grows.
+    # tell() is always the offset just past the last line we returned; a
+    # partial line is one irssi hasn't finished writing yet, so it is left
+    # for next time.
+    you_re = re.compile(r'\bYou\b')
+    def __init__(self, replacement_text, filename):
+      self.replacement_text = replacement_text
+      self.filename = filename
+      self.map = None
+      self.inode = None
+      self.pos = 0
+      self.remap()
+    def read_fingerprint(self):
+      # log_fingerprint() of what we have read, from our mapping of it
+      if self.pos > (len(self.map) if self.map else 0):
+        return None
+      head = self.map[0:min(self.pos, 4096)]
+      tail = self.map[max(0, self.pos-4096):self.pos]
+      return hashlib.sha1(head+tail).hexdigest()
+    def remap(self):
+      # Raises LogReplaced if the log was truncated, or replaced (as rsync
+      # does) by one that doesn't begin with what we have read
+      with open(self.filename) as f:
+        stat = os.fstat(f.fileno())
+        mapped = len(self.map) if self.map else 0
+        if stat.st_ino == self.inode and stat.st_size == mapped:
+          return
+        if self.inode is not None and (stat.st_ino != self.inode or
+                                       stat.st_size < mapped):
+          if stat.st_size < self.pos or (
+             self.pos and self.read_fingerprint() !=
+                          log_fingerprint(self.filename, self.pos)):
+            raise IdlerpgStats.LogReplaced(self.filename)
+        self.map = None
+        if stat.st_size:
+          self.map = mmap.mmap(f.fileno(), stat.st_size, access=mmap.ACCESS_READ)
+        self.inode = stat.st_ino
+    def tell(self):
+      return self.pos
+    def seek(self, offset):
+      self.pos = offset
+    def __iter__(self):
+      return self
+    def next(self):
+      while True:
+        end = self.map.find('\n', self.pos) if self.map else -1
+        if end == -1:
+          self.remap()
+          end = self.map.find('\n', self.pos) if self.map else -1
+          if end == -1:
+            raise StopIteration
+        line = self.map[self.pos:end+1]
+        self.pos = end+1
+        # The primary file doesn't specify a translate_you; use it as is.
+        if not self.replacement_text:
+          return line
+        # Ignore log open/closed for these supplemental files
+        if line.startswith('--- Log opened') or line.startswith('--- Log closed'):
+          continue
+        if 'You' in line:
+          line = self.you_re.sub(self.replacement_text, line)
+        return line
+
   def add_log(self, filename, translate_you=None):
-    class FileReplacement(file):
-      def __init__(self, replacement_text, *args):
-        super(FileReplacement, self).__init__(*args)
-        self.replacement_text = replacement_text
-      def __iter__(self):
-        return self
-      def next(self):
-        while True:
-          line = super(FileReplacement, self).next()
-          # Ignore log open/closed for these supplemental files; note
-          # that the primary file doesn't specify a translate_you, so
-          # it won't be skipped for that file.
-          if re.match(r'--- Log (?:opened|closed)', line):
-            continue
-          return re.sub(r'\bYou\b', self.replacement_text, line)
-
-    if translate_you:
-      self.logfiles.append(FileReplacement(translate_you, filename))
-    else:
-      self.logfiles.append(open(filename))
+    self.logs.append((filename, translate_you))
+    self.logfiles.append(IdlerpgStats.LogReader(translate_you, filename))
     self.primary_log = filename
 
-  def next_line(self):
-    def get_next_epoch_and_line(logfile):
-      for line in logfile:
-        epoch_re = r'(?P<epoch>[\d-]{10} [\d:]{8})'
-        m = re.match(epoch_re+r' \*\s*(\S* has (?:quit|left))', line) or \
-            re.match(epoch_re+"\s?<@?idlerpg>\s(.*)$", line) or \
-            re.match(epoch_re+"-idlerpg\([^\)]*\)- (.*)$", line) or \
-            re.match(epoch_re+"-!- (.* \[.*\] has quit.*)", line)
-        if m:
-          epoch = convert_to_epoch(m.group('epoch'))
-          rest = m.group(2)
-          return epoch, rest
+  def restart(self):
+    # Forget everything parsed so far, to parse the same logs over again
+    logs = self.logs
+    checkpoint_file, snapshot_dir = self.checkpoint_file, self.snapshot_dir
+    self.clear()
+    self.__init__()
+    for filename, translate_you in logs:
+      self.add_log(filename, translate_you)
+    self.checkpoint_file, self.snapshot_dir = checkpoint_file, snapshot_dir
+
+  def set_checkpoint(self, filename):
+    self.checkpoint_file = filename
+
+  def set_snapshot_dir(self, dirname):
+    if not os.path.isdir(dirname):
+      os.makedirs(dirname)
+    self.snapshot_dir = dirname
+
+  def snapshot_filename(self, epoch):
+    return os.path.join(self.snapshot_dir, '{:d}.snapshot'.format(int(epoch)))
+
+  def snapshot_times(self):
+    return sorted(int(name[:-len('.snapshot')])
+                  for name in os.listdir(self.snapshot_dir)
+                  if name.endswith('.snapshot'))
+
+  checkpoint_attributes = ('player', 'quest_started', 'quest_times',
+                           'quest_time_left', 'quest_positions', 'questers',
+                           'next_quest', 'primary_log', 'last_epoch_and_line',
+                           'levels', 'hourly_battles', 'cycle_calls',
+                           'cycle_call_seconds', 'line_counts',
+                           'next_snapshot')
+
+  def save_checkpoint(self, filename, parsed_until):
+    logs = []
+    for (logname, translate_you), logfile in zip(self.logs, self.logfiles):
+      offset = logfile.tell()
+      logs.append((logname, translate_you, offset,
+                   log_fingerprint(logname, offset)))
+    state = {'now': now,
+             'parsed_until': parsed_until,
+             'logs': logs,
+             'heads': self.heads(),
+             'players': self.items()}  # keep the order players appear in
+    for attr in IdlerpgStats.checkpoint_attributes:
+      state[attr] = getattr(self, attr)
+    # Write to a temporary file first so we never leave a partial checkpoint
+    with open(filename+'.tmp', 'wb') as f:
+      cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+    os.rename(filename+'.tmp', filename)
+
+  def load_checkpoint(self, filename):
+    try:
+      with open(filename, 'rb') as f:
+        state = cPickle.load(f)
+    except (IOError, EOFError, cPickle.UnpicklingError):
+      return False
+
+    # Only use the checkpoint if it is for the same logs, each of which
+    # still begins with exactly what we parsed before, and it doesn't
+    # contain anything past the time we are parsing until.
+    if state['parsed_until'] > now:
+      return False
+    if any(attr not in state for attr in IdlerpgStats.checkpoint_attributes):
+      return False
+    if not all(isinstance(player, Player) for who, player in state['players']):
+      return False
+    if [log[0:2] for log in state['logs']] != self.logs:
+      return False
+    for logname, translate_you, offset, fingerprint in state['logs']:
+      if not os.path.exists(logname) or os.path.getsize(logname) < offset:
+        return False
+      if log_fingerprint(logname, offset) != fingerprint:
+        return False
+
+    self.clear()
+    self.update(state['players'])
+    for attr in IdlerpgStats.checkpoint_attributes:
+      setattr(self, attr, state[attr])
+    self.state_changed()
+    self.last_lines = []
+    for nr, (logname, translate_you, offset, fingerprint) in enumerate(state['logs']):
+      self.logfiles[nr].seek(offset)
+      # Logs we had hit the end of are checked for more by next_line()
+      epoch, line = state['heads'][nr]
+      if epoch != sys.maxint:
+        heapq.heappush(self.last_lines, (epoch, nr, line))
+    self.shift_now(state['now'], now)
+    return True
+
+  def heads(self):
+    # The next (epoch, line) from each log; epoch is sys.maxint at the end
+    heads = [(sys.maxint, '')]*len(self.logfiles)
+    for epoch, nr, line in self.last_lines:
+      heads[nr] = (epoch, line)
+    return heads
+
+  def shift_now(self, old_time, new_time):
+    # The timeleft of online players and the time left in a time-based
+    # quest are relative to 'now'; fix them up after 'now' has changed.
+    for who in self:
+      if self[who].online:
+        self[who].timeleft -= (new_time-old_time)
+        self.adjust_total_time_by_alignment(who, old_time, increase=True)
+    if self.quest_time_left:
+      self.quest_time_left -= (new_time-old_time)
+
+  # The (fixed width) time stamp, followed by any of the kinds of lines we
+  # care about; exactly one of the groups after the time stamp will match.
+  log_line_re = re.compile(r'([\d-]{10} [\d:]{8})(?:'
+                           r' \*\s*(\S* has (?:quit|left))|'
+                           r'\s?<@?idlerpg>\s(.*)$|'
+                           r'-idlerpg\([^\)]*\)- (.*)$|'
+                           r'-!- (.* \[.*\] has quit.*))')
+  log_break_re = re.compile(r'--- Log (?:opened|closed) (.*)')
 
-        m = re.match(r'--- Log (?:opened|closed) (.*)', line)
-        if m:
-          ed = m.group(1)
-          timetuple = datetime.strptime(ed, '%a %b %d %H:%M:%S %Y').timetuple()
-          epoch = time.mktime(timetuple)
-          return epoch, line
+  @staticmethod
+  def get_next_epoch_and_line(logfile):
+    for line in logfile:
+      m = IdlerpgStats.log_line_re.match(line)
+      if m:
+        epoch = convert_log_time_to_epoch(m.group(1))
+        rest = m.group(m.lastindex)
+        return epoch, rest
+
+      m = IdlerpgStats.log_break_re.match(line)
+      if m:
+        epoch = convert_header_time_to_epoch(m.group(1))
+        return epoch, line
 
-      return sys.maxint, ''
+    return sys.maxint, ''
 
+  def next_line(self):
+    get_next_epoch_and_line = IdlerpgStats.get_next_epoch_and_line
+    # last_epoch_and_line is a line we handed out that has not been handled
+    # yet (because it was past 'now'); it is cleared once it has been.
     if self.last_epoch_and_line:
       yield self.last_epoch_and_line
-    if not self.last_lines:
-      for nr,logfile in enumerate(self.logfiles):
+      self.last_epoch_and_line = None
+    # last_lines is a heap of the next (epoch, nr, line) of each log that we
+    # haven't reached the end of; check the others for anything new.
+    have_line = set(nr for epoch,nr,line in self.last_lines)
+    for nr,logfile in enumerate(self.logfiles):
+      if nr not in have_line:
         epoch, line = get_next_epoch_and_line(logfile)
-        self.last_lines.append((epoch,nr,line,logfile))
-    while True:
-      epoch, nr, line, logfile = min(self.last_lines)
-      if epoch == sys.maxint:
-        raise StopIteration
+        if epoch != sys.maxint:
+          heapq.heappush(self.last_lines, (epoch,nr,line))
+    while self.last_lines:
+      epoch, nr, line = self.last_lines[0]
       self.last_epoch_and_line = (epoch, line)
-      nextepoch, nextline = get_next_epoch_and_line(logfile)
-      self.last_lines[nr] = (nextepoch,nr,nextline,logfile)
+      nextepoch, nextline = get_next_epoch_and_line(self.logfiles[nr])
+      if nextepoch == sys.maxint:
+        heapq.heappop(self.last_lines)
+      else:
+        heapq.heapreplace(self.last_lines, (nextepoch,nr,nextline))
       yield epoch, line
+      self.last_epoch_and_line = None
+
+  #
+  # Check for going offline
+  #
+
+  # Just a single user quitting
+  def handle_quit_line(self, m, epoch):
+    who = self.player.get(m.group('nick'))
+    if not who:
+      # We don't know which player just left because we don't have a mapping from
+      # this player's irc nick to their character name.  But lots of people use
+      # the same for both, so try that.
+      if m.group('nick') in self:
+        who = m.group('nick')
+    if who in self:
+      if self[who].online:
+        self[who].timeleft += 20*1.14**self[who].level
+      self.ensure_offline(who, epoch, known_offline=True)
+    else:
+      pass
+      # We know that a player left, but not which one.  We could spam the output,
+      # but I don't want to bother...
+      #print "Unknown user {}".format(m.group('nick'))
+
+  # I got disconnected somehow
+  def handle_log_closed_line(self, m, epoch):
+    if self.questers and 'elijah' in self.questers:
+      # If my log closed, I'll miss the "elijah's prudence and self-regard"
+      # message about the fact that I caused the quest to end.
+      self.quest_ended(epoch, successful=False)
+    for who in self:
+      if self[who].online != None:
+        self[who].last_logbreak_seen = epoch  # FIXME: Should be epoch of reopening
+      self.ensure_offline(who, epoch, known_offline=False)
+
+  #
+  # Check for quest starting
+  #
+  def handle_quest_positions_line(self, m, epoch):
+    quester_list, start_pos, end_pos = m.groups()
+    self.record_questers(IdlerpgStats.get_people_list(quester_list), epoch)
+    self.quest_positions = start_pos+end_pos
+    self.quest_time_left = None
+    self.note_cycle_calls(epoch)
+
+  def handle_quest_time_line(self, m, epoch):
+    quester_list, days, hours, mins, secs = m.groups()
+    self.record_questers(IdlerpgStats.get_people_list(quester_list), epoch)
+    duration = convert_to_duration(days, hours, mins, secs)
+    self.quest_time_left = self.quest_started+duration-now
+
+  #
+  # Check for quest ending
+  #
+  def handle_quest_failed_line(self, m, epoch):
+    self.quest_ended(epoch, successful=False)
+
+  def handle_quest_journey_line(self, m, epoch):
+    self.quest_times[self.quest_positions].append(epoch-self.quest_started)
+    self.state_changed()
+    self.quest_ended(epoch, successful=True)
+
+  def handle_quest_blessed_line(self, m, epoch):
+    self.quest_ended(epoch, successful=True)
+
+  #
+  # Various checks for time-to-next-level
+  #
+
+  # Welcome X's new player Y, the Z! Next level in...
+  def handle_new_player_line(self, m, epoch):
+    self.handle_timeleft(m, epoch)
+    who = m.group('who')
+    self.levels[who].append((0, epoch))
+    self.player[m.group('nick')] = who
+    # Defaults for level, itemsum, alignment are fine
+
+  # Y, the level W Z, is now online from nickname X. Next level in...
+  def handle_online_line(self, m, epoch):
+    who = m.group('who')
+    self.player[m.group('nick')] = who
+    self.handle_timeleft(m, epoch)
+
+  # Y, the Z, has attained level W! Next level in...
+  def handle_attained_line(self, m, epoch):
+    who = m.group('who')
+    self.last_leveller = who
+    self[who].level = int(m.group('level'))
+    self.state_changed()
+    self.levels[who].append((m.group('level'), epoch))
+    self.handle_timeleft(m, epoch)
+    self.handle_item_stats(who, 'level', None, None)
+
+  # Y, the level W Z, is #U! Next level in...
+  def handle_rank_line(self, m, epoch):
+    if self[m.group('who')].online:
+      self.handle_timeleft(m, epoch)
+
+  #
+  # Check for itemsums
+  #
+
+  # Finding new items
+  def handle_found_item_line(self, m, epoch):
+    who, level, item = m.groups()
+    map = {"Crown":"helm",
+           "Sparkliness":"ring",
+           "Mail":"tunic",
+           "Sword":"weapon",
+           "Rage":"weapon",
+           "Swiftness":"pair of boots",
+           "Doom":"weapon",
+           "Amulet":"amulet"}
+    item = map.get(item.split()[-1], item)
+    oldvalue, confidence = self[who].item_stats[item]
+    if confidence == 100:
+      factor = {'good':1.1, 'neutral':1.0, 'evil':0.9}[self[who].alignment]
+      olditemsum = math.ceil(self[who].itemsum/factor)
+      newitemsum = olditemsum + (int(level)-oldvalue)
+      self[who].itemsum = int(factor*newitemsum)
+      self.state_changed()
+    self[who].item_stats[item] = (int(level), 100)
+    self[who].item_info = ('ignore_level', None)
+
+  # A change of items after a fierce battle
+  def handle_fierce_battle_line(self, m, epoch):
+    defender, newlvl, item, attacker, oldlvl = m.groups()
+    self.swap_items(attacker, defender, item, int(newlvl), int(oldlvl))
+
+  # Two individuals battling, either due to time (1/hour) or space (grid)
+  def handle_battle_line(self, m, epoch):
+    attacker, attacker_sum, battle_type, defender, defender_sum = \
+      m.group('attacker', 'attacker_sum', 'battle_type', 'defender',
+              'defender_sum')
+    if defender != 'idlerpg':
+      self.handle_battle_item_stats(defender, int(defender_sum))
+      self.ensure_online(defender, epoch)
+    if attacker != 'idlerpg':
+      self.handle_battle_item_stats(attacker, int(attacker_sum))
+      self.ensure_online(attacker, epoch)
+      if attacker != self.last_leveller:
+        if battle_type == 'challenged':
+          possibles = [x for x in self
+                       if self[x].online and self[x].level >= 45]
+          rolls = tuple(int(x) for x in m.group('attacker_roll', 'attacker_sum',
+                                                'defender_roll', 'defender_sum'))
+          self.record_hourly_battle(epoch, rolls, m.group('result') == 'won')
+        elif battle_type == 'come upon':
+          possibles = [x for x in self if self[x].online
+                                       and x not in self.questers]
+        for x in possibles:
+          self[x].attack_stats[0] += 1.0/len(possibles)
+          self[x].attack_stats[1] += 1
+        self[attacker].attack_stats[2] += 1
+      self.last_leveller = None
+
+  #
+  # Check for alignment
+  #
+
+  # X has changed alignment to: \w+.
+  def handle_alignment_line(self, m, epoch):
+    who, align = m.groups()
+    self.change_alignment(who, align, epoch)
+
+  # X stole Y's level \d+ .* while they were sleeping!...
+  def handle_stole_line(self, m, epoch):
+    thief, victim, newlvl, item, oldlvl = m.groups()
+    self.swap_items(thief, victim, item, int(newlvl), int(oldlvl))
+    self.change_alignment(thief,  'evil', epoch)
+    self.change_alignment(victim, 'good', epoch)
+    self[thief].alignment_stats[2] += 1
+
+  # X made to steal Y's .*, but realized it [was worse than what they had]
+  def handle_steal_attempt_line(self, m, epoch):
+    thief, victim, item = m.groups()
+    self.change_alignment(thief,  'evil', epoch)
+    self.change_alignment(victim, 'good', epoch)
+    self[thief].alignment_stats[2] += 1
+
+  #
+  # Check for godsends, calamities, and hogs
+  #
+  def handle_godsend_item_line(self, m, epoch):
+    who, item = m.groups()
+    self[who].gch_stats[0] += 1
+    self.handle_item_stats(who, 'godsend', item, 1.1)
+
+  def handle_godsend_time_line(self, m, epoch):
+    self[m.group('who')].gch_stats[1] += 1
+
+  def handle_calamity_item_line(self, m, epoch):
+    who, item = m.groups()
+    self[who].gch_stats[2] += 1
+    self.handle_item_stats(who, 'calamity', item, 0.9)
+
+  def handle_calamity_time_line(self, m, epoch):
+    self[m.group('who')].gch_stats[3] += 1
+
+  def handle_hog_line(self, m, epoch):
+    self[m.group('who')].gch_stats[4] += 1
+
+  #
+  # Various adjustments to timeleft
+  #
+
+  # X is forsaken by their evil god. \d+ days...
+  def handle_forsaken_line(self, m, epoch):
+    who, days, hours, mins, secs = m.groups()
+    duration = convert_to_duration(days, hours, mins, secs)
+    self[who].timeleft += duration
+    self.change_alignment(who, 'evil', epoch)
+    self[who].alignment_stats[1] += 1
+
+  # X and Y have not let the iniquities of evil men.*them.  \d+% of their time
+  def handle_light_shining_line(self, m, epoch):
+    who1, who2, percentage = m.groups()
+    self.adjust_timeleft_percentage(who1, epoch, int(percentage))
+    self.adjust_timeleft_percentage(who2, epoch, int(percentage))
+    self.change_alignment(who1, 'good', epoch)
+    self.change_alignment(who2, 'good', epoch)
+    self[who1].alignment_stats[0] += 1
+    self[who2].alignment_stats[0] += 1
+
+  # I, J, and K [.*] have team battled.* and (won|lost)!
+  def handle_team_battle_line(self, m, epoch):
+    team, result, days, hours, mins, secs = m.groups()
+    members = re.findall('[^, ]+', team)
+    members.remove('and')
+    duration = convert_to_duration(days, hours, mins, secs)
+    sign = -1 if (result == 'won') else 1
+    for who in members:
+      self[who].timeleft += sign*duration
+
+  # Each line is dispatched through this table, in order.  The keyword is a
+  # substring that every match of the corresponding regex must contain, which
+  # lets us skip a regex without running it; since most lines contain only
+  # one of the keywords, a line is typically only ever matched against one
+  # (precompiled) regex.  Most handlers mark the line as fully handled, but a
+  # few let the line continue on down the table, as they always have.
+  #   line type, keyword, regex, handler, final
+  line_types = [
+    ('quit', ' has quit', re.compile(r'(?P<nick>.*) \[.*\] has (?:quit|left)'),
+     handle_quit_line, True),
+    ('quit', ' has left', re.compile(r'(?P<nick>.*) \[.*\] has (?:quit|left)'),
+     handle_quit_line, True),
+    ('log_closed', '--- Log closed', re.compile(r'--- Log closed (.*)'),
+     handle_log_closed_line, True),
+    ('quest_positions', 'Participants must first reach',
+     re.compile(r"(.*) have been chosen.*Participants must first reach (\[.*?\]).*(\[.*?\])"),
+     handle_quest_positions_line, True),
+    ('quest_time', 'Quest to end in',
+     re.compile(r"(.*) have been chosen.*Quest to end in (\d+) days?, (\d{2}):(\d{2}):(\d{2})"),
+     handle_quest_time_line, True),
+    ('quest_failed', 'prudence and self-regard',
+     re.compile(r".*prudence and self-regard has brought the wrath of the gods upon the realm"),
+     handle_quest_failed_line, True),
+    ('quest_journey', 'completed their journey',
+     re.compile(r".*completed their journey"),
+     handle_quest_journey_line, True),
+    ('quest_blessed', 'have blessed the realm',
+     re.compile(r".*have blessed the realm by completing their quest"),
+     handle_quest_blessed_line, True),
+    ('new_player', "'s new player ",
+     re.compile(r"Welcome (?P<nick>.*)'s new player (?P<who>.*), the .*! "+nextlvl_re),
+     handle_new_player_line, True),
+    ('online', 'is now online from nickname',
+     re.compile(r"(?P<who>.*), the level .*, is now online from nickname (?P<nick>.*). "+nextlvl_re),
+     handle_online_line, True),
+    ('attained', 'has attained level',
+     re.compile(r"(?P<who>.*), the .*, has attained level (?P<level>\d+)! "+nextlvl_re),
+     handle_attained_line, True),
+    # Y reaches next level in...
+    #   Note: This is by far the most common message.  It is sent immediately
+    #   after hourly battles, immediately after grid-collision battles, after
+    #   immediately after godsends and calamaties, and immediately after a few
+    #   other cases like Critical Strikes or light of their God or hand of God.
+    ('timeleft', ' reaches ',
+     re.compile(r"(?P<who>.*) reaches "+nextlvl_re),
+     handle_timeleft, True),
+    ('rank', ', is #',
+     re.compile(r"(?P<who>.*?), the level .*, is #\d+! "+nextlvl_re),
+     handle_rank_line, True),
+    ('found_item', 'found ',
+     re.compile(r".*(?P<who>\b.+) (?:have found the|found a) level (?P<level>\d+) (?P<item>.*?)!"),
+     handle_found_item_line, False),
+    ('fierce_battle', 'In the fierce battle, ',
+     re.compile(r"In the fierce battle, (?P<defender>.*) dropped their level (?P<new_level>\d+) (?P<item>.*)! (?P<attacker>.*) picks it up, tossing their old level (?P<old_level>\d+) .* to .*\."),
+     handle_fierce_battle_line, False),
+    ('battle', '] has c',
+     re.compile(r"(?P<attacker>.*) \[(?P<attacker_roll>\d+)/(?P<attacker_sum>\d+)\] has (?P<battle_type>challenged|come upon) (?P<defender>.*) \[(?P<defender_roll>\d+)/(?P<defender_sum>\d+)\](?: in combat and (?P<result>won|lost))?"),
+     handle_battle_line, True),
+    ('alignment', 'has changed alignment to: ',
+     re.compile(r"(?P<who>.*) has changed alignment to: (.*)\.$"),
+     handle_alignment_line, True),
+    ('stole', ' while they were sleeping! ',
+     re.compile(r"(?P<who>.*) stole (?P<victim>.*)'s level (?P<newlvl>\d+) (?P<item>.*) while they were sleeping! .* leaves their old level (?P<oldlvl>\d+) .* behind, which .* then takes."),
+     handle_stole_line, False),
+    ('steal_attempt', ' made to steal ',
+     re.compile(r"(?P<thief>.*) made to steal (?P<victim>.*)'s (?P<item>.*), but realized it was lower level than your own."),
+     handle_steal_attempt_line, False),
+    ('godsend_item', ' gains 10% effectiveness',
+     re.compile(r".*! (?P<who>\w+)'s (?P<item>.*) gains 10% effectiveness"),
+     handle_godsend_item_line, True),
+    ('godsend_time', 'wondrous godsend has accelerated',
+     re.compile('(?P<who>\w+).*wondrous godsend has accelerated'),
+     handle_godsend_time_line, True),
+    ('calamity_item', ' loses 10% of its effectiveness',
+     re.compile(r".*! (?P<who>\w+)'s (?P<item>.*) loses 10% of its effectiveness"),
+     handle_calamity_item_line, True),
+    ('calamity_time', 'terrible calamity has slowed them',
+     re.compile('(?P<who>\w+).*terrible calamity has slowed them'),
+     handle_calamity_time_line, True),
+    ('hog', 'hand of God carried ',
+     re.compile('.*hand of God carried (?P<who>\w+).*toward level'),
+     handle_hog_line, True),
+    ('hog', ' with fire, slowing',
+     re.compile('Thereupon.*consumed (?P<who>\w+) with fire, slowing'),
+     handle_hog_line, True),
+    ('forsaken', ' is forsaken by their evil god. ',
+     re.compile(r'(.*?) is forsaken by their evil god. (\d+) days?, (\d{2}):(\d{2}):(\d{2})'),
+     handle_forsaken_line, False),
+    ('light_shining', ' have not let the iniquities of evil men',
+     re.compile(r'(.*?) and (.*?) have not let the iniquities of evil men.*them.*(\d+)% of their time is removed from their clocks'),
+     handle_light_shining_line, False),
+    ('team_battle', ' have team battled ',
+     re.compile(r'(.*?)\[.*?have team battled .*? and (won|lost)! (\d+) days?, (\d{2}):(\d{2}):(\d{2})'),
+     handle_team_battle_line, False),
+  ]
+
+  def maybe_snapshot(self, epoch):
+    # Called with the epoch of the next line to handle once it reaches
+    # next_snapshot; record the state as of the end of the previous day.
+    if self.next_snapshot is not None and self.snapshot_dir and self.resumable:
+      filename = self.snapshot_filename(self.next_snapshot)
+      if not os.path.exists(filename):
+        self.save_checkpoint(filename, self.next_snapshot)
+    tomorrow = datetime.fromtimestamp(epoch).date() + timedelta(days=1)
+    self.next_snapshot = time.mktime(tomorrow.timetuple())
 
   def parse_lines(self):
-    last_leveller = None
-    nextlvl_re="[Nn]ext level in (?P<days>\d+) days?, (?P<hours>\d{2}):(?P<mins>\d{2}):(?P<secs>\d{2})"
+    self.last_leveller = None
+    line_types = IdlerpgStats.line_types
+    line_counts = self.line_counts
     for epoch, line in self.next_line():
       # Quit parsing lines if we've gone as far as we're supposed to
       if epoch > now:
         break
-
-      #
-      # Check for going offline
-      #
-
-      # Just a single user quitting
-      m = re.match(r'(?P<nick>.*) \[.*\] has (?:quit|left)', line)
-      if m:
-        who = self.player.get(m.group('nick'))
-        if not who:
-          # We don't know which player just left because we don't have a mapping from
-          # this player's irc nick to their character name.  But lots of people use
-          # the same for both, so try that.
-          if m.group('nick') in self:
-            who = m.group('nick')
-        if who in self:
-          if self[who]['online']:
-            self[who]['timeleft'] += 20*1.14**self[who]['level']
-          self.ensure_offline(who, epoch, known_offline=True)
-        else:
-          pass
-          # We know that a player left, but not which one.  We could spam the output,
-          # but I don't want to bother...
-          #print "Unknown user {}".format(m.group('nick'))
-        continue
-
-      # I got disconnected somehow
-      m = re.match(r'--- Log closed (.*)', line)
-      if m:
-        if self.questers and 'elijah' in self.questers:
-          # If my log closed, I'll miss the "elijah's prudence and self-regard"
-          # message about the fact that I caused the quest to end.
-          self.quest_ended(epoch, successful=False)
-        for who in self:
-          if self[who]['online'] != None:
-            self[who]['last_logbreak_seen'] = epoch  # FIXME: Should be epoch of reopening
-          self.ensure_offline(who, epoch, known_offline=False)
-        continue
-
-      #
-      # Check for quest starting
-      #
-      m = re.match("(.*) have been chosen.*Participants must first reach (\[.*?\]).*(\[.*?\])", line)
-      if m:
-        quester_list, start_pos, end_pos = m.groups()
-        self.record_questers(IdlerpgStats.get_people_list(quester_list), epoch)
-        self.quest_positions = start_pos+end_pos
-        self.quest_time_left = None
-        continue
-      m = re.match(r"(.*) have been chosen.*Quest to end in (\d+) days?, (\d{2}):(\d{2}):(\d{2})", line)
-      if m:
-        quester_list, days, hours, mins, secs = m.groups()
-        self.record_questers(IdlerpgStats.get_people_list(quester_list), epoch)
-        duration = convert_to_duration(days, hours, mins, secs)
-        self.quest_time_left = self.quest_started+duration-now
-        continue
-
-      #
-      # Check for quest ending
-      #
-      m = re.match(r".*prudence and self-regard has brought the wrath of the gods upon the realm", line)
-      if m:
-        self.quest_ended(epoch, successful=False)
-        continue
-      m = re.match(r".*completed their journey", line)
-      if m:
-        self.quest_times[self.quest_positions].append(epoch-self.quest_started)
-        self.quest_ended(epoch, successful=True)
-        continue
-      m = re.match(r".*have blessed the realm by completing their quest", line)
-      if m:
-        self.quest_ended(epoch, successful=True)
-        continue
-
-      #
-      # Various checks for time-to-next-level
-      #
-
-      # Welcome X's new player Y, the Z! Next level in...
-      m = re.match(r"Welcome (?P<nick>.*)'s new player (?P<who>.*), the .*! "+nextlvl_re, line)
-      if m:
-        self.handle_timeleft(m, epoch)
-        who = m.group('who')
-        self.levels[who].append((0, epoch))
-        self.player[m.group('nick')] = who
-        # Defaults for level, itemsum, alignment are fine
-        continue
-
-      # Y, the level W Z, is now online from nickname X. Next level in...
-      m = re.match(r"(?P<who>.*), the level .*, is now online from nickname (?P<nick>.*). "+nextlvl_re, line)
-      if m:
-        who = m.group('who')
-        self.player[m.group('nick')] = who
-        self.handle_timeleft(m, epoch)
-        continue
-
-      # Y, the Z, has attained level W! Next level in...
-      m = re.match(r"(?P<who>.*), the .*, has attained level (?P<level>\d+)! "+nextlvl_re, line)
-      if m:
-        who = m.group('who')
-        last_leveller = who
-        self[who]['level'] = int(m.group('level'))
-        self.levels[who].append((m.group('level'), epoch))
-        self.handle_timeleft(m, epoch)
-        self.handle_item_stats(who, 'level', None, None)
-        continue
-
-      # Y reaches next level in...
-      #   Note: This is by far the most common message.  It is sent immediately
-      #   after hourly battles, immediately after grid-collision battles, after
-      #   immediately after godsends and calamaties, and immediately after a few
-      #   other cases like Critical Strikes or light of their God or hand of God.
-      m = re.match(r"(?P<who>.*) reaches "+nextlvl_re, line)
-      if m:
-        self.handle_timeleft(m, epoch)
-        continue
-
-      # Y, the level W Z, is #U! Next level in...
-      m = re.match(r"(?P<who>.*?), the level .*, is #\d+! "+nextlvl_re, line)
-      if m:
-        if self[m.group('who')]['online']:
-          self.handle_timeleft(m, epoch)
-        continue
-
-      #
-      # Check for itemsums
-      #
-
-      # Finding new items
-      m = re.match(r".*(?P<who>\b.+) (?:have found the|found a) level (?P<level>\d+) (?P<item>.*?)!", line)
-      if m:
-        who, level, item = m.groups()
-        map = {"Crown":"helm",
-               "Sparkliness":"ring",
-               "Mail":"tunic",
-               "Sword":"weapon",
-               "Rage":"weapon",
-               "Swiftness":"pair of boots",
-               "Doom":"weapon",
-               "Amulet":"amulet"}
-        item = map.get(item.split()[-1], item)
-        oldvalue, confidence = self[who]['item_stats'][item]
-        if confidence == 100:
-          factor = {'good':1.1, 'neutral':1.0, 'evil':0.9}[self[who]['alignment']]
-          olditemsum = math.ceil(self[who]['itemsum']/factor)
-          newitemsum = olditemsum + (int(level)-oldvalue)
-          self[who]['itemsum'] = int(factor*newitemsum)
-        self[who]['item_stats'][item] = (int(level), 100)
-        self[who]['item_info'] = ('ignore_level', None)
-
-      # A change of items after a fierce battle
-      m = re.match(r"In the fierce battle, (?P<defender>.*) dropped their level (?P<new_level>\d+) (?P<item>.*)! (?P<attacker>.*) picks it up, tossing their old level (?P<old_level>\d+) .* to .*\.", line)
-      if m:
-        defender, newlvl, item, attacker, oldlvl = m.groups()
-        self.swap_items(attacker, defender, item, int(newlvl), int(oldlvl))
-
-      # Two individuals battling, either due to time (1/hour) or space (grid)
-      m = re.match(r"(?P<attacker>.*) \[\d+/(?P<attacker_sum>\d+)\] has (?P<battle_type>challenged|come upon) (?P<defender>.*) \[\d+/(?P<defender_sum>\d+)\]", line)
-      if m:
-        attacker, attacker_sum, battle_type, defender, defender_sum = m.groups()
-        if defender != 'idlerpg':
-          self.handle_battle_item_stats(defender, int(defender_sum))
-          self.ensure_online(defender, epoch)
-        if attacker != 'idlerpg':
-          self.handle_battle_item_stats(attacker, int(attacker_sum))
-          self.ensure_online(attacker, epoch)
-          if attacker != last_leveller:
-            if battle_type == 'challenged':
-              possibles = [x for x in self
-                           if self[x]['online'] and self[x]['level'] >= 45]
-            elif battle_type == 'come upon':
-              possibles = [x for x in self if self[x]['online']
-                                           and x not in self.questers]
-            for x in possibles:
-              self[x]['attack_stats'][0] += 1.0/len(possibles)
-              self[x]['attack_stats'][1] += 1
-            self[attacker]['attack_stats'][2] += 1
-          last_leveller = None
-        continue
-
-      #
-      # Check for alignment
-      #
-
-      # X has changed alignment to: \w+.
-      m = re.match(r"(?P<who>.*) has changed alignment to: (.*)\.$", line)
-      if m:
-        who, align = m.groups()
-        self.change_alignment(who, align, epoch)
-        continue
-
-      # X stole Y's level \d+ .* while they were sleeping!...
-      m = re.match(r"(?P<who>.*) stole (?P<victim>.*)'s level (?P<newlvl>\d+) (?P<item>.*) while they were sleeping! .* leaves their old level (?P<oldlvl>\d+) .* behind, which .* then takes.", line)
-      if m:
-        thief, victim, newlvl, item, oldlvl = m.groups()
-        self.swap_items(thief, victim, item, int(newlvl), int(oldlvl))
-        self.change_alignment(thief,  'evil', epoch)
-        self.change_alignment(victim, 'good', epoch)
-        self[thief]['alignment_stats'][2] += 1
-
-      # X made to steal Y's .*, but realized it [was worse than what they had]
-      m = re.match(r"(?P<thief>.*) made to steal (?P<victim>.*)'s (?P<item>.*), but realized it was lower level than your own.", line)
-      if m:
-        thief, victim, item = m.groups()
-        self.change_alignment(thief,  'evil', epoch)
-        self.change_alignment(victim, 'good', epoch)
-        self[thief]['alignment_stats'][2] += 1
-
-      #
-      # Check for godsends, calamities, and hogs
-      #
-      m = re.match(r".*! (?P<who>\w+)'s (?P<item>.*) gains 10% effectiveness", line)
-      if m:
-        who, item = m.groups()
-        self[who]['gch_stats'][0] += 1
-        self.handle_item_stats(who, 'godsend', item, 1.1)
-        continue
-      m = re.match('(?P<who>\w+).*wondrous godsend has accelerated', line)
-      if m:
-        self[m.group('who')]['gch_stats'][1] += 1
-        continue
-      m = re.match(r".*! (?P<who>\w+)'s (?P<item>.*) loses 10% of its effectiveness", line)
-      if m:
-        who, item = m.groups()
-        self[who]['gch_stats'][2] += 1
-        self.handle_item_stats(who, 'calamity', item, 0.9)
-        continue
-      m = re.match('(?P<who>\w+).*terrible calamity has slowed them', line)
-      if m:
-        self[m.group('who')]['gch_stats'][3] += 1
-        continue
-      m = re.match('.*hand of God carried (?P<who>\w+).*toward level', line)
-      if m:
-        self[m.group('who')]['gch_stats'][4] += 1
-        continue
-      m = re.match('Thereupon.*consumed (?P<who>\w+) with fire, slowing', line)
-      if m:
-        self[m.group('who')]['gch_stats'][4] += 1
-        continue
-
-      #
-      # Various adjustments to timeleft
-      #
-
-      # X is forsaken by their evil god. \d+ days...
-      m = re.match(r'(.*?) is forsaken by their evil god. (\d+) days?, (\d{2}):(\d{2}):(\d{2})', line)
-      if m:
-        who, days, hours, mins, secs = m.groups()
-        duration = convert_to_duration(days, hours, mins, secs)
-        self[who]['timeleft'] += duration
-        self.change_alignment(who, 'evil', epoch)
-        self[who]['alignment_stats'][1] += 1
-
-      # X and Y have not let the iniquities of evil men.*them.  \d+% of their time
-      m = re.match(r'(.*?) and (.*?) have not let the iniquities of evil men.*them.*(\d+)% of their time is removed from their clocks', line)
-      if m:
-        who1, who2, percentage = m.groups()
-        self.adjust_timeleft_percentage(who1, epoch, int(percentage))
-        self.adjust_timeleft_percentage(who2, epoch, int(percentage))
-        self.change_alignment(who1, 'good', epoch)
-        self.change_alignment(who2, 'good', epoch)
-        self[who1]['alignment_stats'][0] += 1
-        self[who2]['alignment_stats'][0] += 1
-
-      # I, J, and K [.*] have team battled.* and (won|lost)!
-      m = re.match(r'(.*?)\[.*?have team battled .*? and (won|lost)! (\d+) days?, (\d{2}):(\d{2}):(\d{2})', line)
-      if m:
-        team, result, days, hours, mins, secs = m.groups()
-        members = re.findall('[^, ]+', team)
-        members.remove('and')
-        duration = convert_to_duration(days, hours, mins, secs)
-        sign = -1 if (result == 'won') else 1
-        for who in members:
-          self[who]['timeleft'] += sign*duration
+      if self.next_snapshot is None or epoch >= self.next_snapshot:
+        self.maybe_snapshot(epoch)
+
+      handled = False
+      for line_type, keyword, regex, handler, final in line_types:
+        if keyword not in line:
+          continue
+        m = regex.match(line)
+        if m:
+          handled = True
+          line_counts[line_type] += 1
+          handler(self, m, epoch)
+          if final:
+            break
+      if not handled:
+        line_counts['unhandled'] += 1
 
   def update_offline(self):
     # Mark people as offline if they're unknown but their ttl suggests they
     # should have already levelled by now
     for who in self:
-      if self[who]['online'] is None:
+      if self[who].online is None:
         ettl_opt, ettl_exp = expected_ttl(self, who)
-        time_left_approx = min(ettl_opt, self[who]['timeleft'])
-        if time_left_approx + self[who]['last_logbreak_seen'] < now:
-          self[who]['online'] = False
-      self[who]['stronline'] = 'yes' if self[who]['online'] else (
-                               '???' if self[who]['online'] is None else 'no')
+        time_left_approx = min(ettl_opt, self[who].timeleft)
+        if time_left_approx + self[who].last_logbreak_seen < now:
+          self[who].online = False
+          self.state_changed()
+      self[who].stronline = 'yes' if self[who].online else (
+                               '???' if self[who].online is None else 'no')
+
+  def load_latest_checkpoint(self):
+    # The checkpoint is normally the latest state available, but when
+    # parsing until some earlier time start from the closest snapshot
+    # taken before then instead.
+    if self.checkpoint_file and self.load_checkpoint(self.checkpoint_file):
+      return True
+    if self.snapshot_dir:
+      earlier = [t for t in self.snapshot_times() if t <= now]
+      if earlier:
+        return self.load_checkpoint(self.snapshot_filename(earlier[-1]))
+    return False
 
   def parse(self):
+    # Checkpoints can only be made of, or used instead of, a parse that
+    # nothing but the logs themselves have fed into; update_offline() and
+    # --whatif both make guesses that later log lines shouldn't build on.
+    if self.resumable:
+      self.load_latest_checkpoint()
     try:
+      # Catch logs that were truncated or replaced before reading them on
+      for logfile in self.logfiles:
+        logfile.remap()
       self.parse_lines()
     except StopIteration:
       pass
+    except IdlerpgStats.LogReplaced as e:
+      sys.stderr.write("{} was truncated or replaced; parsing it all "
+                       "again\n".format(e))
+      self.restart()
+      return self.parse()
+    if self.checkpoint_file and self.resumable and now == current_time:
+      self.save_checkpoint(self.checkpoint_file, now)
+    self.resumable = False
     self.update_offline()
 
 def time_format(seconds):
@@ -669,11 +1109,11 @@ def quest_info(stats):
     return "None; next should start in "+next_start
 
 def battle_burn(stats, who):
-  oncount = sum([1 for x in stats if stats[x]['online']])
-  battlers = sum([1 for x in stats if stats[x]['online'] and
-                                      stats[x]['level'] >= 45])
+  oncount = sum([1 for x in stats if stats[x].online])
+  battlers = sum([1 for x in stats if stats[x].online and
+                                      stats[x].level >= 45])
   odds_fight_per_day = 0
-  if stats[who]['level'] >= 45:
+  if stats[who].level >= 45:
     odds_fight_per_day += 24.0/battlers # every hour, 1 selected to start fight
   odds_fight_per_day += 1.5/oncount  # 1.5ish grid battles/day, from past stats
   # team battles are basically a wash; the reward is equal to the loss, so the
@@ -684,21 +1124,21 @@ def battle_burn(stats, who):
   # means I should adjust odds_fight_per_day and odds_fight_this_opp to be
   # more precise, but meh -- it won't change things that much.
   for opp in stats:
-    if opp == who or not stats[opp]['online']:
+    if opp == who or not stats[opp].online:
       continue
-    gain = max(7,stats[opp]['level']/4)
-    loss = max(7,stats[opp]['level']/7)
+    gain = max(7,stats[opp].level/4)
+    loss = max(7,stats[opp].level/7)
     odds_fight_this_opp = 1.0/oncount # oncount-1 other players, plus idlerpg
-    odds_beat_opp = stats[who]['itemsum']/(stats[who]['itemsum']+stats[opp]['itemsum']+1e-25)
+    odds_beat_opp = stats[who].itemsum/(stats[who].itemsum+stats[opp].itemsum+1e-25)
     change_if_fight = odds_beat_opp*gain - (1-odds_beat_opp)*loss
     diff = change_if_fight*odds_fight_this_opp*odds_fight_per_day
     percent_change += diff
   if True: # Also handle idlerpg
-    idlerpg_sum = 1+max(stats[x]['itemsum'] for x in stats)
+    idlerpg_sum = 1+max(stats[x].itemsum for x in stats)
     gain = 20
     loss = 10
     odds_fight_this_opp = 1.0/oncount # oncount-1 other players, plus idlerpg
-    odds_beat_opp = stats[who]['itemsum']/(stats[who]['itemsum']+idlerpg_sum+0.0)
+    odds_beat_opp = stats[who].itemsum/(stats[who].itemsum+idlerpg_sum+0.0)
 
     change_if_fight = odds_beat_opp*gain - (1-odds_beat_opp)*loss
     diff = change_if_fight*odds_fight_this_opp*odds_fight_per_day
@@ -706,19 +1146,19 @@ def battle_burn(stats, who):
   return percent_change/100.0
 
 def critical_strike_rate(stats,who):
-  oncount = sum([1 for x in stats if stats[x]['online']])
+  oncount = sum([1 for x in stats if stats[x].online])
   crit_factor = {'good':1.0/50, 'neutral':1.0/35, 'evil':1.0/20}
   odds_fight_per_day = 24.0/oncount  # every hour, 1.0 selected to start fight
   odds_fight_per_day += 1.5/oncount  # 1.5ish grid battles per day
   rate = 0
   for opp in stats:
-    if opp == who or not stats[opp]['online']:
+    if opp == who or not stats[opp].online:
       continue
     odds_fight_this_opp = 1.0/oncount # oncount-1 other players, plus idlerpg
-    odds_beaten_by_opp = stats[opp]['itemsum']/(stats[who]['itemsum']+stats[opp]['itemsum']+1e-25)
+    odds_beaten_by_opp = stats[opp].itemsum/(stats[who].itemsum+stats[opp].itemsum+1e-25)
 
     odds_lose = odds_fight_per_day*odds_fight_this_opp*odds_beaten_by_opp
-    rate += odds_lose * crit_factor[stats[opp]['alignment']] * 15.0/100
+    rate += odds_lose * crit_factor[stats[opp].alignment] * 15.0/100
 
   return rate
 
@@ -735,26 +1175,27 @@ def godsend_calamity_hog_burn(stats, who):
   return overall_percentage
 
 def alignment_burn(stats, who):
-  if stats[who]['alignment'] == 'good':
+  if stats[who].alignment == 'good':
     good_and_online_count = sum([1 for x in stats
-                   if stats[x]['online'] and stats[x]['alignment'] == 'good'])
+                   if stats[x].online and stats[x].alignment == 'good'])
     if good_and_online_count < 2:
       return 0
     percent = (.05+.12)/2
     odds = 2*(1.0/12)
     return odds*percent
-  elif stats[who]['alignment'] == 'evil':
+  elif stats[who].alignment == 'evil':
     percent = (.01+.05)/2
     odds = .5*1.0/8
     return -odds*percent
   else:
     return 0
 
-def quest_burn(stats, who):
+def quest_rates(stats):
+  # The parts of quest_burn that do not depend on who is asking
   above_level_40 = sum([1 for x in stats
-                        if stats[x]['online'] and stats[x]['level'] >= 40])
+                        if stats[x].online and stats[x].level >= 40])
   if above_level_40 < 4:
-    return 0, 0, 0
+    return None
 
   # Determine average quest duration
   time_quest_average = 86400*0.75  # Time based quests are 12-24 hours
@@ -780,15 +1221,23 @@ def quest_burn(stats, who):
   average_wait_time = 21600*(1+fail_quest_percentage)  # Yes '+', after simplify
   quests_per_day = 86400 / (average_quest_time + average_wait_time)
 
+  optimistic_rate = quests_per_day * odds_a * .25
+  expected_rate   = quests_per_day * odds_c * .25
+  return quests_per_day, fail_quest_percentage, optimistic_rate, expected_rate
+
+def quest_burn(stats, who):
+  rates = quest_rates(stats)
+  if not rates:
+    return 0, 0, 0
+  quests_per_day, fail_quest_percentage, optimistic_rate, expected_rate = rates
+
   # Determine antiburn
-  pen = 15*1.14**stats[who]['level']
+  pen = 15*1.14**stats[who].level
   antiburn = pen*quests_per_day*fail_quest_percentage
 
   # Find rates and return them
   idlerpg = (sum(ord(x) for x in who) == 621)
-  optimistic_rate = quests_per_day * odds_a * .25
-  expected_rate   = quests_per_day * odds_c * .25
-  if stats[who]['level'] < 40:
+  if stats[who].level < 40:
     return 0, 0, antiburn
   elif idlerpg:
     return optimistic_rate, optimistic_rate, antiburn
@@ -810,6 +1259,16 @@ def solve_ttl_to_0(ttl, r, p):
   # Switch back to seconds
   return ttl_burn_time * 86400
 
+def solve_ttls_to_0(ttl, r, p):
+  # solve_ttl_to_0() over numpy arrays of ttls, burn rates and antiburns
+  import numpy as np
+  ttl = np.asarray(ttl, dtype=float)/86400.0
+  p = np.asarray(p, dtype=float)/86400.0
+  r = np.asarray(r, dtype=float)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    ttl_burn_time = (-1/r)*np.log((1-p)/(r*ttl+1-p))
+  return np.where((p > 1) | (r*ttl+1-p < 0), float('inf'), ttl_burn_time*86400)
+
 def solve_for_flat_slope(ttl, r, p):
   # ttl,p in seconds; burn_rate in days; get common units
   ttl /= 86400.0
@@ -832,6 +1291,9 @@ def advance_by_time(original_ttl, r, p, time_advance):
   return result
 
 def get_burn_rates(stats, who):
+  return stats.memoized(('burn_rates', who), compute_burn_rates, stats, who)
+
+def compute_burn_rates(stats, who):
   burn_rate = 0
   burn_rate += battle_burn(stats, who)
   burn_rate += godsend_calamity_hog_burn(stats, who)
@@ -840,56 +1302,230 @@ def get_burn_rates(stats, who):
 
   return burn_rate + quest_default_br, burn_rate + quest_tweaked_br, antiburn
 
-def expected_ttl(stats, who): # How much time-to-level decrease in next day
-  if 'expected_ttls' in stats[who]:
-    return stats[who]['expected_ttls']
-  cur_ttl = stats[who]['timeleft']
-
-  optimal_burn_rate, expected_burn_rate, antiburn = get_burn_rates(stats, who)
+def expected_ttl(stats, who, burn_rates=None): # How much time-to-level decrease in next day
+  if stats[who].expected_ttls is not None:
+    return stats[who].expected_ttls
+  cur_ttl = stats[who].timeleft
 
+  if burn_rates:
+    rates = burn_rates[who]
+  else:
+    rates = get_burn_rates(stats, who)
+  # timeleft moves with 'now' without the state changing, so it is part of
+  # the key along with the rates used
+  return stats.memoized(('expected_ttl', who, cur_ttl)+tuple(rates),
+                        solve_expected_ttls, cur_ttl, *rates)
+
+def solve_expected_ttls(cur_ttl, optimal_burn_rate, expected_burn_rate,
+                        antiburn):
   ttl1 = solve_ttl_to_0(cur_ttl, optimal_burn_rate, 0)
   ttl2 = solve_ttl_to_0(cur_ttl, expected_burn_rate, antiburn)
   return ttl1, ttl2
 
+def burn_rate_arrays(stats):
+  # Same computations as battle_burn, critical_strike_rate, alignment_burn
+  # and quest_burn, but done for every player at once.  battle_burn and
+  # critical_strike_rate loop over all opponents for each player, so calling
+  # them per player is quadratic in python; here that is a pairwise numpy
+  # matrix instead.  Returns the list of players and a dict of arrays
+  # indexed like that list.
+  import numpy as np
+
+  players = list(stats)
+  level = np.array([stats[x].level for x in players])
+  itemsum = np.array([stats[x].itemsum for x in players], dtype=float)
+  online = np.array([bool(stats[x].online) for x in players], dtype=bool)
+  alignment = [stats[x].alignment for x in players]
+  good = np.array([x == 'good' for x in alignment], dtype=bool)
+  evil = np.array([x == 'evil' for x in alignment], dtype=bool)
+
+  oncount = online.sum()
+  battlers = (online & (level >= 45)).sum()
+  if level.dtype.kind in 'iu':
+    gain, loss = np.maximum(7, level//4), np.maximum(7, level//7)
+  else:
+    gain, loss = np.maximum(7, level/4.0), np.maximum(7, level/7.0)
+  # opponents[i,j] is whether player j is someone player i could fight
+  opponents = online[np.newaxis,:] & ~np.eye(len(players), dtype=bool)
+  pairsum = itemsum[:,np.newaxis]+itemsum[np.newaxis,:]+1e-25
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    # Battles; see battle_burn
+    # (battle_burn would divide by zero for offline players at 45+ when no
+    # online player is 45+; give them a bogus rate rather than failing all)
+    odds_fight_per_day = np.where(level >= 45, 24.0/max(battlers, 1), 0) + \
+                         1.5/oncount
+    odds_beat_opp = itemsum[:,np.newaxis]/pairsum
+    change_if_fight = odds_beat_opp*gain - (1-odds_beat_opp)*loss
+    odds_fight_this_opp = 1.0/oncount
+    diff = change_if_fight*odds_fight_this_opp*odds_fight_per_day[:,np.newaxis]
+    percent_change = np.where(opponents, diff, 0).sum(axis=1)
+    idlerpg_sum = 1+itemsum.max()
+    odds_beat_opp = itemsum/(itemsum+idlerpg_sum)
+    change_if_fight = odds_beat_opp*20 - (1-odds_beat_opp)*10
+    percent_change += change_if_fight*odds_fight_this_opp*odds_fight_per_day
+    battle = percent_change/100.0
+
+    # Critical strikes; see critical_strike_rate
+    crit_factor = {'good':1.0/50, 'neutral':1.0/35, 'evil':1.0/20}
+    opp_crit = np.array([crit_factor[x] for x in alignment])
+    odds_beaten_by_opp = itemsum[np.newaxis,:]/pairsum
+    odds_lose = (24.0/oncount + 1.5/oncount)*odds_fight_this_opp * \
+                odds_beaten_by_opp
+    crit = np.where(opponents, odds_lose*opp_crit*15.0/100, 0).sum(axis=1)
+
+  # Alignment; see alignment_burn
+  align = np.zeros(len(players))
+  if (online & good).sum() >= 2:
+    align[good] = 2*(1.0/12) * (.05+.12)/2
+  align[evil] = -(.5*1.0/8) * (.01+.05)/2
+
+  # Quests; see quest_burn
+  quest_opt = np.zeros(len(players))
+  quest_exp = np.zeros(len(players))
+  antiburn = np.zeros(len(players))
+  rates = quest_rates(stats)
+  if rates:
+    quests_per_day, fail_quest_percentage, optimistic_rate, expected_rate = rates
+    idlerpg = np.array([sum(ord(c) for c in x) == 621 for x in players],
+                       dtype=bool)
+    pen = 15*1.14**level
+    antiburn = pen*quests_per_day*fail_quest_percentage
+    questable = (level >= 40)
+    quest_opt[questable] = optimistic_rate
+    quest_exp[questable] = np.where(idlerpg, optimistic_rate,
+                                    expected_rate)[questable]
+
+  # godsend/calamity/hog burn is the same for everyone
+  gch = np.repeat(godsend_calamity_hog_burn(stats, None), len(players))
+  return players, dict(battle=battle, gch=gch, align=align, crit=crit,
+                       quest_opt=quest_opt, quest_exp=quest_exp,
+                       antiburn=antiburn)
+
+def get_all_burn_rates(stats):
+  # get_burn_rates() for every player, as a dict keyed by player.  It is
+  # shared until the state changes, so callers must not modify it.
+  def compute():
+    players, arrays = stats.memoized('burn_rate_arrays', burn_rate_arrays, stats)
+    base = arrays['battle'] + arrays['gch'] + arrays['align']
+    return dict(zip(players, zip((base+arrays['quest_opt']).tolist(),
+                                 (base+arrays['quest_exp']).tolist(),
+                                 arrays['antiburn'].tolist())))
+  if not stats:
+    return {}
+  return stats.memoized('all_burn_rates', compute)
+
+def compute_all_burn_info(stats):
+  # compute_burn_info() for every player, as a dict keyed by player
+  def compute():
+    players, arrays = stats.memoized('burn_rate_arrays', burn_rate_arrays, stats)
+    bb, ab, gchb = arrays['battle'], arrays['align'], arrays['gch']
+    columns = (bb, gchb, ab,
+               arrays['quest_opt'], bb+gchb+ab+arrays['quest_opt'],
+               arrays['quest_exp'], bb+gchb+ab+arrays['quest_exp'],
+               arrays['antiburn']/86400, arrays['crit'])
+    return dict(zip(players, zip(*[c.tolist() for c in columns])))
+  if not stats:
+    return {}
+  return stats.memoized('all_burn_info', compute)
+
 def relevant_user(stats, who, show_who):
-  if stats[who]['stronline'] == 'no' and not 'offline' in show_who:
+  if stats[who].stronline == 'no' and not 'offline' in show_who:
     return False
-  if 'highlevel' in show_who and (stats[who]['level'] <= stats['elijah']['level']-2):
+  if 'highlevel' in show_who and (stats[who].level <= stats['elijah'].level-2):
     return False
   return True
 
-def print_summary_info(rpgstats, show_who):
+class Report(object):
+  # What one of the reports below found, before any formatting: rows of
+  # plain values under the given column names (times in seconds, dates as
+  # epochs), and notes for anything that isn't one row per player, such as
+  # the quest under the summary.  to_text lays the report out for people,
+  # the way it has always been printed; render_reports() below can instead
+  # hand the raw values on as JSON or CSV.
+  def __init__(self, name, columns, rows, to_text, **notes):
+    self.name = name
+    self.columns = columns
+    self.rows = rows
+    self.to_text = to_text
+    self.notes = notes
+
+  def text_lines(self):
+    return self.to_text(self)
+
+  def as_dict(self):
+    return dict(report=self.name,
+                rows=[dict(zip(self.columns, row)) for row in self.rows],
+                **self.notes)
+
+def render_reports(reports, output_format, out=sys.stdout):
+  if output_format == 'json':
+    import json
+    # One line per run, so that --follow gives a stream of JSON documents
+    out.write(json.dumps([report.as_dict() for report in reports])+'\n')
+  elif output_format == 'csv':
+    import csv
+    # Each report is a header row and its rows, all tagged with the report
+    # name; notes are only available as JSON
+    writer = csv.writer(out)
+    for report in reports:
+      writer.writerow(('report',)+tuple(report.columns))
+      for row in report.rows:
+        writer.writerow((report.name,)+tuple(row))
+  else:
+    for report in reports:
+      for line in report.text_lines():
+        out.write(line+'\n')
+
+def summary_report(rpgstats, show_who):
+  burn_rates = None
+  if any(rpgstats[x].expected_ttls is None for x in rpgstats):
+    burn_rates = get_all_burn_rates(rpgstats)
+  rows = []
+  for who in sorted(rpgstats, key=lambda x:(rpgstats[x].stronline,rpgstats[x].timeleft)):
+    if not relevant_user(rpgstats, who, show_who):
+      continue
+    ettl1, ettl2 = expected_ttl(rpgstats, who, burn_rates)
+    rows.append((rpgstats[who].level,
+                 rpgstats[who].stronline,
+                 rpgstats[who].itemsum,
+                 rpgstats[who].timeleft,
+                 rpgstats[who].alignment,
+                 float(ettl1), float(ettl2), who))
+  return Report('summary',
+                ('level', 'online', 'itemsum', 'timeleft', 'alignment',
+                 'optimistic_ttl', 'expected_ttl', 'character'),
+                rows, summary_text,
+                quest=quest_info(rpgstats), questers=list(rpgstats.questers))
+
+def summary_text(report):
   print_expected = False
-  # Print out all the information we've collected
   if print_expected:
     brkln="--- --- ---- ------------ ---- ------------ ------------ ---------"
-    print "Lvl On? ISum  Time-to-Lvl Algn   Optimistic Expected TTL character"
+    lines = ["Lvl On? ISum  Time-to-Lvl Algn   Optimistic Expected TTL character"]
   else:
     brkln="--- --- ---- ------------ ---- ------------ ---------"
-    print "Lvl On? ISum  Time-to-Lvl Algn   Approx TTL character"
+    lines = ["Lvl On? ISum  Time-to-Lvl Algn   Approx TTL character"]
   last = True
-  for who in sorted(rpgstats, key=lambda x:(rpgstats[x]['stronline'],rpgstats[x]['timeleft'])):
-    if not relevant_user(rpgstats, who, show_who):
-      continue
-    on = rpgstats[who]['stronline']
+  for level, on, itemsum, timeleft, alignment, ettl1, ettl2, who in report.rows:
     assumed_on = bool(on=='yes')
     if assumed_on ^ last:
-      print brkln
+      lines.append(brkln)
       last = assumed_on
     format_string = '{:3d} {:3s} {:4d} {} {} {} {}'
-    ettl1, ettl2 = expected_ttl(rpgstats, who)
     final_args = (time_format(ettl1), who)
     if print_expected:
       format_string += ' {}'
       final_args = (time_format(ettl1), time_format(ettl2), who)
-    print(format_string.format(
-             rpgstats[who]['level'],
-             on,
-             rpgstats[who]['itemsum'],
-             time_format(rpgstats[who]['timeleft']),
-             rpgstats[who]['alignment'][0:4],
-             *final_args))
-  print("Quest: "+quest_info(rpgstats))
+    lines.append(format_string.format(
+                   level,
+                   on,
+                   itemsum,
+                   time_format(timeleft),
+                   alignment[0:4],
+                   *final_args))
+  lines.append("Quest: "+report.notes['quest'])
+  return lines
 
 def compute_burn_info(rpgstats, who):
   bb = battle_burn(rpgstats, who)
@@ -901,17 +1537,31 @@ def compute_burn_info(rpgstats, who):
   critrate = critical_strike_rate(rpgstats,who)
   return (bb, gchb, ab, qbdef, combdef, qbtweak, combtweak, antiburn/86400, critrate)
 
-def print_detailed_burn_info(rpgstats, show_who):
-  print "Battle g/c/hog align  quest Comb'd    qmod Comb'd  Xburn CritS  Character"
-  print "------ ------ ------ ------ ------  ------ ------  ----- -----  ---------"
-  for who in sorted(rpgstats, key=lambda x:rpgstats[x]['itemsum']):
+def burn_info_report(rpgstats, show_who):
+  burninfo = None
+  if any(rpgstats[x].burnrates is None for x in rpgstats):
+    burninfo = compute_all_burn_info(rpgstats)
+  rows = []
+  for who in sorted(rpgstats, key=lambda x:rpgstats[x].itemsum):
     if not relevant_user(rpgstats, who, show_who):
       continue
-    if 'burnrates' in rpgstats[who]:
-      burnrates = rpgstats[who]['burnrates']
+    if rpgstats[who].burnrates is not None:
+      burnrates = rpgstats[who].burnrates
     else:
-      burnrates = compute_burn_info(rpgstats, who)
-    print '{:6.3f} {:6.3f} {:6.3f} {:6.3f} {:6.3f}  {:6.3f} {:6.3f}  {:5.2f} {:5.3f}  '.format(*burnrates)+who
+      burnrates = burninfo[who]
+    rows.append(tuple(burnrates)+(who,))
+  return Report('burninfo',
+                ('battle', 'gch', 'alignment', 'quest', 'combined',
+                 'quest_modified', 'combined_modified', 'antiburn',
+                 'critical_strike_rate', 'character'),
+                rows, burn_info_text)
+
+def burn_info_text(report):
+  lines = ["Battle g/c/hog align  quest Comb'd    qmod Comb'd  Xburn CritS  Character",
+           "------ ------ ------ ------ ------  ------ ------  ----- -----  ---------"]
+  for row in report.rows:
+    lines.append('{:6.3f} {:6.3f} {:6.3f} {:6.3f} {:6.3f}  {:6.3f} {:6.3f}  {:5.2f} {:5.3f}  '.format(*row[:-1])+row[-1])
+  return lines
 
 def compute_basic_stats(stats, stat_type, for_whom=None):
   statinfo = {}
@@ -921,7 +1571,8 @@ def compute_basic_stats(stats, stat_type, for_whom=None):
     # changes slightly with time making this inexact, but the mean is still
     # correct and we can get an "average" probability p by dividing Np by N,
     # and just assume this average p was constant for a rough approximation.
-    Np, N, actual = stats[who][stat_type]
+    Np, N, actual = getattr(stats[who], stat_type)
+    actual = int(actual)
     p = Np/N if N != 0 else 0
     mean = Np
     sd = math.sqrt(Np*(1-p)) # stddev, for binomial distribution
@@ -930,31 +1581,33 @@ def compute_basic_stats(stats, stat_type, for_whom=None):
     statinfo[who] = (actual, mean, sd, Nsds)
   return statinfo
 
-def print_attacker_stats(stats, show_who):
-  statinfo = compute_basic_stats(stats, 'attack_stats')
-  print "Battle statistics: number of times as attacker"
-  print "actual  mean  stddev #stdevs character"
-  print "------ ------ ------ ------- ---------"
-  for who in sorted(statinfo, key=lambda x:statinfo[x][3]):
-    if not relevant_user(rpgstats, who, show_who):
-      continue
-    print "{:6d} {:6.2f} {:6.2f} {:7.3f} ".format(*statinfo[who]) + who
-
-def print_quest_stats(stats, show_who):
-  statinfo = compute_basic_stats(stats, 'quest_stats')
-  print "Quest statistics: number of times as quester"
-  print "actual  mean  stddev #stdevs character"
-  print "------ ------ ------ ------- ---------"
-  for who in sorted(statinfo, key=lambda x:statinfo[x][3]):
-    if not relevant_user(rpgstats, who, show_who):
-      continue
-    print "{:6d} {:6.2f} {:6.2f} {:7.3f} ".format(*statinfo[who]) + who
+stats_columns = ('count', 'mean', 'stddev', 'stddevs', 'character')
+
+def stats_text(title, header, dashes, row_format):
+  # The to_text of the tables of counts vs. expectations below
+  def to_text(report):
+    lines = [title, header, dashes]
+    for row in report.rows:
+      lines.append(row_format.format(*row[:-1]) + row[-1])
+    return lines
+  return to_text
+
+def basic_stats_report(stats, name, stat_type, title, show_who):
+  statinfo = compute_basic_stats(stats, stat_type)
+  rows = [statinfo[who]+(who,)
+          for who in sorted(statinfo, key=lambda x:statinfo[x][3])
+          if relevant_user(stats, who, show_who)]
+  return Report(name, stats_columns, rows,
+                stats_text(title,
+                           "actual  mean  stddev #stdevs character",
+                           "------ ------ ------ ------- ---------",
+                           "{:6d} {:6.2f} {:6.2f} {:7.3f} "))
 
 def compute_gch_stats(stats, idx, times_per_day, for_whom=None):
   statinfo = {}
   for who in (for_whom or stats):
-    count = stats[who]['gch_stats'][idx]
-    total_time_online = sum(stats[who]['total_time_stats'])
+    count = stats[who].gch_stats[idx]
+    total_time_online = sum(stats[who].total_time_stats)
 
     mean = total_time_online/86400.0 * times_per_day
 
@@ -970,23 +1623,24 @@ def compute_gch_stats(stats, idx, times_per_day, for_whom=None):
     statinfo[who] = (count, mean, stddev, Nsds)
   return statinfo
 
-def print_gch_stats(stats, idx, typestr, times_per_day, show_who):
+def gch_stats_report(stats, name, idx, typestr, times_per_day, show_who):
   statinfo = compute_gch_stats(stats, idx, times_per_day)
-  print "statistics: number of times received "+typestr
-  print "count mean stddev #stdevs character"
-  print "----- ---- ------ ------- ---------"
-  for who in sorted(statinfo, key=lambda x:statinfo[x][3]):
-    if not relevant_user(rpgstats, who, show_who):
-      continue
-    print "{:5d} {:4.1f} {:6.2f} {:7.3f} ".format(*statinfo[who]) + who
+  rows = [statinfo[who]+(who,)
+          for who in sorted(statinfo, key=lambda x:statinfo[x][3])
+          if relevant_user(stats, who, show_who)]
+  return Report(name, stats_columns, rows,
+                stats_text("statistics: number of times received "+typestr,
+                           "count mean stddev #stdevs character",
+                           "----- ---- ------ ------- ---------",
+                           "{:5d} {:4.1f} {:6.2f} {:7.3f} "))
 
 def compute_alignment_stats(stats, idx, times_per_day, for_whom=None):
   statinfo = {}
   for who in (for_whom or stats):
     # alignment stats are: praying_count, forsaken_count, stealing_count
     # So, relevant time for each of those is: good, evil, evil
-    count = stats[who]['alignment_stats'][idx]
-    online_time = stats[who]['total_time_stats'][idx+idx%2]
+    count = stats[who].alignment_stats[idx]
+    online_time = stats[who].total_time_stats[idx+idx%2]
 
     mean = online_time/86400.0*times_per_day
 
@@ -1002,57 +1656,78 @@ def compute_alignment_stats(stats, idx, times_per_day, for_whom=None):
     statinfo[who] = (count, mean, stddev, Nsds)
   return statinfo
 
-def print_alignment_stats(stats, idx, typestr, times_per_day, show_who):
+def alignment_stats_report(stats, name, idx, typestr, times_per_day, show_who):
   statinfo = compute_alignment_stats(stats, idx, times_per_day)
-  print "alignment statistics: "+typestr
-  print "count mean stddev #stdevs character"
-  print "----- ---- ------ ------- ---------"
-  for who in sorted(statinfo, key=lambda x:statinfo[x][3]):
-    if not relevant_user(rpgstats, who, show_who):
-      continue
-    if statinfo[who][1] != 0:
-      print "{:5d} {:4.1f} {:6.2f} {:7.3f} ".format(*statinfo[who]) + who
-
-def print_personal_stats(stats, who):
-  print "personal statistics: "+who
-  print "type          count  mean stddev #stdevs"
-  print "------------- ----- ----- ------ -------"
-  def print_info(stat_type, statinfo):
-    print "{:<13s}".format(stat_type),
-    print "{:5d} {:5.1f} {:6.2f} {:7.3f} ".format(*statinfo[who])
-
-  print_info('Attacker', compute_basic_stats(stats, 'attack_stats', [who]))
-  print_info('Quests', compute_basic_stats(stats, 'quest_stats', [who]))
-  print_info('Light Shining', compute_alignment_stats(stats, 0, 2.0/12, [who]))
-  print_info('Forsakings', compute_alignment_stats(stats, 1, 1.0/16, [who]))
-  print_info('Stealings', compute_alignment_stats(stats, 2, 1.0/16, [who]))
-  print_info('Godsend-item', compute_gch_stats(stats, 0, 1.0/40, [who]))
-  print_info('Godsend-time', compute_gch_stats(stats, 1, 9.0/40, [who]))
-  print_info('Calamity-item', compute_gch_stats(stats, 2, 1.0/80, [who]))
-  print_info('Calamity-time', compute_gch_stats(stats, 3, 9.0/80, [who]))
-  print_info('Hand of God', compute_gch_stats(stats, 4, 1.0/20, [who]))
-
-def print_item_stats(stats, show_who):
-  item_list = ("ring",
-               "amulet",
-               "charm",
-               "weapon",
-               "helm",
-               "tunic",
-               "pair of gloves",
-               "set of leggings",
-               "shield",
-               "pair of boots")
-  for item in item_list:
-    print "  {:8s}".format(item.split()[-1]),
-  print 'character'
+  rows = [statinfo[who]+(who,)
+          for who in sorted(statinfo, key=lambda x:statinfo[x][3])
+          if relevant_user(stats, who, show_who) and statinfo[who][1] != 0]
+  return Report(name, stats_columns, rows,
+                stats_text("alignment statistics: "+typestr,
+                           "count mean stddev #stdevs character",
+                           "----- ---- ------ ------- ---------",
+                           "{:5d} {:4.1f} {:6.2f} {:7.3f} "))
+
+def personal_stats_report(stats, who):
+  rows = []
+  for stat_type, statinfo in (
+      ('Attacker', compute_basic_stats(stats, 'attack_stats', [who])),
+      ('Quests', compute_basic_stats(stats, 'quest_stats', [who])),
+      ('Light Shining', compute_alignment_stats(stats, 0, 2.0/12, [who])),
+      ('Forsakings', compute_alignment_stats(stats, 1, 1.0/16, [who])),
+      ('Stealings', compute_alignment_stats(stats, 2, 1.0/16, [who])),
+      ('Godsend-item', compute_gch_stats(stats, 0, 1.0/40, [who])),
+      ('Godsend-time', compute_gch_stats(stats, 1, 9.0/40, [who])),
+      ('Calamity-item', compute_gch_stats(stats, 2, 1.0/80, [who])),
+      ('Calamity-time', compute_gch_stats(stats, 3, 9.0/80, [who])),
+      ('Hand of God', compute_gch_stats(stats, 4, 1.0/20, [who]))):
+    rows.append((stat_type,)+statinfo[who])
+  return Report('personal', ('type',)+stats_columns[:-1], rows,
+                personal_stats_text, character=who)
+
+def personal_stats_text(report):
+  lines = ["personal statistics: "+report.notes['character'],
+           "type          count  mean stddev #stdevs",
+           "------------- ----- ----- ------ -------"]
+  for row in report.rows:
+    lines.append("{:<13s} ".format(row[0]) +
+                 "{:5d} {:5.1f} {:6.2f} {:7.3f} ".format(*row[1:]))
+  return lines
+
+def item_stats_report(stats, show_who):
+  item_list = Player.item_names
   factor = {'good':1.1, 'neutral':1.0, 'evil':0.9}
-  for who in sorted(stats, key=lambda x:stats[x]['itemsum']/factor[stats[x]['alignment']]):
-    if not relevant_user(rpgstats, who, show_who):
+  rows = []
+  for who in sorted(stats, key=lambda x:stats[x].itemsum/factor[stats[x].alignment]):
+    if not relevant_user(stats, who, show_who):
       continue
-    for item in item_list:
-      print "{:3d} ({:3.0f}%)".format(*stats[who]['item_stats'][item]),
-    print who
+    rows.append(sum((stats[who].item_stats[item] for item in item_list), ()) +
+                (who,))
+  columns = []
+  for item in item_list:
+    columns += [item.split()[-1], item.split()[-1]+'_confidence']
+  return Report('item', tuple(columns)+('character',), rows, item_stats_text)
+
+def item_stats_text(report):
+  items = report.columns[0:-1:2]
+  lines = [' '.join("  {:8s}".format(item) for item in items)+' character']
+  for row in report.rows:
+    lines.append(' '.join("{:3d} ({:3.0f}%)".format(*row[i:i+2])
+                          for i in xrange(0, len(row)-1, 2)) + ' ' + row[-1])
+  return lines
+
+def line_types_report(stats):
+  total = sum(stats.line_counts.values())
+  rows = [(count, 100.0*count/total, line_type)
+          for line_type, count in stats.line_counts.most_common()]
+  return Report('line_types', ('count', 'percent', 'line_type'), rows,
+                line_types_text)
+
+def line_types_text(report):
+  lines = ["  count percent line type",
+           "------- ------- ---------"]
+  for row in report.rows:
+    lines.append("{:7d} {:6.2f}% {}".format(*row))
+  return lines
 
 def plot_levels(rpgstats, show_who):
   import matplotlib.pyplot as plt
@@ -1074,92 +1749,463 @@ def plot_levels(rpgstats, show_who):
 
   plt.show()
 
-def print_next_levelling(stats, show_who):
+LevelPrediction = namedtuple('LevelPrediction', 'when who level')
+
+def predict_levelling(stats, horizon_days=None, max_levelups=None):
+  # Simulate everyone currently online burning down at their expected rates
+  # and return a LevelPrediction for each level gained, in order, until
+  # horizon_days have passed, max_levelups levels have been gained, or no
+  # one can level anymore.  Each player's predicted level time is kept in a
+  # heap, and only recomputed when something their burn rates depend on
+  # changes: their own level, or another player crossing a threshold that
+  # battle_burn or quest_burn looks at.
   def basic_time_to_level(level):
     return 600*1.16**min(level,60) + 86400*max(level-60, 0)
-  onliners = [who for who in stats if stats[who]['online']]
-
-  cur = now
-  ettl = {}
-  br = {}
-  ab = {}
-  while True:
-    minpair = (float('inf'), None)
-    # Find the burn rate, antiburn, and expected ttl for each player
-    # as well as the player with least expected ttl
+  def opponent_traits(level):
+    return (max(7,level/4), max(7,level/7), level >= 40, level >= 45)
+  onliners = [who for who in stats if stats[who].online]
+  end_time = now+horizon_days*86400 if horizon_days is not None else float('inf')
+
+  anchor = {}  # who -> (time, ttl at that time, burn rate, antiburn)
+  version = dict.fromkeys(onliners, 0)
+  heap = []
+  def schedule(who, cur, ttl, burn_rate, antiburn):
+    anchor[who] = (cur, ttl, burn_rate, antiburn)
+    version[who] += 1
+    when = cur + solve_ttl_to_0(ttl, burn_rate, antiburn)
+    heapq.heappush(heap, (when, version[who], who))
+  def ttl_at(who, cur):
+    then, ttl, burn_rate, antiburn = anchor[who]
+    return advance_by_time(ttl, burn_rate, antiburn, cur-then)
+
+  saved_levels = dict((who, stats[who].level) for who in onliners)
+  predictions = []
+  try:
+    burn_rates = get_all_burn_rates(stats)
     for who in onliners:
-      br1, br2, antiburn = get_burn_rates(stats, who)
-      br[who] = br2
-      ab[who] = antiburn
-      ettl[who] = solve_ttl_to_0(stats[who]['timeleft'], br2, antiburn)
-      if ettl[who] < minpair[0]:
-        minpair = ettl[who], who
-
-    # Advance time by least expected ttl
-    t_adv, who_adv = minpair
-    if who_adv is None:
-      raise SystemExit("No more levelling.")
-    cur += t_adv
-
-    # Advance each player forward in time by least expected ttl
-    for who in onliners:
-      stats[who]['timeleft'] = advance_by_time(stats[who]['timeleft'], br[who],
-                                               ab[who], t_adv)
-    # Advance specified player to next level
-    stats[who_adv]['level'] += 1
-    stats[who_adv]['timeleft'] = basic_time_to_level(stats[who_adv]['level'])
-
-    # Notify that who_adv is expected to level at the given time
-    if relevant_user(stats, who_adv, show_who):
-      timestr = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(cur))
-      print("{} {:3d} {}".format(timestr, stats[who_adv]['level'], who_adv))
-
-def show_quit_strategy(stats, quitters, show_who):
+      br1, br2, antiburn = burn_rates[who]
+      schedule(who, now, stats[who].timeleft, br2, antiburn)
+
+    while heap and len(predictions) != max_levelups:
+      cur, ver, who_adv = heapq.heappop(heap)
+      if ver != version[who_adv]:
+        continue  # Stale; this player was rescheduled since
+      if cur == float('inf') or cur > end_time:
+        break
+
+      old_traits = opponent_traits(stats[who_adv].level)
+      stats[who_adv].level += 1
+      stats.state_changed()
+      level = stats[who_adv].level
+      predictions.append(LevelPrediction(cur, who_adv, level))
+
+      if opponent_traits(level) == old_traits:
+        br1, br2, antiburn = get_burn_rates(stats, who_adv)
+        schedule(who_adv, cur, basic_time_to_level(level), br2, antiburn)
+      else:
+        burn_rates = get_all_burn_rates(stats)
+        for who in onliners:
+          br1, br2, antiburn = burn_rates[who]
+          ttl = basic_time_to_level(level) if who == who_adv else ttl_at(who, cur)
+          schedule(who, cur, ttl, br2, antiburn)
+  finally:
+    for who in saved_levels:
+      stats[who].level = saved_levels[who]
+    stats.state_changed()
+  return predictions
+
+def levelling_report(stats, show_who, horizon_days=None, max_levelups=None):
+  predictions = predict_levelling(stats, horizon_days, max_levelups)
+  rows = [(prediction.when, prediction.level, prediction.who)
+          for prediction in predictions
+          if relevant_user(stats, prediction.who, show_who)]
+  return Report('levelling', ('when', 'level', 'character'), rows,
+                levelling_text,
+                complete=(horizon_days is None and max_levelups is None))
+
+def levelling_text(report):
+  lines = []
+  for when, level, who in report.rows:
+    # Notify that who is expected to level at the given time
+    timestr = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when))
+    lines.append("{} {:3d} {}".format(timestr, level, who))
+  if report.notes['complete']:
+    lines.append("No more levelling.")
+  return lines
+
+def realm_parameters(stats):
+  # The parts of the realm the Monte Carlo simulation needs, as plain
+  # numpy arrays over the players currently online (offline players do
+  # not take part in anything), so they can be handed to worker processes.
+  import numpy as np
+  players = [who for who in stats if stats[who].online]
+  alignment = [stats[who].alignment for who in players]
+  return dict(players  = players,
+              level    = np.array([stats[x].level for x in players], dtype=float),
+              timeleft = np.array([stats[x].timeleft for x in players], dtype=float),
+              itemsum  = np.array([stats[x].itemsum for x in players], dtype=float),
+              good     = np.array([x == 'good' for x in alignment], dtype=bool),
+              evil     = np.array([x == 'evil' for x in alignment], dtype=bool),
+              idlerpg_sum = 1+max(stats[x].itemsum for x in stats),
+              quest_rates = quest_rates(stats))
+
+def simulate_realm(params, seed, trials, max_days):
+  # Run trials independent simulations of the realm in lockstep, an hour at
+  # a time, sampling the same events at the same rates that the burn rate
+  # functions (battle_burn, godsend_calamity_hog_burn, alignment_burn,
+  # quest_burn) average over.  Returns a trials x players array of the
+  # time until each player next levels, inf if not within max_days.
+  import numpy as np
+  rng = np.random.RandomState(seed)
+  oncount = len(params['players'])
+  itemsum = np.append(params['itemsum'], params['idlerpg_sum'])
+  level = np.tile(params['level'], (trials, 1))
+  ttl = np.tile(params['timeleft'], (trials, 1))
+  result = np.empty((trials, oncount))
+  result.fill(np.inf)
+  pending = np.ones((trials, oncount), dtype=bool)
+  good, evil = params['good'], params['evil']
+
+  def fight(rows, attacker, opp):
+    # opp == oncount means the idlerpg user
+    odds_win = itemsum[attacker]/(itemsum[attacker]+itemsum[opp]+1e-25)
+    opp_level = level[rows, np.minimum(opp, oncount-1)]
+    gain = np.where(opp == oncount, 20, np.maximum(7, opp_level//4))
+    loss = np.where(opp == oncount, 10, np.maximum(7, opp_level//7))
+    won = rng.random_sample(len(rows)) < odds_win
+    ttl[rows, attacker] *= np.where(won, 1-gain/100.0, 1+loss/100.0)
+  def random_opponents(attacker):
+    # Uniformly among the other oncount-1 players plus idlerpg
+    opp = rng.randint(0, oncount, size=len(attacker))
+    return opp + (opp >= attacker)
+  def nudge(hit, low, high):
+    # Multiply ttl by 1+U(low,high) wherever hit
+    ttl[hit] *= 1+rng.uniform(low, high, size=hit.sum())
+
+  elapsed = 0
+  while pending.any() and elapsed < max_days*86400:
+    # Hourly battle, between a random level 45+ player and a random opponent
+    eligible = (level >= 45)
+    keys = np.where(eligible, rng.random_sample((trials, oncount)), -1)
+    rows = np.flatnonzero(eligible.any(axis=1))
+    attacker = keys[rows].argmax(axis=1)
+    fight(rows, attacker, random_opponents(attacker))
+
+    # Grid collisions; 1.5ish per day spread among those online
+    rows, attacker = np.nonzero(rng.random_sample((trials, oncount)) <
+                                1.5/oncount/24)
+    fight(rows, attacker, random_opponents(attacker))
+
+    # Godsends, calamities, and hand of god
+    roll = rng.random_sample((trials, oncount))
+    nudge(roll < .9*(1.0/4)/24, -.12, -.05)
+    nudge((roll >= .9*(1.0/4)/24) & (roll < .9*(1.0/4+1.0/8)/24), .05, .12)
+    hog = rng.random_sample((trials, oncount)) < .05/24
+    favored = rng.random_sample((trials, oncount)) < .8
+    nudge(hog & favored, -.75, -.05)
+    nudge(hog & ~favored, .05, .75)
+
+    # Alignment events
+    if good.sum() >= 2:
+      nudge(good & (rng.random_sample((trials, oncount)) < 2*(1.0/12)/24),
+            -.12, -.05)
+    nudge(evil & (rng.random_sample((trials, oncount)) < .5*(1.0/8)/24),
+          .01, .05)
+
+    # Quests; either four eligible players get 25% off, or it fails and
+    # everyone gets a p15 penalty
+    if params['quest_rates']:
+      quests_per_day, fail_quest_percentage = params['quest_rates'][0:2]
+      eligible = (level >= 40)
+      done = (rng.random_sample(trials) < quests_per_day/24) & \
+             (eligible.sum(axis=1) >= 4)
+      failed = done & (rng.random_sample(trials) < fail_quest_percentage)
+      ttl[failed] += 15*1.14**level[failed]
+      rows = np.flatnonzero(done & ~failed)
+      keys = np.where(eligible[rows], rng.random_sample((len(rows), oncount)), -1)
+      questers = np.argsort(-keys, axis=1)[:, 0:4]
+      ttl[rows[:,np.newaxis], questers] *= .75
+
+    # Let an hour pass, and level up anyone who made it
+    ttl -= 3600
+    elapsed += 3600
+    levelled = (ttl <= 0)
+    first = levelled & pending
+    result[first] = elapsed + ttl[first]
+    pending &= ~levelled
+    level[levelled] += 1
+    ttl[levelled] += 600*1.16**np.minimum(level[levelled],60) + \
+                     86400*np.maximum(level[levelled]-60, 0)
+  return result
+
+def simulate_realm_job(job):
+  return simulate_realm(*job)
+
+def ttl_distribution(stats, trials, seed=None, max_days=100, processes=None):
+  # Spread the simulations across a pool of worker processes, in chunks
+  # that each get their own seed (seed, seed+1, ...), so that results for
+  # a given seed do not depend on how many workers there are.  Returns
+  # the online players and a trials x players array of TTLs.
+  import multiprocessing
+  import numpy as np
+  params = realm_parameters(stats)
+  if not params['players']:
+    return [], np.empty((trials, 0))
+  if seed is None:
+    seed = np.random.RandomState().randint(2**31)
+  chunk_size = 250
+  jobs = [(params, seed+i, min(chunk_size, trials-start), max_days)
+          for i, start in enumerate(xrange(0, trials, chunk_size))]
+  pool = multiprocessing.Pool(processes)
+  try:
+    results = pool.map(simulate_realm_job, jobs)
+  finally:
+    pool.close()
+    pool.join()
+  return params['players'], np.concatenate(results)
+
+def ttl_bands_report(stats, show_who, trials, seed):
+  import numpy as np
+  players, ttls = ttl_distribution(stats, trials, seed)
+  bands = np.percentile(ttls, [10, 50, 90], axis=0, interpolation='nearest')
+  burn_rates = get_all_burn_rates(stats)
+  rows = []
+  for i in np.argsort(bands[1], kind='mergesort'):
+    who = players[i]
+    if not relevant_user(stats, who, show_who):
+      continue
+    ettl_opt, ettl_exp = expected_ttl(stats, who, burn_rates)
+    rows.append((stats[who].level,
+                 stats[who].timeleft,
+                 float(ettl_exp),
+                 float(bands[0][i]),
+                 float(bands[1][i]),
+                 float(bands[2][i]),
+                 who))
+  return Report('ttl_bands',
+                ('level', 'timeleft', 'expected_ttl', 'ttl_10th_percentile',
+                 'ttl_median', 'ttl_90th_percentile', 'character'),
+                rows, ttl_bands_text, trials=trials)
+
+def ttl_bands_text(report):
+  lines = ["Lvl  Time-to-Lvl     Expected  10% of runs  50% of runs  90% of runs character",
+           "--- ------------ ------------ ------------ ------------ ------------ ---------"]
+  for row in report.rows:
+    lines.append('{:3d} {} {} {} {} {} {}'.format(
+                   row[0], *([time_format(x) for x in row[1:6]] + [row[6]])))
+  return lines
+
+# Forecasting from the realm's rand48 stream, once guess_seed.py and
+# fill-out-seeds.py have found where it is.  Per rand-calls.txt, every
+# self_clock cycle makes one check each for a hand of God, team battle,
+# calamity, godsend, evilness and goodness, then two calls per player for
+# each of moveplayers' three steps (one for questers on a location quest).
+# An hour is one call, 1200 cycles, then the hourly battle's five calls
+# ending with the attacker and defender rolls, and two more if the attacker
+# won.
+self_clock = 3
+realm_checks = [  # event, days between events per player, players counted
+  ('hand of God', 20, 'online'),
+  ('team battle', 24, 'online'),
+  ('calamity',     8, 'online'),
+  ('godsend',      4, 'online'),
+  ('evilness',     8, 'evil'),
+  ('goodness',    12, 'good'),
+]
+# The share of hours, in tracked logs, without rand() calls the model can't
+# see (collisions, steals, how many items find_item tried, ...); a forecast
+# is only right if the stream hasn't been shifted by any of those.
+exact_hour_odds = 0.45
+
+def realm_calls(stats):
+  # (players online, good, evil, rand() calls per self_clock cycle)
+  online = [who for who in stats if stats[who].online]
+  good = sum(stats[x].alignment == 'good' for x in online)
+  evil = sum(stats[x].alignment == 'evil' for x in online)
+  questing = 0
+  if stats.quest_positions:
+    questing = sum(1 for x in stats.questers if stats[x].online)
+  return len(online), good, evil, 6+6*len(online)-3*questing
+
+class SeedTracker(object):
+  # Where the realm's rand48 stream is: the seed as of the defender roll of
+  # an hourly battle.  It starts from the last battle in an annotated log
+  # written by fill-out-seeds.py, and follows the hourly battles parsed
+  # since by finding each one's rolls just past where the model expects.
+  max_hours = 72  # Don't look for battles further than this from the last
+  annotated_re = re.compile(r'\s*\d+ +(\d+) +-?\d+ +-?\d+ '
+                            r'([\d-]{10} [\d:]{8})(.*)')
+  def __init__(self, seeds_file):
+    self.seed = None
+    with open(seeds_file) as f:
+      for line in f:
+        m = SeedTracker.annotated_re.match(line)
+        if m:
+          self.seed = int(m.group(1))
+          self.epoch = convert_log_time_to_epoch(m.group(2))
+          self.won = ' and won!' in m.group(3)
+    if self.seed is None:
+      raise SystemExit("No tracked battles in {}".format(seeds_file))
+    self.in_sync = True
+
+  def sync(self, stats):
+    # The calls expected up to each battle are added up hour by hour, at the
+    # rate of rand() calls recorded for the hours before each battle, so
+    # that players coming and going or questing along the way are followed
+    import numpy as np
+    import rand48
+    expected = 2 if self.won else 0
+    last = self.epoch
+    for epoch, (aroll, asum, droll, dsum), won, cycle_calls in stats.hourly_battles:
+      if epoch <= self.epoch:
+        continue
+      expected += int(round(max(1, round((epoch-last)/3600.0)) *
+                            (1200*cycle_calls+6)))
+      last = epoch
+      hours = max(1, int(round((epoch-self.epoch)/3600.0)))
+      if hours > SeedTracker.max_hours:
+        self.in_sync = False
+        continue
+      lo, hi = max(2, expected-64), expected+256*hours
+      fractions = rand48.stream(self.seed, hi).astype(np.float64)/rand48.m
+      # fractions[k-1] is what the k'th call after the anchor gets
+      hits = ((np.floor(fractions[lo-2:hi-2]*asum) == aroll) &
+              (np.floor(fractions[lo-1:hi-1]*dsum) == droll))
+      counts = lo + np.flatnonzero(hits)
+      if not counts.size:
+        self.in_sync = False
+        expected += 2 if won else 0
+        continue
+      count = counts[np.argmin(abs(counts-expected))]
+      self.seed = rand48.jump(self.seed, int(count))
+      self.epoch, self.won, self.in_sync = epoch, won, True
+      expected = 2 if won else 0
+
+def forecast_realm(seed, won, online, good, evil, cycle_calls, hours):
+  # Roll the stream forward from the defender roll of the last hourly
+  # battle, returning (seconds later, confidence, what) for each event and
+  # hourly battle the model says is coming.
+  import numpy as np
+  import rand48
+  counted = {'online': online, 'good': good, 'evil': evil}
+  spans = np.array([days*86400/self_clock for name, days, who in realm_checks])
+  limits = np.array([counted[who] for name, days, who in realm_checks])
+  # A team battle is 2 calls plus a Fisher-Yates shuffle of everyone online,
+  # which takes one call fewer than there are players.
+  event_calls = {'hand of God': 3, 'team battle': 1+online,
+                 'calamity': 3, 'godsend': 3, 'evilness': 3,
+                 'goodness': 1+max(0, good-2)}
+  margin = hours*(64 + sum(event_calls.values()))
+  fractions = rand48.stream(seed, hours*(1200*cycle_calls+6)+margin+2)
+  fractions = fractions.astype(np.float64)/rand48.m
+
+  forecast = []
+  pos = 2 if won else 0  # Index of the next call's fraction
+  confidence = 1.0
+  for hour in xrange(hours):
+    pos += 1
+    cycle = 0
+    while cycle < 1200:
+      # Find the next cycle with an event at or after this one
+      starts = pos + cycle_calls*np.arange(1200-cycle)
+      hit = (fractions[starts[:, None]+np.arange(6)]*spans < limits)
+      cycles = np.flatnonzero(hit.any(axis=1))
+      if not cycles.size:
+        pos += cycle_calls*(1200-cycle)
+        break
+      cycle += cycles[0]
+      pos += cycle_calls*cycles[0]
+      # Go through that cycle's checks, as each event shifts the rest
+      check_pos = pos
+      for (name, days, who), span, limit in zip(realm_checks, spans, limits):
+        if fractions[check_pos]*span < limit:
+          when = (hour*1200+cycle+1)*self_clock
+          hour_share = exact_hour_odds**(float(cycle)/1200)
+          forecast.append((when, confidence*hour_share, name))
+          check_pos += event_calls[name]
+          if name in ('calamity', 'godsend', 'evilness'):
+            # These can make more calls than we know of
+            confidence /= 2
+        check_pos += 1
+      pos = check_pos + cycle_calls-6
+      cycle += 1
+    # The hourly battle; call pos+2 picks whether idlerpg is the opponent
+    # (rand(#online) < 1), then come the attacker and defender rolls.
+    when = (hour+1)*(1200*self_clock)
+    against = ' against idlerpg' if fractions[pos+2]*online < 1 else ''
+    confidence *= exact_hour_odds
+    forecast.append((when, confidence,
+                     'battle{}: attacker rolls {:.0%} of their sum, '
+                     'defender {:.0%}'.format(against, fractions[pos+3],
+                                              fractions[pos+4])))
+    pos += 5
+  return forecast
+
+def battle_forecast_report(stats, tracker, horizon_days=None):
+  tracker.sync(stats)
+  hours = int(math.ceil(24*horizon_days)) if horizon_days else 6
+  online, good, evil, cycle_calls = realm_calls(stats)
+  rows = [(tracker.epoch+when, float(confidence), what)
+          for when, confidence, what in forecast_realm(tracker.seed,
+                                                       tracker.won, online,
+                                                       good, evil,
+                                                       cycle_calls, hours)]
+  return Report('battle_forecast', ('when', 'confidence', 'what'), rows,
+                battle_forecast_text, from_battle=tracker.epoch,
+                seed=tracker.seed, in_sync=tracker.in_sync)
+
+def battle_forecast_text(report):
+  notes = report.notes
+  lines = ["Forecast from the hourly battle at {} (seed {}){}:".format(
+             time.strftime('%Y-%m-%d %H:%M:%S',
+                           time.localtime(notes['from_battle'])),
+             notes['seed'], '' if notes['in_sync'] else '; lost sync since'),
+           "When                Conf  What",
+           "------------------- ----  ----"]
+  for when, confidence, what in report.rows:
+    lines.append("{} {:4.0%}  {}".format(
+                   time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when)),
+                   confidence, what))
+  return lines
+
+def quit_strategy_report(stats, quitters, show_who):
   penalties = {}
+  burn_rates = get_all_burn_rates(stats)
   for who in stats:
-    if not stats[who]['online']:
+    if not stats[who].online:
       continue
     penrate = 16 if who == quitters[0] else 15
     mult = 0.75 if who in quitters else 1
-    penalty = penrate*1.14**stats[who]['level']
-    br1, br2, ab = get_burn_rates(stats, who)
+    penalty = penrate*1.14**stats[who].level
+    br1, br2, ab = burn_rates[who]
 
-    ettl_finish_opt = solve_ttl_to_0(mult*stats[who]['timeleft'], br1, 0)
-    ettl_quit_opt = solve_ttl_to_0(penalty+stats[who]['timeleft'], br1, 0)
+    ettl_finish_opt = solve_ttl_to_0(mult*stats[who].timeleft, br1, 0)
+    ettl_quit_opt = solve_ttl_to_0(penalty+stats[who].timeleft, br1, 0)
 
-    ettl_finish_exp = solve_ttl_to_0(mult*stats[who]['timeleft'], br2, ab)
-    ettl_quit_exp = solve_ttl_to_0(penalty+stats[who]['timeleft'], br2, ab)
+    ettl_finish_exp = solve_ttl_to_0(mult*stats[who].timeleft, br2, ab)
+    ettl_quit_exp = solve_ttl_to_0(penalty+stats[who].timeleft, br2, ab)
     penalties[who] = (penalty,
-                      ettl_quit_opt-ettl_finish_opt,
-                      ettl_quit_exp-ettl_finish_exp)
-
-  print "Lvl PlainPenalty XtraOptimstc XtraExpected character"
-  print "--- ------------ ------------ ------------ ---------"
-  for who in sorted(penalties, key=lambda x:penalties[x][1]):
-    if not relevant_user(stats, who, show_who):
-      continue
-    print('{:3d} {} {} {} {}'.format(
-             stats[who]['level'],
-             time_format(penalties[who][0]),
-             time_format(penalties[who][1]),
-             time_format(penalties[who][2]),
-             who))
-
-  # Find out any important folks who might go up a level before quest ends
-  if stats.questers:
-    possible_levellers = ""
-    if not stats.quest_time_left and \
-       len(stats.quest_times[stats.quest_positions]) == 0:
-      print "No stats about this quest found; unknown who may level before the quest ends."
-      return
-    for who in sorted(stats, key=lambda x:stats[x]['level']):
+                      float(ettl_quit_opt-ettl_finish_opt),
+                      float(ettl_quit_exp-ettl_finish_exp))
+  rows = [(stats[who].level,)+penalties[who]+(who,)
+          for who in sorted(penalties, key=lambda x:penalties[x][1])
+          if relevant_user(stats, who, show_who)]
+
+  # Find out any important folks who might go up a level before quest ends;
+  # None if there is a quest but we know nothing about how long it will take
+  possible_levellers = []
+  if stats.questers and not stats.quest_time_left and \
+     len(stats.quest_times[stats.quest_positions]) == 0:
+    possible_levellers = None
+  elif stats.questers:
+    for who in sorted(stats, key=lambda x:stats[x].level):
       # Ignore them if they can't go up a level, or are otherwise not relevant
       if not relevant_user(stats, who, show_who):
         continue
 
       # Find out the odds of them levelling before quest ends; assuming
       # optimistic burndown rate
-      ettl_opt, ettl_exp = expected_ttl(stats, who)
+      ettl_opt, ettl_exp = expected_ttl(stats, who, burn_rates)
       if stats.quest_time_left:
         quest_end = now+stats.quest_time_left
         odds = 1 if (quest_end > now+ettl_opt) else 0
@@ -1169,27 +2215,318 @@ def show_quit_strategy(stats, quitters, show_who):
         odds = num_longer_quests/len(stats.quest_times[stats.quest_positions])
       # If this person might level, include their info
       if odds > 0:
-        possible_levellers += " {} ({:.1f}%)".format(who, int(100*odds))
-    print("Folks who may level before quest completes:" +
-          (possible_levellers or " No one."))
-
-def show_flat_slopes(stats, show_who):
-  penalties = {}
-  print "Lvl FlatOptimstc FlatExpected character"
-  print "--- ------------ ------------ ---------"
-  for who in sorted(stats, key=lambda x:stats[x]['level']):
+        possible_levellers.append((who, odds))
+  return Report('quit_strategy',
+                ('level', 'penalty', 'extra_optimistic', 'extra_expected',
+                 'character'),
+                rows, quit_strategy_text, quitters=quitters,
+                questers=list(stats.questers),
+                possible_levellers=possible_levellers)
+
+def quit_options(questers):
+  # Every quitter list quit_strategy_report() could be given for these
+  # questers: any non-empty subset of them losing the 25% bonus, in any
+  # order, led by whoever quits first (p16) or by '' if that isn't known.
+  # Only who is first matters, so each subset is taken in quester order
+  # after the first quitter rather than in every ordering.
+  for size in xrange(1, len(questers)+1):
+    for subset in itertools.combinations(questers, size):
+      yield ('',)+subset
+      for first in subset:
+        yield (first,)+tuple(x for x in subset if x != first)
+
+def quit_strategy_search(stats):
+  # The extra optimistic and expected time everyone online would need to
+  # level under each of quit_options(), as (quitters, extra_opt, extra_exp)
+  # with numpy arrays indexed like the returned list of players.  Each
+  # player has only two possible finishing ttls (with or without the
+  # bonus) and two quitting ttls (p15 or p16), so those are all solved up
+  # front and each option just picks from them.
+  import numpy as np
+  players = [who for who in stats if stats[who].online]
+  burn_rates = get_all_burn_rates(stats)
+  br1, br2, ab = [np.array(x) for x in zip(*[burn_rates[who] for who in players])] \
+                 if players else (np.array([]),)*3
+  timeleft = np.array([stats[who].timeleft for who in players], dtype=float)
+  level = np.array([stats[who].level for who in players], dtype=float)
+  finish = dict(((rate, mult), solve_ttls_to_0(mult*timeleft, br, antiburn))
+                for rate, br, antiburn in (('opt', br1, 0), ('exp', br2, ab))
+                for mult in (1, 0.75))
+  quit = dict(((rate, penrate),
+               solve_ttls_to_0(penrate*1.14**level+timeleft, br, antiburn))
+              for rate, br, antiburn in (('opt', br1, 0), ('exp', br2, ab))
+              for penrate in (15, 16))
+  options = []
+  for quitters in quit_options(stats.questers):
+    first = np.array([who == quitters[0] for who in players], dtype=bool)
+    bonus = np.array([who in quitters for who in players], dtype=bool)
+    extra_opt, extra_exp = [np.where(first, quit[rate, 16], quit[rate, 15]) -
+                            np.where(bonus, finish[rate, 0.75], finish[rate, 1])
+                            for rate in ('opt', 'exp')]
+    options.append((quitters, extra_opt, extra_exp))
+  return players, options
+
+def pareto_best(costs):
+  # Indices of the rows of costs that no other row is at least as good as
+  # everywhere and better than somewhere, lower being better
+  import numpy as np
+  costs = np.asarray(costs, dtype=float)
+  no_worse = (costs[:,np.newaxis,:] <= costs[np.newaxis,:,:]).all(axis=2)
+  better = (costs[:,np.newaxis,:] < costs[np.newaxis,:,:]).any(axis=2)
+  dominated = (no_worse & better).any(axis=0)
+  return [i for i in xrange(len(costs)) if not dominated[i]]
+
+def quit_search_report(stats):
+  # The quit options that no other option sets everyone online back less
+  # than (going by the expected times), least setback on average first
+  players, options = quit_strategy_search(stats)
+  rows = []
+  setbacks = {}
+  if options and players:
+    for i in pareto_best([extra_exp for quitters, extra_opt, extra_exp in options]):
+      quitters, extra_opt, extra_exp = options[i]
+      worst = extra_exp.argmax()
+      rows.append((','.join(quitters), float(extra_opt.mean()),
+                   float(extra_exp.mean()), float(extra_exp[worst]),
+                   players[worst]))
+      setbacks[','.join(quitters)] = dict(zip(players, extra_exp.tolist()))
+  rows.sort(key=lambda row: row[2])
+  return Report('quit_search',
+                ('quitters', 'mean_extra_optimistic', 'mean_extra_expected',
+                 'max_extra_expected', 'hardest_hit'),
+                rows, quit_search_text, questers=list(stats.questers),
+                options_considered=len(options), setbacks=setbacks)
+
+def quit_search_text(report):
+  if not report.notes['questers']:
+    return ["No quest to quit."]
+  lines = ["Pareto-best quit strategies ({} of {} considered):".format(
+             len(report.rows), report.notes['options_considered']),
+           "MeanOptimstc MeanExpected  MaxExpected hardest hit / quitters",
+           "------------ ------------ ------------ ----------------------"]
+  for quitters, mean_opt, mean_exp, max_exp, who in report.rows:
+    lines.append('{} {} {} {} / {}'.format(
+                   time_format(mean_opt),
+                   time_format(mean_exp),
+                   time_format(max_exp),
+                   who, quitters))
+  return lines
+
+def quit_strategy_text(report):
+  lines = ["Lvl PlainPenalty XtraOptimstc XtraExpected character",
+           "--- ------------ ------------ ------------ ---------"]
+  for level, penalty, extra_opt, extra_exp, who in report.rows:
+    lines.append('{:3d} {} {} {} {}'.format(
+                   level,
+                   time_format(penalty),
+                   time_format(extra_opt),
+                   time_format(extra_exp),
+                   who))
+  possible_levellers = report.notes['possible_levellers']
+  if possible_levellers is None:
+    lines.append("No stats about this quest found; unknown who may level before the quest ends.")
+  elif report.notes['questers']:
+    lines.append("Folks who may level before quest completes:" +
+                 (''.join(" {} ({:.1f}%)".format(who, int(100*odds))
+                          for who, odds in possible_levellers) or " No one."))
+  return lines
+
+def flat_slopes_report(stats, show_who):
+  burn_rates = get_all_burn_rates(stats)
+  rows = []
+  for who in sorted(stats, key=lambda x:stats[x].level):
     if not relevant_user(stats, who, show_who):
       continue
-    br1, br2, ab = get_burn_rates(stats, who)
-
-    flat_ttl_opt = solve_for_flat_slope(stats[who]['timeleft'], br1, 0)
-    flat_ttl_exp = solve_for_flat_slope(stats[who]['timeleft'], br2, ab)
+    br1, br2, ab = burn_rates[who]
+
+    flat_ttl_opt = solve_for_flat_slope(stats[who].timeleft, br1, 0)
+    flat_ttl_exp = solve_for_flat_slope(stats[who].timeleft, br2, ab)
+    rows.append((stats[who].level, float(flat_ttl_opt), float(flat_ttl_exp),
+                 who))
+  return Report('flat_slopes',
+                ('level', 'flat_optimistic', 'flat_expected', 'character'),
+                rows, flat_slopes_text)
+
+def flat_slopes_text(report):
+  lines = ["Lvl FlatOptimstc FlatExpected character",
+           "--- ------------ ------------ ---------"]
+  for level, flat_ttl_opt, flat_ttl_exp, who in report.rows:
+    lines.append('{:3d} {} {} {}'.format(
+                   level,
+                   time_format(flat_ttl_opt),
+                   time_format(flat_ttl_exp),
+                   who))
+  return lines
+
+def evaluate_scenario(state, epoch, horizon_days):
+  # level, optimistic and expected ttl, expected burn rate, and levels
+  # gained within horizon_days, for everyone in a scenario's realm.  Runs
+  # in a worker process, so it is handed everything it depends on.
+  global now
+  now = epoch
+  stats = IdlerpgStats.from_scenario_state(state)
+  burn_rates = get_all_burn_rates(stats)
+  levels_gained = Counter(prediction.who for prediction in
+                          predict_levelling(stats, horizon_days))
+  results = {}
+  for who in stats:
+    ettl_opt, ettl_exp = expected_ttl(stats, who, burn_rates)
+    results[who] = (stats[who].level, ettl_opt, ettl_exp,
+                    burn_rates[who][1], levels_gained[who])
+  return results
+
+def evaluate_scenario_job(job):
+  return evaluate_scenario(*job)
+
+def compare_scenarios(stats, specs, horizon_days, processes=None):
+  # Apply each scenario spec (see IdlerpgStats.apply_scenario) to its own
+  # copy of the current state, then evaluate them all in a pool of worker
+  # processes.  Changes are applied here rather than in the workers so
+  # that a bad spec is reported instead of taking down a worker.  Returns
+  # the results of evaluate_scenario() for each spec, in order.
+  import multiprocessing
+  state = stats.scenario_state()
+  jobs = []
+  for spec in specs:
+    scenario = IdlerpgStats.from_scenario_state(state)
+    scenario.apply_scenario(spec, now)
+    jobs.append((scenario.scenario_state(), now, horizon_days))
+  pool = multiprocessing.Pool(processes)
+  try:
+    return pool.map(evaluate_scenario_job, jobs)
+  finally:
+    pool.close()
+    pool.join()
+
+def scenarios_report(stats, specs, who, horizon_days=None):
+  # Rank the scenarios (and things as they are) by how well who does in
+  # them: most levels gained within the horizon, then soonest expected
+  # next level
+  if who not in stats:
+    raise SystemExit("Unrecognized player: "+who)
+  if horizon_days is None:
+    horizon_days = 7
+  specs = [''] + [spec for spec in specs if spec]
+  results = compare_scenarios(stats, specs, horizon_days)
+  rows = []
+  for spec, result in zip(specs, results):
+    level, ettl_opt, ettl_exp, burn_rate, levels_gained = result[who]
+    rows.append((levels_gained, float(ettl_opt), float(ettl_exp), burn_rate,
+                 spec or '(as is)'))
+  rows.sort(key=lambda row: (-row[0], row[2]))
+  return Report('scenarios',
+                ('levels_gained', 'optimistic_ttl', 'expected_ttl',
+                 'expected_burn_rate', 'scenario'),
+                rows, scenarios_text, character=who,
+                horizon_days=horizon_days)
+
+def scenarios_text(report):
+  lines = ["Scenarios for {}, best first (levels gained in {:g} days):".format(
+             report.notes['character'], report.notes['horizon_days']),
+           "Lvls   Optimistic     Expected   Burn scenario",
+           "---- ------------ ------------ ------ --------"]
+  for levels_gained, ettl_opt, ettl_exp, burn_rate, spec in report.rows:
+    lines.append('{:4d} {} {} {:6.3f} {}'.format(
+                   levels_gained,
+                   time_format(ettl_opt),
+                   time_format(ettl_exp),
+                   burn_rate,
+                   spec))
+  return lines
+
+def default_quit_strategy(stats):
+  questers = stats.questers[:]
+  priority_quitters = ('elijah','Atychiphobe')
+  for person in priority_quitters:
+    if person in questers:
+      questers.remove(person)
+      questers.insert(0,person)
+      break
+  quit_strategy = ','.join(questers)
+  if not any(x in questers for x in priority_quitters):
+    quit_strategy = ','+quit_strategy
+  return quit_strategy
+
+def add_report_arguments(parser):
+  # The options choosing what to show, shared by the command line and the
+  # queries answered by --serve
+  parser.add_argument('--show', action='append', default=[],
+                      choices=['summary', 'burninfo', 'levelling',
+                               'plot_levelling', 'flat_slopes',
+                               'ttl_bands', 'battle_forecast',
+                               'line_types'],
+                      help='Which kind of info to show')
+  parser.add_argument('--format', choices=['text', 'json', 'csv'],
+                      default='text',
+                      help='How to write out the requested info (default: '
+                           'text); json and csv give the raw values')
+  parser.add_argument('--horizon-days', type=float, metavar='DAYS',
+                      help='Only predict levelling for the next DAYS days')
+  parser.add_argument('--horizon-levels', type=int, metavar='COUNT',
+                      help='Only predict the next COUNT levels gained')
+  parser.add_argument('--trials', type=int, default=2000, metavar='COUNT',
+                      help='Number of simulated runs for --show ttl_bands')
+  parser.add_argument('--seed', type=int,
+                      help='Random seed for --show ttl_bands, to make the '
+                           'simulated runs reproducible')
+  parser.add_argument('--seeds-file', type=str, metavar='FILE',
+                      help='Log annotated by fill-out-seeds.py, to start '
+                           '--show battle_forecast from')
+  parser.add_argument('--stats', action='append', default=[],
+                      choices=['attacker', 'quest', 'item',
+                               'light-shining', 'forsaking', 'stealing',
+                               'godsend-item', 'godsend-time',
+                               'calamity-item', 'calamity-time',
+                               'hand-of-god'],
+                      help='Show cumulative stats vs. expected results')
+  parser.add_argument('--stats-of', action='append', default=[],
+                      metavar='PLAYER',
+                      help='Show all stats of specific individual')
+  parser.add_argument('--quit-strategy', type=str, nargs='?', const='',
+                      metavar='QUITTER(S)',
+                      help='Show how much everyone will be set back if a quest'
+                           ' is quit right now.  Comma-separated QUITTER(s) '
+                           'lose out on 25%% bonus.  quitter1 gets p16 instead '
+                           'of p15.  Current questers assumed if none specifed,'
+                           ' but none get the p16 penalty.')
+  parser.add_argument('--quit-search', action='store_true',
+                      help='Try every choice of quitters for the current '
+                           'quest (in --quit-strategy terms) and show the '
+                           'ones that are Pareto-best for everyone online')
+  parser.add_argument('--scenario', action='append', default=[],
+                      metavar='SPEC',
+                      help='Rank what would happen under each SPEC (may be '
+                           'repeated), evaluated in parallel.  SPEC is '
+                           '";"-separated changes, each in the --whatif '
+                           'format or "quit[:QUITTER]" to quit the current '
+                           'quest.  Uses --horizon-days (default: 7).')
+  parser.add_argument('--scenarios-for', type=str, default='elijah',
+                      metavar='PLAYER',
+                      help='Whose results to rank scenarios by (default: '
+                           'elijah)')
+  parser.add_argument('--offline',
+                      dest='who', action='append_const', const='offline',
+                      help='Show information for offline players as well')
+  parser.add_argument('--high-levellers',
+                      dest='who', action='append_const', const='highlevel',
+                      help='Show information for only high level players')
 
-    print('{:3d} {} {} {}'.format(
-             stats[who]['level'],
-             time_format(flat_ttl_opt),
-             time_format(flat_ttl_exp),
-             who))
+def finish_report_args(rpgstats, args):
+  # Defaults that depend on the other options or the current state
+  if args.who is None:
+    args.who = []
+  if args.quit_strategy is not None:
+    # Try to be smart about who to select for quitting
+    args.default_quitters = not args.quit_strategy
+    if args.default_quitters:
+      args.quit_strategy = default_quit_strategy(rpgstats)
+  if not (args.show or args.stats or args.stats_of or args.quit_strategy or
+          args.quit_search or args.scenario):
+    args.show = ['summary']
+  if 'battle_forecast' in args.show:
+    if not args.seeds_file:
+      raise SystemExit("--show battle_forecast needs --seeds-file")
+    args.seed_tracker = SeedTracker(args.seeds_file)
 
 def parse_args(rpgstats):
   # A few helper functions for calling rpgstats.parse() and keeping
@@ -1206,21 +2543,18 @@ def parse_args(rpgstats):
   comparisons = []
   def copy_for_comparison(stats):
     def default_player_copy():
-      basic_dict = default_player()
-      basic_dict['burnrates'] = (0,0,0,0,0,0,0,0,0)
-      basic_dict['expected_ttls'] = (0,0)
-      return basic_dict
+      player = Player()
+      player.burnrates = (0,0,0,0,0,0,0,0,0)
+      player.expected_ttls = (0,0)
+      return player
     mycopy = defaultdict(default_player_copy)
     for who in stats:
       mycopy[who] = stats[who].copy()
-      mycopy[who]['attack_stats']     = stats[who]['attack_stats'][:]
-      mycopy[who]['quest_stats']      = stats[who]['quest_stats'][:]
-      mycopy[who]['total_time_stats'] = stats[who]['total_time_stats'][:]
-      mycopy[who]['alignment_stats']  = stats[who]['alignment_stats'][:]
-      mycopy[who]['gch_stats']        = stats[who]['gch_stats'][:]
+    burn_rates = get_all_burn_rates(stats)
+    burninfo = compute_all_burn_info(stats)
     for who in stats:
-      mycopy[who]['expected_ttls'] = expected_ttl(stats, who)
-      mycopy[who]['burnrates'] = compute_burn_info(stats, who)
+      mycopy[who].expected_ttls = expected_ttl(stats, who, burn_rates)
+      mycopy[who].burnrates = burninfo[who]
     comparisons.append(mycopy)
 
   class ParseEndTime(argparse.Action):
@@ -1235,19 +2569,18 @@ def parse_args(rpgstats):
                                           rpgstats.primary_log])
         final_line = output.splitlines()[-1]
         sincedate = final_line[0:19]
-        print "Found {} at {}:\n  {}".format(timestr, sincedate, final_line)
+        sys.stderr.write("Found {} at {}:\n  {}\n".format(timestr, sincedate,
+                                                          final_line))
         return convert_to_epoch(sincedate)
     def __call__(self, parser, namespace, values, option_string=None):
       global now
       new_time = self.parse_time(values)
       old_time, now = now, new_time
-      for who in rpgstats:
-        if rpgstats[who]['online']:
-          rpgstats[who]['timeleft'] -= (new_time-old_time)
-          rpgstats.adjust_total_time_by_alignment(who, old_time, increase=True)
+      rpgstats.shift_now(old_time, new_time)
       force_parse(rpgstats)
   class TweakStats(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
+      setattr(namespace, self.dest, values)
       ensure_parsed(rpgstats)
       rpgstats.apply_attribute_modifications(values, now)
   class RecordForComparison(argparse.Action):
@@ -1281,106 +2614,295 @@ def parse_args(rpgstats):
                       default=0, nargs=0,
                       help='Record stats for comparison; must be used twice'
                            ' (with --whatif or --until flags inbetween)')
-  parser.add_argument('--show', action='append', default=[],
-                      choices=['summary', 'burninfo', 'levelling',
-                               'plot_levelling', 'flat_slopes'],
-                      help='Which kind of info to show')
-  parser.add_argument('--stats', action='append', default=[],
-                      choices=['attacker', 'quest', 'item',
-                               'light-shining', 'forsaking', 'stealing',
-                               'godsend-item', 'godsend-time',
-                               'calamity-item', 'calamity-time',
-                               'hand-of-god'],
-                      help='Show cumulative stats vs. expected results')
-  parser.add_argument('--stats-of', action='append', default=[],
-                      metavar='PLAYER',
-                      help='Show all stats of specific individual')
-  parser.add_argument('--quit-strategy', type=str, nargs='?', const='',
-                      metavar='QUITTER(S)',
-                      help='Show how much everyone will be set back if a quest'
-                           ' is quit right now.  Comma-separated QUITTER(s) '
-                           'lose out on 25%% bonus.  quitter1 gets p16 instead '
-                           'of p15.  Current questers assumed if none specifed,'
-                           ' but none get the p16 penalty.')
-  parser.add_argument('--offline',
-                      dest='who', action='append_const', const='offline',
-                      help='Show information for offline players as well')
-  parser.add_argument('--high-levellers',
-                      dest='who', action='append_const', const='highlevel',
-                      help='Show information for only high level players')
+  parser.add_argument('--follow', type=int, nargs='?', const=60,
+                      metavar='SECONDS',
+                      help='Keep running, showing the requested info again '
+                           'whenever new log lines change it; remote logs '
+                           'are re-synced every SECONDS (default: 60)')
+  parser.add_argument('--serve', type=str, metavar='SOCKET',
+                      help='Keep running, answering queries (lines of the '
+                           'options for what to show) on the Unix socket '
+                           'SOCKET instead of showing anything')
+  add_report_arguments(parser)
   args = parser.parse_args()
 
   # Make sure the log is parsed
   ensure_parsed(rpgstats)
 
   # Sanity checking and specialized defaults
-  if args.who is None:
-    args.who = []
-  if args.quit_strategy is not None:
-    if len(comparisons) > 0:
-      raise SystemExit("Quit strategy is incompatible with comparisons")
-    # Try to be smart about who to select for quitting
-    if not args.quit_strategy:
-      questers = rpgstats.questers[:]
-      priority_quitters = ('elijah','Atychiphobe')
-      for person in priority_quitters:
-        if person in questers:
-          questers.remove(person)
-          questers.insert(0,person)
-          break
-      args.quit_strategy = ','.join(questers)
-      if not any(x in questers for x in priority_quitters):
-        args.quit_strategy = ','+args.quit_strategy
-  if not (args.show or args.stats or args.stats_of or args.quit_strategy):
-    args.show = ['summary']
+  if (args.quit_strategy is not None or args.quit_search) and \
+     len(comparisons) > 0:
+    raise SystemExit("Quit strategy is incompatible with comparisons")
+  if args.follow is not None:
+    if len(comparisons) > 0 or args.whatif or now != current_time:
+      raise SystemExit("--follow is incompatible with comparisons, --whatif, "
+                       "--until, and --since")
+    if 'levelling' in args.show or 'plot_levelling' in args.show:
+      raise SystemExit("--follow is incompatible with levelling predictions")
+  if args.serve is not None:
+    if len(comparisons) > 0 or args.whatif or now != current_time or \
+       args.follow is not None:
+      raise SystemExit("--serve is incompatible with comparisons, --whatif, "
+                       "--until, --since, and --follow")
+  if 'battle_forecast' in args.show and len(comparisons) > 0:
+    raise SystemExit("Battle forecasts are incompatible with comparisons")
+  if args.scenario and len(comparisons) > 0:
+    raise SystemExit("Scenarios are incompatible with comparisons")
+  finish_report_args(rpgstats, args)
 
   # Handle comparisons
   if len(comparisons) not in (0,2):
     raise SystemExit("Error: Can only meaningfully handle two --compare flags")
   elif len(comparisons) == 2:
     for who in rpgstats:
-      rpgstats[who]['level']    = comparisons[1][who]['level'] - \
-                                  comparisons[0][who]['level']
-      rpgstats[who]['timeleft'] = comparisons[1][who]['timeleft'] - \
-                                  comparisons[0][who]['timeleft']
-      rpgstats[who]['itemsum']  = comparisons[1][who]['itemsum'] - \
-                                  comparisons[0][who]['itemsum']
-      rpgstats[who]['attack_stats'] = list(operator.sub(*x) for x in
-                                zip(comparisons[1][who]['attack_stats'],
-                                    comparisons[0][who]['attack_stats']))
-      rpgstats[who]['quest_stats'] = list(operator.sub(*x) for x in
-                                zip(comparisons[1][who]['quest_stats'],
-                                    comparisons[0][who]['quest_stats']))
-      rpgstats[who]['total_time_stats'] = list(operator.sub(*x) for x in
-                                zip(comparisons[1][who]['total_time_stats'],
-                                    comparisons[0][who]['total_time_stats']))
-      rpgstats[who]['alignment_stats'] = list(operator.sub(*x) for x in
-                                zip(comparisons[1][who]['alignment_stats'],
-                                    comparisons[0][who]['alignment_stats']))
-      rpgstats[who]['gch_stats'] = list(operator.sub(*x) for x in
-                                zip(comparisons[1][who]['gch_stats'],
-                                    comparisons[0][who]['gch_stats']))
-      rpgstats[who]['expected_ttls'] = tuple(operator.sub(*x) for x in
-                                zip(comparisons[1][who]['expected_ttls'],
-                                    comparisons[0][who]['expected_ttls']))
-      rpgstats[who]['burnrates'] = tuple(operator.sub(*x) for x in
-                                zip(comparisons[1][who]['burnrates'],
-                                    comparisons[0][who]['burnrates']))
-      if comparisons[1][who]['alignment'] != comparisons[0][who]['alignment']:
-        rpgstats[who]['alignment'] = comparisons[0][who]['alignment'][0] + \
-                              '->' + comparisons[1][who]['alignment'][0]
-      if comparisons[1][who]['stronline'] != comparisons[0][who]['stronline']:
-        rpgstats[who]['stronline'] = comparisons[0][who]['stronline'][0] + \
+      rpgstats[who].level    = comparisons[1][who].level - \
+                                  comparisons[0][who].level
+      rpgstats[who].timeleft = comparisons[1][who].timeleft - \
+                                  comparisons[0][who].timeleft
+      rpgstats[who].itemsum  = comparisons[1][who].itemsum - \
+                                  comparisons[0][who].itemsum
+      rpgstats[who].attack_stats = list(operator.sub(*x) for x in
+                                zip(comparisons[1][who].attack_stats,
+                                    comparisons[0][who].attack_stats))
+      rpgstats[who].quest_stats = list(operator.sub(*x) for x in
+                                zip(comparisons[1][who].quest_stats,
+                                    comparisons[0][who].quest_stats))
+      rpgstats[who].total_time_stats = list(operator.sub(*x) for x in
+                                zip(comparisons[1][who].total_time_stats,
+                                    comparisons[0][who].total_time_stats))
+      rpgstats[who].alignment_stats = list(operator.sub(*x) for x in
+                                zip(comparisons[1][who].alignment_stats,
+                                    comparisons[0][who].alignment_stats))
+      rpgstats[who].gch_stats = list(operator.sub(*x) for x in
+                                zip(comparisons[1][who].gch_stats,
+                                    comparisons[0][who].gch_stats))
+      rpgstats[who].expected_ttls = tuple(operator.sub(*x) for x in
+                                zip(comparisons[1][who].expected_ttls,
+                                    comparisons[0][who].expected_ttls))
+      rpgstats[who].burnrates = tuple(operator.sub(*x) for x in
+                                zip(comparisons[1][who].burnrates,
+                                    comparisons[0][who].burnrates))
+      if comparisons[1][who].alignment != comparisons[0][who].alignment:
+        rpgstats[who].alignment = comparisons[0][who].alignment[0] + \
+                              '->' + comparisons[1][who].alignment[0]
+      if comparisons[1][who].stronline != comparisons[0][who].stronline:
+        rpgstats[who].stronline = comparisons[0][who].stronline[0] + \
                                      '>' + \
-                                     comparisons[1][who]['stronline'][0]
+                                     comparisons[1][who].stronline[0]
+    rpgstats.state_changed()
 
   # Okay, we can finally return args
   return args
 
 
+def requested_reports(rpgstats, args):
+  reports = []
+  if 'summary' in args.show:
+    reports.append(summary_report(rpgstats, args.who))
+  if 'burninfo' in args.show:
+    reports.append(burn_info_report(rpgstats, args.who))
+  if 'attacker' in args.stats:
+    reports.append(basic_stats_report(rpgstats, 'attacker', 'attack_stats',
+                                      "Battle statistics: number of times as attacker",
+                                      args.who))
+  if 'item' in args.stats:
+    reports.append(item_stats_report(rpgstats, args.who))
+  if 'quest' in args.stats:
+    reports.append(basic_stats_report(rpgstats, 'quest', 'quest_stats',
+                                      "Quest statistics: number of times as quester",
+                                      args.who))
+  if 'light-shining' in args.stats:
+    reports.append(alignment_stats_report(rpgstats, 'light-shining', 0, 'light-shining', 2.0/12, args.who))
+  if 'forsaking' in args.stats:
+    reports.append(alignment_stats_report(rpgstats, 'forsaking', 1, 'forsaking', 1.0/16, args.who))
+  if 'stealing' in args.stats:
+    reports.append(alignment_stats_report(rpgstats, 'stealing', 2, 'stealing', 1.0/16, args.who))
+  if 'godsend-item' in args.stats:
+    reports.append(gch_stats_report(rpgstats, 'godsend-item', 0, "item improvement godsends",    1.0/40, args.who))
+  if 'godsend-time' in args.stats:
+    reports.append(gch_stats_report(rpgstats, 'godsend-time', 1, "time acceleration godsends",   9.0/40, args.who))
+  if 'calamity-item' in args.stats:
+    reports.append(gch_stats_report(rpgstats, 'calamity-item', 2, "item detriment calamities",    1.0/80, args.who))
+  if 'calamity-time' in args.stats:
+    reports.append(gch_stats_report(rpgstats, 'calamity-time', 3, "time deceleration calamities", 9.0/80, args.who))
+  if 'hand-of-god' in args.stats:
+    reports.append(gch_stats_report(rpgstats, 'hand-of-god', 4, "hands of god",                 1.0/20, args.who))
+  for who in args.stats_of:
+    if who not in rpgstats:
+      raise SystemExit("Unrecognized player: "+who)
+    reports.append(personal_stats_report(rpgstats, who))
+  if 'levelling' in args.show:
+    reports.append(levelling_report(rpgstats, args.who,
+                                    args.horizon_days, args.horizon_levels))
+  if args.quit_strategy:
+    reports.append(quit_strategy_report(rpgstats, args.quit_strategy.split(','),
+                                        args.who))
+  if args.quit_search:
+    reports.append(quit_search_report(rpgstats))
+  if 'flat_slopes' in args.show:
+    reports.append(flat_slopes_report(rpgstats, args.who))
+  if args.scenario:
+    reports.append(scenarios_report(rpgstats, args.scenario,
+                                    args.scenarios_for, args.horizon_days))
+  if 'ttl_bands' in args.show:
+    reports.append(ttl_bands_report(rpgstats, args.who, args.trials, args.seed))
+  if 'battle_forecast' in args.show:
+    reports.append(battle_forecast_report(rpgstats, args.seed_tracker,
+                                          args.horizon_days))
+  if 'line_types' in args.show:
+    reports.append(line_types_report(rpgstats))
+  return reports
+
+def show_requested_info(rpgstats, args):
+  render_reports(requested_reports(rpgstats, args), args.format)
+  if 'plot_levelling' in args.show:
+    sys.stdout.flush()
+    plot_levels(rpgstats, args.who)
+
+def sync_remote_logs():
+  if subprocess.check_output(['hostname']).strip() != 'localhost.localdomain':
+    os.system('rsync -a pt-scm-staging-01:irclogs/Palantir/ /home/newren/irclogs/Palantir-yellow/')
+
+class LogWatcher(object):
+  # Waits for changes to the logs, using inotify if pyinotify is available
+  # and otherwise just waiting a bit before checking the logs again.
+  poll_interval = 5
+  def __init__(self, filenames):
+    try:
+      import pyinotify
+    except ImportError:
+      self.notifier = None
+      return
+    # Watch the directories rather than the logs, since rsync replaces them
+    wm = pyinotify.WatchManager()
+    mask = pyinotify.IN_MODIFY | pyinotify.IN_MOVED_TO | pyinotify.IN_CREATE
+    for dirname in set(os.path.dirname(filename) for filename in filenames):
+      wm.add_watch(dirname, mask)
+    self.notifier = pyinotify.Notifier(wm, default_proc_fun=lambda event: None)
+  def wait(self, timeout):
+    if not self.notifier:
+      time.sleep(min(timeout, LogWatcher.poll_interval))
+    elif self.notifier.check_events(timeout*1000):
+      self.notifier.read_events()
+      self.notifier.process_events()
+
+def follow_logs(rpgstats, args):
+  global now
+  watcher = LogWatcher([filename for filename, translate_you in rpgstats.logs])
+  next_sync = time.time() + args.follow
+  while True:
+    watcher.wait(max(0, next_sync-time.time()))
+    if time.time() >= next_sync:
+      sync_remote_logs()
+      next_sync = time.time() + args.follow
+
+    # Parse anything new, and only show things again if a log line that
+    # changes the state has come in
+    old_count = sum(rpgstats.line_counts.values())-rpgstats.line_counts['unhandled']
+    old_time, now = now, time.time()
+    rpgstats.shift_now(old_time, now)
+    rpgstats.parse()
+    new_count = sum(rpgstats.line_counts.values())-rpgstats.line_counts['unhandled']
+    if new_count == old_count:
+      continue
+    if args.quit_strategy is not None and args.default_quitters:
+      args.quit_strategy = default_quit_strategy(rpgstats)
+    if args.format == 'text':
+      print "=== {} ===".format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now)))
+    show_requested_info(rpgstats, args)
+    sys.stdout.flush()
+
+class QueryParser(argparse.ArgumentParser):
+  # Sends mistakes in a query back to whoever made it, rather than exiting
+  def error(self, message):
+    raise ValueError(message)
+
+def answer_query(rpgstats, parser, request):
+  # What levelling.py would print given request's options, as a string, and
+  # whether it is an answer worth keeping for a while (errors aren't, in
+  # case whatever caused them gets fixed, and nor are unseeded Monte Carlo
+  # runs, which should be a fresh draw each time)
+  try:
+    args = parser.parse_args(shlex.split(request))
+    if 'plot_levelling' in args.show:
+      raise ValueError("plot_levelling can't be shown over a socket")
+    finish_report_args(rpgstats, args)
+    out = StringIO()
+    render_reports(requested_reports(rpgstats, args), args.format, out)
+    return out.getvalue(), not ('ttl_bands' in args.show and args.seed is None)
+  except (ValueError, SystemExit) as e:
+    return "error: {}\n".format(e), False
+  except Exception as e:
+    # A bug or a bad file named in the query; don't let it take down the
+    # server for everyone else
+    traceback.print_exc()
+    return "error: {}\n".format(e), False
+
+def serve_queries(rpgstats, args, sync_interval=60):
+  # Keep rpgstats up to date with the logs and answer queries about it on a
+  # Unix socket.  Each connection sends one line holding the options for
+  # what to show (e.g. "--show summary --format json"; an empty line gets
+  # the summary) and gets back what levelling.py would have printed, then
+  # is closed.  Answers are worked out as of the time they are asked for,
+  # and remembered for a few seconds (or until the logs change), so that a
+  # burst of the same query (several dashboards polling, say) costs nothing.
+  global now
+  if os.path.exists(args.serve):
+    os.unlink(args.serve)  # Left over from a previous run
+  server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  server.bind(args.serve)
+  server.listen(5)
+  # Clean up the socket when told to stop, not just on ^C
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+  parser = QueryParser(prog='query')
+  add_report_arguments(parser)
+
+  def log_states():
+    return [(os.path.getsize(f), os.path.getmtime(f)) for f, t in rpgstats.logs]
+  seen_states = log_states()
+  next_sync = time.time() + sync_interval
+  answers = {}  # request -> (answer, when), since the logs last changed
+  try:
+    while True:
+      if time.time() >= next_sync:
+        sync_remote_logs()
+        next_sync = time.time() + sync_interval
+      states = log_states()
+      if states != seen_states:
+        seen_states = states
+        old_time, now = now, time.time()
+        rpgstats.shift_now(old_time, now)
+        rpgstats.parse()
+        answers.clear()
+
+      ready, _, _ = select.select([server], [], [], LogWatcher.poll_interval)
+      if not ready:
+        continue
+      conn, _ = server.accept()
+      try:
+        conn.settimeout(LogWatcher.poll_interval)
+        request = conn.makefile().readline().strip()
+        answer, when = answers.get(request, (None, None))
+        if answer is None or time.time() - when >= LogWatcher.poll_interval:
+          # Times to level and the like are all relative to now
+          old_time, now = now, time.time()
+          rpgstats.shift_now(old_time, now)
+          answer, lasting = answer_query(rpgstats, parser, request)
+          if lasting:
+            answers[request] = (answer, now)
+          else:
+            answers.pop(request, None)
+        conn.sendall(answer)
+      except socket.error:
+        pass  # The client went away or never finished asking
+      finally:
+        conn.close()
+  finally:
+    server.close()
+    os.unlink(args.serve)
+
 rpgstats = IdlerpgStats()
-if subprocess.check_output(['hostname']).strip() != 'localhost.localdomain':
-  os.system('rsync -a pt-scm-staging-01:irclogs/Palantir/ /home/newren/irclogs/Palantir-yellow/')
+sync_remote_logs()
 rpgstats.add_log('/home/newren/irclogs/Palantir-yellow/idlerpg.log',
                  translate_you='Atychiphobe')
 #os.system('rsync -a gerrit-ro@pt-scm-staging-01:irclogs/Palantir/ /home/newren/irclogs/Palantir-elijah/')
@@ -1389,42 +2911,13 @@ rpgstats.add_log('/home/newren/irclogs/Palantir/idlerpg.log',
 # We want 'You found a level X <item>!' messages to come before the
 # 'Y has attained level Z!' messages, so we list the main log last
 rpgstats.add_log('/home/newren/irclogs/Palantir/#idlerpg.log')
+rpgstats.set_checkpoint('/home/newren/irclogs/levelling.checkpoint')
+rpgstats.set_snapshot_dir('/home/newren/irclogs/levelling.snapshots')
 args = parse_args(rpgstats)
-if 'summary' in args.show:
-  print_summary_info(rpgstats, args.who)
-if 'burninfo' in args.show:
-  print_detailed_burn_info(rpgstats, args.who)
-if 'attacker' in args.stats:
-  print_attacker_stats(rpgstats, args.who)
-if 'item' in args.stats:
-  print_item_stats(rpgstats, args.who)
-if 'quest' in args.stats:
-  print_quest_stats(rpgstats, args.who)
-if 'light-shining' in args.stats:
-  print_alignment_stats(rpgstats, 0, 'light-shining', 2.0/12, args.who)
-if 'forsaking' in args.stats:
-  print_alignment_stats(rpgstats, 1, 'forsaking', 1.0/16, args.who)
-if 'stealing' in args.stats:
-  print_alignment_stats(rpgstats, 2, 'stealing', 1.0/16, args.who)
-if 'godsend-item' in args.stats:
-  print_gch_stats(rpgstats, 0, "item improvement godsends",    1.0/40, args.who)
-if 'godsend-time' in args.stats:
-  print_gch_stats(rpgstats, 1, "time acceleration godsends",   9.0/40, args.who)
-if 'calamity-item' in args.stats:
-  print_gch_stats(rpgstats, 2, "item detriment calamities",    1.0/80, args.who)
-if 'calamity-time' in args.stats:
-  print_gch_stats(rpgstats, 3, "time deceleration calamities", 9.0/80, args.who)
-if 'hand-of-god' in args.stats:
-  print_gch_stats(rpgstats, 4, "hands of god",                 1.0/20, args.who)
-for who in args.stats_of:
-  if who not in rpgstats:
-    raise SystemExit("Unrecognized player: "+who)
-  print_personal_stats(rpgstats, who)
-if 'levelling' in args.show:
-  print_next_levelling(rpgstats, args.who)
-if 'plot_levelling' in args.show:
-  plot_levels(rpgstats, args.who)
-if args.quit_strategy:
-  show_quit_strategy(rpgstats, args.quit_strategy.split(','), args.who)
-if 'flat_slopes' in args.show:
-  show_flat_slopes(rpgstats, args.who)
+if args.serve is not None:
+  serve_queries(rpgstats, args)
+else:
+  show_requested_info(rpgstats, args)
+  if args.follow is not None:
+    sys.stdout.flush()
+    follow_logs(rpgstats, args)
@@ -0,0 +1,131 @@
+# The rand48 linear congruential generator behind idlerpg's rand() calls:
+#   seed_{i+1} = (a*seed_i + c) % m
+# Stepping n calls is itself an affine map,
+#   seed_{i+n} = (a^n*seed_i + c*(1+a+...+a^(n-1))) % m,
+# so jumping any distance (forwards or backwards) can be done by square
+# and multiply on (multiplier, increment) pairs in O(log n) rather than
+# stepping one call at a time.
+
+import array
+import bisect
+
+a = 0x5DEECE66D
+c = 0xB
+m = 2**48
+ainv = 246154705703781  # a*ainv % m == 1, so seed_i = ainv*(seed_{i+1}-c) % m
+
+def jump_coefficients(n):
+  # Returns (A, C) such that n calls take any seed to (A*seed+C) % m;
+  # negative n goes backwards.
+  if n < 0:
+    step_a, step_c, n = ainv, (-ainv*c) % m, -n
+  else:
+    step_a, step_c = a, c
+  A, C = 1, 0
+  while n:
+    if n & 1:
+      A, C = (step_a*A) % m, (step_a*C + step_c) % m
+    step_a, step_c = (step_a*step_a) % m, (step_a*step_c + step_c) % m
+    n >>= 1
+  return A, C
+
+def jump(seed, n=1):
+  # The seed n calls after (or before, for negative n) the given one
+  if n == 1:
+    return (a*seed + c) % m
+  A, C = jump_coefficients(n)
+  return (A*seed + C) % m
+
+def fraction(seed):
+  # What rand() hands back, before scaling by its argument
+  return (seed+0.0)/m
+
+def count_hops(initial_seed, final_seed):
+  # Number of calls (between 1 and m) needed to get from initial_seed to
+  # final_seed.  Since c is odd and a % 4 == 1, the generator has full
+  # period m, and modulo 2^(k+1) it has period 2^(k+1); so jumping 2^k
+  # calls leaves the low k bits of a seed alone and always flips bit k.
+  # That lets us pick out the bits of the answer one at a time, lowest
+  # first.
+  hops = 0
+  seed = initial_seed
+  for k in xrange(48):
+    bit = 1 << k
+    if (seed ^ final_seed) & bit:
+      seed = jump(seed, bit)
+      hops |= bit
+  return hops or m
+
+class JumpTable(object):
+  # Precomputed jump_coefficients(n) for every n in a few windows [lo, hi],
+  # for code that needs the same jumps over and over.  Each window starts
+  # from jump_coefficients(lo) and is filled in by single steps.  The
+  # coefficients are kept in flat arrays of unsigned longs (which are 64
+  # bits here, plenty for values below 2^48); with shared=True those live
+  # in shared memory, so processes forked afterwards all read the same
+  # table rather than each getting their own copy.
+  def __init__(self, windows, shared=False):
+    merged = []
+    for lo, hi in sorted(windows):
+      if merged and lo <= merged[-1][1]+1:
+        merged[-1][1] = max(merged[-1][1], hi)
+      else:
+        merged.append([lo, hi])
+    self.starts = [lo for lo, hi in merged]
+    self.ends = [hi for lo, hi in merged]
+    self.offsets = []
+    size = sum(hi-lo+1 for lo, hi in merged)
+    if shared:
+      from multiprocessing.sharedctypes import RawArray
+      self.multipliers = RawArray('L', size)
+      self.increments = RawArray('L', size)
+    else:
+      self.multipliers = array.array('L', [0])*size
+      self.increments = array.array('L', [0])*size
+
+    idx = 0
+    for lo, hi in merged:
+      self.offsets.append(idx)
+      A, C = jump_coefficients(lo)
+      for n in xrange(lo, hi+1):
+        self.multipliers[idx], self.increments[idx] = A, C
+        A, C = (a*A) % m, (a*C + c) % m
+        idx += 1
+
+  def coefficients(self, n):
+    # Same as jump_coefficients(n), looked up when n is in the table
+    i = bisect.bisect_right(self.starts, n)-1
+    if i >= 0 and n <= self.ends[i]:
+      idx = self.offsets[i] + n-self.starts[i]
+      return self.multipliers[idx], self.increments[idx]
+    return jump_coefficients(n)
+
+_stream_steps = None
+
+def stream(seed, n, chunk=1 << 16):
+  # The seeds after each of the next n calls, as a numpy array of uint64s.
+  # Each chunk of them comes from the seed before it with one multiply and
+  # add, using jump_coefficients(k) for every k up to the chunk size, which
+  # are worked out once.  (Arithmetic wraps modulo 2^64, and m divides
+  # that, so masking off the top bits afterwards gives the right answer.)
+  import numpy as np
+  global _stream_steps
+  mask = np.uint64(m-1)
+  if _stream_steps is None or len(_stream_steps[0]) < chunk:
+    A = np.ones(chunk+1, dtype=np.uint64)
+    C = np.zeros(chunk+1, dtype=np.uint64)
+    step = 1
+    while step <= chunk:
+      step_a, step_c = jump_coefficients(step)
+      k = min(step, chunk+1-step)
+      A[step:step+k] = (A[:k]*np.uint64(step_a)) & mask
+      C[step:step+k] = (A[:k]*np.uint64(step_c) + C[:k]) & mask
+      step *= 2
+    _stream_steps = (A, C)
+  A, C = _stream_steps
+  seeds = np.empty(n, dtype=np.uint64)
+  for start in xrange(0, n, chunk):
+    size = min(chunk, n-start)
+    base = np.uint64(jump(seed, start) if start else seed)
+    seeds[start:start+size] = (A[1:size+1]*base + C[1:size+1]) & mask
+  return seeds
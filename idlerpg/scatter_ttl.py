@@ -1,51 +1,37 @@
 #!/usr/bin/env python
 
 from collections import defaultdict
-from datetime import datetime
-import re
 import sys
-import time
 
 import matplotlib.pyplot as plt
 import numpy as np
 
-def convert_to_epoch(datestring):
-  year = '2015 ' if datestring.startswith('Jan') else '2014 '
-  return time.mktime(datetime.strptime(year+datestring, '%Y %b %d %H:%M:%S').timetuple())
+import events
 
 for_whom = sys.argv[1] if len(sys.argv) > 1 else None
 remaining = defaultdict(list)
 x = []
 y = []
-with open('/home/newren/.xchat2/xchatlogs/Palantir-#idlerpg.log') as f:
-  for line in f:
-    if 'reaches next level' in line:
-      m = re.match(r'([A-Z][a-z]{2} \d{2} \d{2}:\d{2}:\d{2}) <idlerpg>\s*([A-Za-z]*) reaches next level in (\d+) days?, (\d{2}):(\d{2}):(\d{2})', line)
-      if not m:
-        break
-      date, who, days, hours, minutes, seconds = m.groups()
-      if for_whom and who != for_whom:
-        continue
-      remnant = int(days)*86400+int(hours)*3600+int(minutes)*60+int(seconds)
-      if remnant < 86400:
-        continue
-      remaining[who].append((convert_to_epoch(date), remnant))
-    elif 'has attained' in line:
-      m = re.match(r'([A-Z][a-z]{2} \d{2} \d{2}:\d{2}:\d{2}) <idlerpg>\s*([A-Za-z]*),.*, has attained', line)
-      if not m:
-        raise SystemExit("BLAH: "+line)
-      date, who = m.groups()
-      if for_whom and who != for_whom:
-        continue
-      finished = convert_to_epoch(date)
-      for milepost,timeleft in remaining[who]:
-        took = finished-milepost
-        assert took > 0
-        #x.append(took)
-        #y.append(timeleft)
-        x.append(timeleft)
-        y.append(timeleft/took)
-      remaining[who] = []
+for event in events.query('/home/newren/.xchat2/xchatlogs/Palantir-#idlerpg.log',
+                          ('next_level', 'attained')):
+  who = event.actor
+  if for_whom and who != for_whom:
+    continue
+  if event.type == 'next_level' and event.kind is None:
+    remnant = event.duration
+    if remnant < 86400:
+      continue
+    remaining[who].append((event.epoch, remnant))
+  elif event.type == 'attained':
+    finished = event.epoch
+    for milepost,timeleft in remaining[who]:
+      took = finished-milepost
+      assert took > 0
+      #x.append(took)
+      #y.append(timeleft)
+      x.append(timeleft)
+      y.append(timeleft/took)
+    remaining[who] = []
 
 plt.figure()
 plt.scatter(x,y)
@@ -0,0 +1,76 @@
+# Converting the time stamps found in the logs to epochs.  Every log line
+# has one, so the common 'YYYY-MM-DD HH:MM:SS' (irssi, newer xchat) and
+# 'Mon DD HH:MM:SS' (older xchat) stamps are picked apart by position rather
+# than with strptime(), and the epoch of each day's local midnight is worked
+# out once and remembered.  Days with a daylight saving time change don't
+# have 86400 seconds, so times on those go through mktime() every time.
+
+from datetime import datetime
+import time
+
+months = dict((name, i+1) for i, name in enumerate(
+  ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+   'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']))
+
+# The date part of a time stamp -> epoch of its local midnight, or False
+day_epochs = {}
+
+def local_midnight(date, year, month, day):
+  # Epoch of the local midnight starting the given day (remembered under
+  # date), or False when the day isn't 86400 seconds long
+  midnight = time.mktime((year, month, day, 0, 0, 0, 0, 0, -1))
+  tomorrow = time.mktime((year, month, day+1, 0, 0, 0, 0, 0, -1))
+  if tomorrow-midnight != 86400:
+    midnight = False
+  day_epochs[date] = midnight
+  return midnight
+
+def local_time_to_epoch(date, year, month, day, clock):
+  # date is the key to remember the day under; clock is 'HH:MM:SS'
+  midnight = day_epochs.get(date)
+  if midnight is None:
+    midnight = local_midnight(date, year, month, day)
+  hours, mins, secs = int(clock[0:2]), int(clock[3:5]), int(clock[6:8])
+  if midnight is False:
+    return time.mktime((year, month, day, hours, mins, secs, 0, 0, -1))
+  return midnight + 3600*hours + 60*mins + secs
+
+def convert_to_epoch(timestring):
+  # 'YYYY-MM-DD HH:MM:SS' or 'YYYY-MM-DD', e.g. from the command line; unlike
+  # the functions below, anything else is rejected with a ValueError
+  if ':' in timestring:
+    timetuple = datetime.strptime(timestring, '%Y-%m-%d %H:%M:%S').timetuple()
+  else:
+    timetuple = datetime.strptime(timestring, '%Y-%m-%d').timetuple()
+  return time.mktime(timetuple)
+
+def convert_log_time_to_epoch(timestring):
+  # The fixed width 'YYYY-MM-DD HH:MM:SS' time stamps.  This is the one run
+  # for every line, so once a day is known only the clock gets parsed.
+  midnight = day_epochs.get(timestring[0:10])
+  if midnight:
+    return midnight + 3600*int(timestring[11:13]) + \
+                        60*int(timestring[14:16]) + int(timestring[17:19])
+  return local_time_to_epoch(timestring[0:10], int(timestring[0:4]),
+                             int(timestring[5:7]), int(timestring[8:10]),
+                             timestring[11:19])
+
+def convert_short_time_to_epoch(timestring, year):
+  # The 'Mon DD HH:MM:SS' time stamps (the day may be space padded), which
+  # leave the year to be found elsewhere in the log
+  return local_time_to_epoch((year, timestring[0:6]), year,
+                             months[timestring[0:3]], int(timestring[4:6]),
+                             timestring[7:15])
+
+def convert_stamp_to_epoch(timestring, year=None):
+  # Either of the above
+  if timestring[4] == '-':
+    return convert_log_time_to_epoch(timestring)
+  return convert_short_time_to_epoch(timestring, year)
+
+def convert_header_time_to_epoch(timestring):
+  # The 'Fri Jun 05 21:36:18 2015' of '--- Log opened' lines, or the
+  # 'Wed Apr  1 10:00:00 2015' of xchat's '**** BEGIN LOGGING AT' lines
+  weekday, month, day, clock, year = timestring.split()
+  return local_time_to_epoch((year, month, day), int(year), months[month],
+                             int(day), clock)